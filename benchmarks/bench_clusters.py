@@ -0,0 +1,79 @@
+"""
+Compares the sparse neighbor graph behind `wxdata.extras.st_clusters` against the dense pairwise
+matrix it replaced, on the 2012-04-14 outbreak fixture, and on the same outbreak repeated over
+several days.
+
+    python -m benchmarks.bench_clusters [days] [repeat]
+"""
+import sys
+import timeit
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from geopy.distance import great_circle
+from sklearn.cluster import DBSCAN
+from sklearn.metrics import pairwise_distances
+
+from wxdata import stormevents
+from wxdata.extras.clusters import _neighbors_graph
+from wxdata.stormevents.tornprocessing import discretize
+from wxdata.testing import resource_path
+
+EPS_KM = 60
+EPS_MIN = 60
+MIN_SAMPLES = 15
+
+
+## previous implementation
+
+def _boolean_distance(pt1, pt2, eps_km, eps_min):
+    lat_index = 0
+    lon_index = 1
+    timestamp_sec_index = 2
+    sec_per_min = 60
+    return abs(pt1[timestamp_sec_index] - pt2[timestamp_sec_index]) > eps_min * sec_per_min or \
+           great_circle((pt1[lat_index], pt1[lon_index]), (pt2[lat_index], pt2[lon_index])).km > eps_km
+
+
+def legacy_labels(points, eps_km, eps_min, min_samples):
+    points = points.copy()
+    points['timestamp_sec'] = points.timestamp.astype(np.int64) / 10 ** 9
+    n_jobs = 1 if len(points) < 100 else -1
+    similarity = pairwise_distances(points[['lat', 'lon', 'timestamp_sec']],
+                                    metric=partial(_boolean_distance, eps_km=eps_km, eps_min=eps_min),
+                                    n_jobs=n_jobs)
+
+    db = DBSCAN(eps=0.5, metric='precomputed', min_samples=min_samples)
+    return db.fit_predict(similarity)
+
+
+def sparse_labels(points, eps_km, eps_min, min_samples):
+    times = points.timestamp.values.astype('datetime64[ns]').view(np.int64)
+    neighbors = _neighbors_graph(points.lat.values, points.lon.values, times, eps_km, eps_min)
+    return DBSCAN(eps=1, metric='precomputed', min_samples=min_samples).fit_predict(neighbors)
+
+
+def _time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main(days=3, repeat=3):
+    df = stormevents.load_file(resource_path('120414_tornadoes.csv'))
+    outbreak = discretize(df)
+    outbreak = outbreak[outbreak.lat.notnull() & outbreak.lon.notnull()]
+
+    for numdays in (1, days):
+        points = pd.concat([outbreak.assign(timestamp=outbreak.timestamp + pd.Timedelta(days=day))
+                            for day in range(numdays)], ignore_index=True)
+
+        assert (sparse_labels(points, EPS_KM, EPS_MIN, MIN_SAMPLES) ==
+                legacy_labels(points, EPS_KM, EPS_MIN, MIN_SAMPLES)).all()
+        t_legacy = _time(lambda: legacy_labels(points, EPS_KM, EPS_MIN, MIN_SAMPLES), repeat)
+        t_new = _time(lambda: sparse_labels(points, EPS_KM, EPS_MIN, MIN_SAMPLES), repeat)
+        print('{} day(s), {:>5} points  dense: {:8.3f}s  sparse: {:8.4f}s  ({:.0f}x)'.format(
+            numdays, len(points), t_legacy, t_new, t_legacy / t_new))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,37 @@
+"""
+Compares the memory held by storm event frames loaded with the default and the compact schema,
+and the time to load them through the parsed file cache.
+
+    python -m benchmarks.bench_compact [repeat]
+"""
+import sys
+import tempfile
+import timeit
+
+import pandas as pd
+
+from wxdata import stormevents, workdir
+from wxdata.stormevents.io import _union_categories
+from wxdata.testing import resource_path
+
+_YEARS = (1990, 1991, 1992)
+
+
+def load(files, compact):
+    dfs = [stormevents.load_file(f, compact=compact) for f in files]
+    return pd.concat(_union_categories(dfs), ignore_index=True)
+
+
+def main(repeat=3):
+    workdir.setto(tempfile.mkdtemp())
+    files = [resource_path('StormEvents_details-ftp_v1.0_d{}_c20170717.csv.gz'.format(yr)) for yr in _YEARS]
+
+    for compact in (False, True):
+        df = load(files, compact)
+        t_load = min(timeit.repeat(lambda: load(files, compact), number=1, repeat=repeat))
+        print('{:<8} {} rows  {:7.1f} MB  load: {:.3f}s'.format(
+            'compact' if compact else 'default', len(df), df.memory_usage(deep=True).sum() / 1e6, t_load))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,82 @@
+"""
+Compares `http.saveall` against the previous implementation (a process pool and a fresh
+connection per url), downloading from a local stand-in server that adds a fixed latency
+to every request.
+
+    python -m benchmarks.bench_http [num_files] [file_kb] [latency_ms]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from multiprocessing import Pool
+
+import requests
+
+from wxdata.http import saveall
+
+
+class _SlowHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        SimpleHTTPRequestHandler.do_GET(self)
+
+    def log_message(self, *args):
+        pass
+
+
+def _legacy_save(url, src_dest_map):
+    response = requests.get(url, stream=True)
+    response.raise_for_status()
+    with open(src_dest_map[url], 'wb') as f:
+        response.raw.decode_content = True
+        shutil.copyfileobj(response.raw, f)
+    return os.path.getsize(src_dest_map[url])
+
+
+def legacy_saveall(src_dest_map):
+    with Pool(min(len(src_dest_map), 4)) as pool:
+        return pool.map(partial(_legacy_save, src_dest_map=src_dest_map), src_dest_map.keys())
+
+
+def main(num_files=40, file_kb=256, latency_ms=50):
+    root = tempfile.mkdtemp()
+    served, saved = os.path.join(root, 'served'), os.path.join(root, 'saved')
+    os.makedirs(served)
+    for i in range(num_files):
+        with open(os.path.join(served, 'file{}.bin'.format(i)), 'wb') as f:
+            f.write(os.urandom(file_kb * 1024))
+
+    _SlowHandler.latency = latency_ms / 1000.
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(_SlowHandler, directory=served))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+
+    def run(label, func):
+        shutil.rmtree(saved, ignore_errors=True)
+        os.makedirs(saved)
+        src_dest_map = {'{}/file{}.bin'.format(base_url, i): os.path.join(saved, 'file{}.bin'.format(i))
+                        for i in range(num_files)}
+        t0 = time.time()
+        func(src_dest_map)
+        print('{:<28} {:8.3f}s'.format(label, time.time() - t0))
+
+    print('{} files x {} KB, {} ms latency'.format(num_files, file_kb, latency_ms))
+    try:
+        run('process pool (previous)', legacy_saveall)
+        for workers in (4, 8, 16):
+            run('thread pool, {} workers'.format(workers), partial(saveall, max_workers=workers))
+    finally:
+        server.shutdown()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
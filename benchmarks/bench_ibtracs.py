@@ -0,0 +1,87 @@
+"""
+Compares the typed, cached IBTrACS loader in `wxdata.tcs` against reading the CSV with inferred
+types and stripping every cell, on a synthetic archive in the IBTrACS v03 CSV layout.
+
+    python -m benchmarks.bench_ibtracs [num_storms] [repeat]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+from wxdata import tcs, workdir
+from benchmarks.bench_tcs import synthetic_tracks
+
+_HEADER = ('IBTrACS WMO -- Version: v03r10\n'
+           'Serial_Num,Season,Num,Basin,Sub_basin,Name,ISO_time,Nature,Latitude,Longitude,Wind(WMO),'
+           'Pres(WMO),Center,Wind(WMO) Percentile,Pres(WMO) Percentile,Track_type\n'
+           ' N/A, Year, #, BB, BB, N/A, YYYY-MM-DD HH:MM:SS, N/A, deg_north, deg_east, kt, mb, N/A,'
+           ' %, %, N/A\n')
+
+
+def write_archive(path, num_storms):
+    df = synthetic_tracks(num_storms)
+    rng = np.random.RandomState(1)
+    with open(path, 'w') as f:
+        f.write(_HEADER)
+        for row in df.itertuples():
+            f.write('{}, {}, {:02d}, {}, {}, {:>20} ,{:%Y-%m-%d %H:%M:%S}, {}, {:.2f},{:.2f}, {:5.1f}, {:6.1f},'
+                    '{} , {:9.3f}, {:9.3f},main\n'.format(
+                        row.serial_num, row.season, row.Index % 30, rng.choice(['NA', 'EP', 'WP']),
+                        rng.choice(['MM', 'GM', 'CS']), row.name, row.iso_time, rng.choice(['TS', 'ET', 'NR']),
+                        row.latitude, row.longitude, row.wind, 1010 - row.wind / 2, 'atcf',
+                        rng.uniform(-100, 100), rng.uniform(-100, 100)))
+    return len(df)
+
+
+def legacy_read(path):
+    df = pd.read_csv(path, header=1, parse_dates=['ISO_time'], skiprows=[2])
+    df.columns = [col.replace('(WMO)', '').replace(' ', '_').lower() for col in df.columns]
+
+    df = df.applymap(lambda x: x.strip() if type(x) is str else x)
+    return df
+
+
+def _time(func, repeat, setup=None):
+    def run():
+        if setup is not None:
+            setup()
+        func()
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def _mb(df):
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+def main(num_storms=7000, repeat=3):
+    tmp = tempfile.mkdtemp()
+    try:
+        workdir.setto(tmp)
+        path = os.path.join(tmp, 'Basin.NA.ibtracs_wmo.v03r10.csv')
+        numfixes = write_archive(path, num_storms)
+        cachedir = os.path.join(tmp, '_cache', 'ibtracs')
+        print('{} storms, {} fixes, {:.1f} MB of CSV'.format(num_storms, numfixes, os.path.getsize(path) / 1e6))
+
+        expected = legacy_read(path)
+        df = tcs._read_ibtracs_csv(path)
+        assert_frame_equal(df.astype(expected.dtypes), expected, check_exact=False, rtol=1e-6)
+
+        t_legacy = _time(lambda: legacy_read(path), repeat)
+        t_cold = _time(lambda: tcs._read_ibtracs(path), repeat, setup=lambda: shutil.rmtree(cachedir, True))
+        t_cached = _time(lambda: tcs._read_ibtracs(path), repeat)
+        print('load    inferred + applymap: {:7.3f}s  typed: {:7.3f}s ({:.1f}x)  cached: {:7.3f}s ({:.1f}x)'.format(
+            t_legacy, t_cold, t_legacy / t_cold, t_cached, t_legacy / t_cached))
+        print('memory  inferred + applymap: {:7.1f}MB typed: {:7.1f}MB ({:.1f}x)'.format(
+            _mb(expected), _mb(df), _mb(expected) / _mb(df)))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
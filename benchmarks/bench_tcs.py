@@ -0,0 +1,167 @@
+"""
+Compares the vectorized IBTrACS calculations in `wxdata.tcs` against the previous row-wise
+implementations, on a synthetic track archive.
+
+    python -m benchmarks.bench_tcs [num_storms] [repeat]
+"""
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+from wxdata import tcs
+from wxdata.geog import angle_between, dist_between
+
+
+def synthetic_tracks(num_storms=500, seed=0):
+    # 6-hourly fixes with the odd gap, 3-hourly fix and duplicated time, like the real archive
+    rng = np.random.RandomState(seed)
+    storms = []
+    for i in range(num_storms):
+        numfixes = rng.randint(8, 60)
+        times = pd.Timestamp('1980-01-01') + pd.Timedelta(days=int(rng.randint(0, 365 * 30))) + \
+            pd.to_timedelta(np.cumsum(rng.choice([3, 6, 6, 6, 6, 12, 0], numfixes)), unit='h')
+        storms.append(pd.DataFrame({
+            'serial_num': '{:04d}X{:06d}'.format(1980 + i % 30, i),
+            'season': 1980 + i % 30,
+            'name': 'STORM{}'.format(i),
+            'iso_time': times,
+            'latitude': 10 + np.cumsum(rng.uniform(-0.5, 1.5, numfixes)),
+            'longitude': -40 - np.cumsum(rng.uniform(-1.5, 1.5, numfixes)),
+            'wind': np.clip(np.cumsum(rng.choice([-10, -5, 0, 5, 10, 15, 20], numfixes)) + 25, 15, 185).astype(float),
+        }))
+    df = pd.concat(storms, ignore_index=True)
+    # shuffle the storms' order in the frame but keep each storm's fixes together
+    df = df.sample(frac=1, random_state=rng).sort_values(['serial_num', 'iso_time'], kind='mergesort')
+    return df.reset_index(drop=True)
+
+
+## previous implementations
+
+def legacy_delta(df, quantity, dt='6 hr'):
+    series = {}
+    dt = pd.Timedelta(dt)
+    for _, storm in df.groupby('serial_num'):
+        for index, row in storm.iterrows():
+            current_time = row.iso_time
+            next_time = current_time + dt
+            try:
+                next_row = storm[storm.iso_time == next_time].iloc[0]
+                dquantity = next_row[quantity] - row[quantity]
+                series[index] = dquantity
+            except (IndexError, KeyError):
+                continue
+
+    return pd.Series(series)
+
+
+def legacy_label_ri(df, keep_dwind=False, dwind_col=None):
+    labels = {}
+    if dwind_col is None:
+        df['dwind'] = legacy_delta(df, 'wind', dt='24 hours')
+    else:
+        df['dwind'] = df[dwind_col]
+
+    for _, storm in df.groupby('serial_num'):
+        for index, row in storm.iterrows():
+            if row['dwind'] >= 30.0:
+                init_time = row.iso_time
+                labels[index] = True
+                internal_index = index
+
+                while True:
+                    internal_index += 1
+                    try:
+                        next_row = storm.loc[internal_index]
+                    except KeyError:
+                        break
+                    next_time = next_row.iso_time
+
+                    if next_time > init_time + pd.Timedelta('24 hours'):
+                        labels[next_row.name] = False
+                        break
+                    else:
+                        labels[next_row.name] = True
+            elif index not in labels:
+                labels[index] = False
+
+    if not keep_dwind or (dwind_col is not None and dwind_col != 'dwind'):
+        del df['dwind']
+    return pd.Series(labels)
+
+
+def legacy_heading(df, dt='6 hr', to_xy=True, xy_unit='kt'):
+    points = []
+    dt = pd.Timedelta(dt)
+    for _, storm in df.groupby('serial_num'):
+        for index, row in storm.iterrows():
+            current_time = row.iso_time
+            result = {}
+            this_row = row
+            try:
+                next_time = current_time + dt
+                next_row = storm[storm.iso_time == next_time].iloc[0]
+            except IndexError:
+                # we don't have a position at that hour. Maybe we've reached the end?
+                continue
+
+            this_point = (this_row.latitude, this_row.longitude)
+            next_point = (next_row.latitude, next_row.longitude)
+
+            result['angle'] = angle_between(this_point, next_point)
+            result['dist'] = dist_between(this_point, next_point)
+            result['name'] = row['name']
+            result['season'] = row['season']
+            result['iso_time'] = row.iso_time
+            result['serial_num'] = row.serial_num
+
+            points.append(result)
+
+    ret = pd.DataFrame(points)
+
+    if to_xy:
+        ret['x'] = ret['dist'] * np.cos(ret['angle'])
+        ret['y'] = ret['dist'] * np.sin(ret['angle'])
+
+        if xy_unit == 'kt':
+            ret['x'] = ret.x * 0.54 / (dt.total_seconds() / 3600)
+            ret['y'] = ret.y * 0.54 / (dt.total_seconds() / 3600)
+
+    return ret
+
+
+def _time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main(num_storms=500, repeat=3):
+    df = synthetic_tracks(num_storms)
+    print('{} storms, {} fixes'.format(num_storms, len(df)))
+
+    for dt in ('6 hr', '24 hr'):
+        expected = legacy_delta(df, 'wind', dt)
+        assert tcs.delta(df, 'wind', dt).equals(expected)
+        t_legacy = _time(lambda: legacy_delta(df, 'wind', dt), repeat)
+        t_new = _time(lambda: tcs.delta(df, 'wind', dt), repeat)
+        print('delta {:<6} row-wise: {:8.3f}s  vectorized: {:8.4f}s  ({:.0f}x)'.format(
+            dt, t_legacy, t_new, t_legacy / t_new))
+
+    df['dwind'] = tcs.delta(df, 'wind', '24 hr')
+    assert tcs.label_ri(df, dwind_col='dwind', keep_dwind=True).equals(
+        legacy_label_ri(df, dwind_col='dwind', keep_dwind=True))
+    t_legacy = _time(lambda: legacy_label_ri(df, dwind_col='dwind', keep_dwind=True), repeat)
+    t_new = _time(lambda: tcs.label_ri(df, dwind_col='dwind', keep_dwind=True), repeat)
+    print('label_ri      row-wise: {:8.3f}s  vectorized: {:8.4f}s  ({:.0f}x)'.format(
+        t_legacy, t_new, t_legacy / t_new))
+
+    assert_frame_equal(tcs.heading(df), legacy_heading(df))
+    t_legacy = _time(lambda: legacy_heading(df), repeat)
+    t_new = _time(lambda: tcs.heading(df), repeat)
+    print('heading       row-wise: {:8.3f}s  vectorized: {:8.4f}s  ({:.0f}x)'.format(
+        t_legacy, t_new, t_legacy / t_new))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,111 @@
+"""
+Compares the row-wise and columnar timezone conversion of storm event frames, and the
+per-row timezone string lookups with and without the memoized resolution tables, and the
+cost of localizing timestamps while loading and of re-deriving the date/time fields.
+
+    python -m benchmarks.bench_temporal [repeat]
+"""
+import sys
+import tempfile
+import timeit
+
+import pandas as pd
+
+from wxdata import stormevents, workdir, _timezones as _tzhelp
+from wxdata.stormevents.temporal import (convert_col_tz, convert_row_tz, convert_timestamp_tz,
+                                         sync_datetime_fields, _pdtz_from_str, _tz_offsets)
+from wxdata.testing import resource_path
+
+_YEARS = (1990, 1991, 1992)
+
+
+def load_sample():
+    files = [resource_path('StormEvents_details-ftp_v1.0_d{}_c20170717.csv.gz'.format(yr))
+             for yr in _YEARS]
+    return pd.concat([stormevents.load_file(f) for f in files], ignore_index=True)
+
+
+def rowwise(df, col, to_tz):
+    return df.apply(lambda row: convert_row_tz(row, col, to_tz), axis=1)
+
+
+def unmemoized_lookups(cz_timezones):
+    # what every row paid before: a pytz lookup, falling back to our own table
+    for tz_str in cz_timezones:
+        try:
+            _tzhelp.parse_tz.__wrapped__(tz_str)
+        except ValueError:
+            pass
+
+
+def memoized_lookups(cz_timezones):
+    for tz_str in cz_timezones:
+        try:
+            _pdtz_from_str(tz_str)
+        except ValueError:
+            pass
+
+
+def rowwise_localize(df):
+    # what `load_file(..., tz_localize=True)` did before
+    for col in ('begin_date_time', 'end_date_time'):
+        df[col] = df.apply(lambda r: convert_timestamp_tz(r[col], 'UTC', r.cz_timezone), axis=1)
+    return df
+
+
+def strftime_sync(df):
+    # `sync_datetime_fields` as it was, formatting every row with strftime
+    for prefix in ('begin', 'end'):
+        dts = df['{}_date_time'.format(prefix)].dt
+        df['{}_yearmonth'.format(prefix)] = dts.strftime('%Y%m')
+        df['{}_time'.format(prefix)] = dts.strftime('%H%M')
+        df['{}_day'.format(prefix)] = dts.day
+    df['year'] = df.begin_date_time.dt.year
+    df['month_name'] = df.begin_date_time.dt.strftime('%B')
+    return df
+
+
+def main(repeat=3):
+    df = load_sample()
+    print('{} rows'.format(len(df)))
+
+    for to_tz in ('GMT', 'CST'):
+        assert rowwise(df, 'begin_date_time', to_tz).equals(convert_col_tz(df, 'begin_date_time', to_tz))
+
+        t_row = min(timeit.repeat(lambda: rowwise(df, 'begin_date_time', to_tz), number=1, repeat=repeat))
+        t_col = min(timeit.repeat(lambda: convert_col_tz(df, 'begin_date_time', to_tz), number=1, repeat=repeat))
+        print('to {:<4} row-wise: {:8.3f}s  columnar: {:8.4f}s  ({:.0f}x)'.format(
+            to_tz, t_row, t_col, t_row / t_col))
+
+    converted = df.assign(**{col: convert_col_tz(df, col, 'CST') for col in ('begin_date_time', 'end_date_time')})
+    t_strftime = min(timeit.repeat(lambda: strftime_sync(converted.copy()), number=1, repeat=repeat))
+    t_sync = min(timeit.repeat(lambda: sync_datetime_fields(converted.copy()), number=1, repeat=repeat))
+    print('sync fields  strftime: {:8.3f}s  integer components: {:8.4f}s  ({:.0f}x)'.format(
+        t_strftime, t_sync, t_strftime / t_sync))
+
+    tzs = df.cz_timezone.tolist()
+    t_plain = min(timeit.repeat(lambda: unmemoized_lookups(tzs), number=1, repeat=repeat))
+    t_memo = min(timeit.repeat(lambda: memoized_lookups(tzs), number=1, repeat=repeat))
+    t_offsets = min(timeit.repeat(lambda: _tz_offsets(tzs), number=1, repeat=repeat))
+    print('tz lookups  unmemoized: {:8.3f}s  memoized: {:8.4f}s  offsets table: {:8.4f}s'.format(
+        t_plain, t_memo, t_offsets))
+    print('cache misses  _pdtz_from_str: {}  parse_tz: {}  utc_offset_minutes: {}'.format(
+        _pdtz_from_str.cache_info()['misses'], _tzhelp.parse_tz.cache_info()['misses'],
+        _tzhelp.utc_offset_minutes.cache_info()['misses']))
+
+    # load through the parquet cache so that reading doesn't swamp the localization
+    workdir.setto(tempfile.mkdtemp())
+    files = [resource_path('StormEvents_details-ftp_v1.0_d{}_c20170717.csv.gz'.format(yr)) for yr in _YEARS]
+    for f in files:
+        stormevents.load_file(f)
+    t_plain = min(timeit.repeat(lambda: [stormevents.load_file(f) for f in files], number=1, repeat=repeat))
+    t_local = min(timeit.repeat(lambda: [stormevents.load_file(f, tz_localize=True) for f in files],
+                                number=1, repeat=repeat))
+    t_rowwise = min(timeit.repeat(lambda: [rowwise_localize(stormevents.load_file(f)) for f in files],
+                                  number=1, repeat=repeat))
+    print('load_file  plain: {:.3f}s  tz_localize: {:.3f}s ({:.1f}x plain)  (row-wise tz_localize: {:.3f}s)'.format(
+        t_plain, t_local, t_local / t_plain, t_rowwise))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,87 @@
+"""
+Compares the batched tornado processing in `wxdata.stormevents.tornprocessing` against the
+previous per-tornado implementations, on the 1990-1992 tornadoes repeated over a dozen years.
+
+    python -m benchmarks.bench_tornprocessing [copies] [repeat]
+"""
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+from wxdata import stormevents
+from wxdata.stormevents.temporal import sync_datetime_fields
+from wxdata.stormevents.tornprocessing import (correct_tornado_times, discretize, discretize_tor,
+                                               _corrected_times, _corrected_times_for)
+from wxdata.testing import resource_path
+
+_YEARS = (1990, 1991, 1992)
+
+
+def load_tornadoes(copies=4):
+    files = [resource_path('StormEvents_details-ftp_v1.0_d{}_c20170717.csv.gz'.format(yr))
+             for yr in _YEARS]
+    df = pd.concat([stormevents.load_file(f, eventtypes=['Tornado']) for f in files], ignore_index=True)
+    df = df[~df.cz_timezone.isin(['UNK', 'SCT', 'CSC'])]
+
+    # each copy shifted by another three years, with its own event ids
+    shifted = []
+    for copy in range(copies):
+        offset = pd.DateOffset(years=len(_YEARS) * copy)
+        shifted.append(df.assign(begin_date_time=df.begin_date_time + offset,
+                                 end_date_time=df.end_date_time + offset,
+                                 event_id=df.event_id + copy * 10 ** 7))
+    return pd.concat(shifted, ignore_index=True)
+
+
+## previous implementations
+
+def legacy_discretize(df, spacing_min=1):
+    foreachtor = [discretize_tor(tor, spacing_min) for _, tor in df.iterrows()]
+    return pd.concat(foreachtor, ignore_index=True)
+
+
+def legacy_correct_tornado_times(df, copy=True):
+    if copy:
+        df = df.copy()
+    vals = df[['event_type', 'begin_date_time', 'end_date_time', 'tor_length']].values
+
+    df[['begin_date_time', 'end_date_time']] = np.apply_along_axis(_corrected_times_for,
+                                                                   axis=1, arr=vals)
+    return sync_datetime_fields(df)
+
+
+def _time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main(copies=4, repeat=3):
+    df = load_tornadoes(copies)
+    print('{} tornadoes'.format(len(df)))
+
+    valid = df[df.end_date_time >= df.begin_date_time]
+    assert_frame_equal(discretize(valid), legacy_discretize(valid))
+    t_legacy = _time(lambda: legacy_discretize(valid), repeat)
+    t_new = _time(lambda: discretize(valid), repeat)
+    print('discretize  per-tornado: {:8.3f}s  batched: {:8.4f}s  ({:.0f}x)'.format(
+        t_legacy, t_new, t_legacy / t_new))
+
+    assert_frame_equal(correct_tornado_times(df), legacy_correct_tornado_times(df))
+    t_legacy = _time(lambda: legacy_correct_tornado_times(df), repeat)
+    t_new = _time(lambda: correct_tornado_times(df), repeat)
+    print('correct_tornado_times  per-tornado: {:8.3f}s  masks: {:8.4f}s  ({:.1f}x)'.format(
+        t_legacy, t_new, t_legacy / t_new))
+
+    # without re-deriving the date and time fields, which the two share
+    vals = df[['event_type', 'begin_date_time', 'end_date_time', 'tor_length']].values
+    t_legacy = _time(lambda: np.apply_along_axis(_corrected_times_for, axis=1, arr=vals), repeat)
+    t_new = _time(lambda: _corrected_times(df.event_type, df.begin_date_time, df.end_date_time,
+                                           df.tor_length), repeat)
+    print('  time rules only      per-tornado: {:8.3f}s  masks: {:8.4f}s  ({:.0f}x)'.format(
+        t_legacy, t_new, t_legacy / t_new))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,6 +1,57 @@
+import threading
+from functools import wraps
+
 import pytz
 import six
 
+_MISSING = object()
+
+
+def _memoized(resolve):
+    # Memoizes a resolver of tz strings, including the ValueError raised for strings that can't
+    # be resolved. Only a few dozen distinct strings show up in practice so the table stays small;
+    # `cache_info()` gives its hit/miss counts.
+    table = {}
+    stats = {'hits': 0, 'misses': 0}
+    lock = threading.Lock()
+
+    @wraps(resolve)
+    def wrapped(tz_str):
+        try:
+            resolved = table.get(tz_str, _MISSING)
+        except TypeError:
+            # unhashable, nothing to memoize on
+            return resolve(tz_str)
+
+        if resolved is _MISSING:
+            with lock:
+                stats['misses'] += 1
+            try:
+                resolved = resolve(tz_str)
+            except ValueError as e:
+                resolved = e
+            table[tz_str] = resolved
+        else:
+            with lock:
+                stats['hits'] += 1
+
+        if isinstance(resolved, ValueError):
+            raise type(resolved)(*resolved.args)
+        return resolved
+
+    def cache_info():
+        with lock:
+            return dict(stats, size=len(table))
+
+    def cache_clear():
+        with lock:
+            table.clear()
+            stats.update(hits=0, misses=0)
+
+    wrapped.cache_info = cache_info
+    wrapped.cache_clear = cache_clear
+    return wrapped
+
 
 class TimeZone(object):
     @classmethod
@@ -114,6 +165,7 @@ def get_tz_info(abbrev):
     return _timezone_map[tz_str]
 
 
+@_memoized
 def parse_tz(tz_str):
     if tz_str is None:
         return get_tz_info(tz_str).to_pytz()
@@ -125,6 +177,42 @@ def parse_tz(tz_str):
         return get_tz_info(tz_str).to_pytz()
 
 
+def utc_offset_minutes(tz_str):
+    # Fixed UTC offset of `tz_str` in minutes, or None if it doesn't have one. Strings
+    # outside `STORMEVENTS_TZ_OFFSETS` are resolved once and cached (see `cache_info()`).
+    try:
+        return STORMEVENTS_TZ_OFFSETS[tz_str]
+    except (KeyError, TypeError):
+        return _utc_offset_minutes(tz_str)
+
+
+@_memoized
+def _utc_offset_minutes(tz_str):
+    try:
+        offset = parse_tz(tz_str).utcoffset(None)
+    except ValueError:
+        return None
+    if offset is None:
+        return None
+    return int(offset.total_seconds()) // 60
+
+
+# UTC offsets in minutes of every `cz_timezone` string found in StormEvents, or None for those
+# without a fixed one. The offsets are the ones `parse_tz` resolves to, so that every code path
+# agrees on them: bare EST, MST and HST are the pytz zones (Panama, Phoenix, Honolulu) with
+# their own DST and LMT history, not fixed offsets. The typos (SCT, CSC) and UNK can't be
+# resolved from the string alone. Note that older data logs both Alaska and Puerto Rico as AST;
+# the -4h here is only right for the latter.
+STORMEVENTS_TZ_OFFSETS = {tz_str: _utc_offset_minutes(tz_str)
+                          for tz_str in list(_timezone_map) + ['CSt', 'ESt']}
+STORMEVENTS_TZ_OFFSETS.update({'SCT': None, 'CSC': None, 'UNK': None})
+_utc_offset_minutes.cache_clear()
+
+
+utc_offset_minutes.cache_info = _utc_offset_minutes.cache_info
+utc_offset_minutes.cache_clear = _utc_offset_minutes.cache_clear
+
+
 def utc_offset_no_dst(tz_str, as_of=None):
     try:
         from datetime import datetime, timedelta
@@ -0,0 +1,173 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+# Thread-safe in-memory cache of at most `maxsize` entries; the least recently used
+# entry is evicted first.
+class LRUCache(object):
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return default
+
+            # move to the most recently used end
+            del self._entries[key]
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, expires=None):
+        if expires is None and self.ttl is not None:
+            expires = time.time() + self.ttl
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+# On-disk cache of pickled values in an SQLite database, safe to share between threads
+# and processes. At most `max_entries` are kept, the least recently used evicted first.
+class SQLiteCache(object):
+    def __init__(self, path, max_entries=None, ttl=None, timeout=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._timeout = timeout
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                         'key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+
+    def _connection(self):
+        # sqlite connections can't cross threads or forks, so keep one per thread and process
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self._timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, default=None, touch=True):
+        # returns a (value, expires) pair; with `touch` off the read doesn't write the database,
+        # and the entry keeps its place in the eviction order
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return default
+
+            value, expires = row
+            if expires is not None and expires < now:
+                conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                return default
+
+            if touch:
+                conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(value), expires
+
+    def set(self, key, value):
+        now = time.time()
+        expires = now + self.ttl if self.ttl is not None else None
+        blob = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                         (key, blob, expires, now))
+            if self.max_entries is not None:
+                conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC '
+                             'LIMIT -1 OFFSET ?)', (self.max_entries,))
+        return expires
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache')
+
+    def __len__(self):
+        with self._connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+# An in-process LRUCache in front of an SQLiteCache, counting hits on either tier and misses.
+# A disk hit is only promoted into memory, so the disk tier evicts in the order entries were set.
+class TieredCache(object):
+    def __init__(self, path, maxsize=128, max_entries=None, ttl=None):
+        self.memory = LRUCache(maxsize, ttl)
+        self.disk = SQLiteCache(path, max_entries, ttl)
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count('memory_hits')
+            return value
+
+        entry = self.disk.get(key, touch=False)
+        if entry is not None:
+            value, expires = entry
+            self.memory.set(key, value, expires)
+            self._count('disk_hits')
+            return value
+
+        self._count('misses')
+        return default
+
+    def set(self, key, value):
+        expires = self.disk.set(key, value)
+        self.memory.set(key, value, expires)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path, **cache_kw):
+    # one TieredCache per database, shared by everything in this process using it
+    path = os.path.abspath(path)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = TieredCache(path, **cache_kw)
+        return _caches[path]
@@ -1,26 +1,32 @@
 from __future__ import division
 
-from functools import partial
+import heapq
 
 import numpy as np
 import pandas as pd
 import matplotlib.patheffects as path_effects
 import six
-from geopy.distance import great_circle
+from geopy.distance import EARTH_RADIUS, great_circle
 from pandas.util.testing import assert_frame_equal
+from scipy.sparse import csr_matrix
 from sklearn.cluster import DBSCAN
-from sklearn.metrics import pairwise_distances
+from sklearn.neighbors import BallTree
 
+from wxdata.geog import dists_between
 from wxdata.plotting import plot_points, sample_colors
 from wxdata.stormevents import time_partition
+from wxdata.stormevents.operations import EventIndex, fatality_totals
 from wxdata.stormevents.tornprocessing import discretize, ef, longevity
 
-__all__ = ['st_clusters', 'plot_clusters', 'assert_clusters_equal', 'timebucketed_clusters']
+__all__ = ['st_clusters', 'plot_clusters', 'assert_clusters_equal', 'timebucketed_clusters',
+           'StreamingClusters']
 
 NOISE_LABEL = -1
 
 
-def st_clusters(events, eps_km, eps_min, min_samples, algorithm=None):
+def st_clusters(events, eps_km, eps_min, min_samples, algorithm=None, locations=None, fatalities=None):
+    # `locations` makes the tornadoes follow their multi-point paths, and `fatalities` has
+    # `tor_stats` count fatalities from the fatalities table rather than the events' deaths.
     assert min_samples > 0
 
     if events.empty:
@@ -29,37 +35,65 @@ def st_clusters(events, eps_km, eps_min, min_samples, algorithm=None):
     if algorithm == 'brute':
         cluster_dict = _brute_st_clusters(events, eps_km, eps_min, min_samples)
     else:
-        points = discretize(events)
+        points = discretize(events, locations=locations)
         points = points[(~points.lon.isnull()) & (~points.lat.isnull())]
 
         if points.empty:
             return ClusterGroup.empty()
 
-        points['timestamp_sec'] = points.timestamp.astype(np.int64) / 10 ** 9
-        n_jobs = 1 if len(points) < 100 else -1
-        similarity = pairwise_distances(points[['lat', 'lon', 'timestamp_sec']],
-                                        metric=partial(_boolean_distance, eps_km=eps_km, eps_min=eps_min),
-                                        n_jobs=n_jobs)
+        times = points.timestamp.values.astype('datetime64[ns]').view(np.int64)
+        neighbors = _neighbors_graph(points.lat.values, points.lon.values, times, eps_km, eps_min)
 
-        db = DBSCAN(eps=0.5, metric='precomputed', min_samples=min_samples)
-        cluster_labels = db.fit_predict(similarity)
+        # the stored entries of the graph are the neighbors, so any eps >= 1 will do
+        db = DBSCAN(eps=1, metric='precomputed', min_samples=min_samples)
+        cluster_labels = db.fit_predict(neighbors)
 
-        points.drop('timestamp_sec', axis=1, inplace=True)
         points['cluster'] = cluster_labels
 
-        cluster_dict = {label: Cluster(label, points[points.cluster == label], events)
+        event_stats = _tor_event_stats(events, fatalities)
+        cluster_dict = {label: Cluster(label, points[points.cluster == label], events, event_stats)
                         for label in points.cluster.unique()}
 
     return ClusterGroup(cluster_dict)
 
 
-def _boolean_distance(pt1, pt2, eps_km, eps_min):
-    lat_index = 0
-    lon_index = 1
-    timestamp_sec_index = 2
-    sec_per_min = 60
-    return abs(pt1[timestamp_sec_index] - pt2[timestamp_sec_index]) > eps_min * sec_per_min or \
-           great_circle((pt1[lat_index], pt1[lon_index]), (pt2[lat_index], pt2[lon_index])).km > eps_km
+def _neighbors_graph(lats, lons, times, eps_km, eps_min):
+    # Sparse graph of the pairs of points within `eps_km` and `eps_min` of each other (each
+    # point included). The points are swept in time order, `eps_min` at a time, and each block
+    # is queried against a haversine BallTree of the points within `eps_min` of it.
+    numpoints = len(lats)
+    eps_ns = int(eps_min * 60 * 10 ** 9)
+    # a hair wider than eps_km; the exact great circle distance is checked afterwards
+    radius = eps_km / EARTH_RADIUS * (1 + 1e-9)
+
+    order = np.argsort(times, kind='mergesort')
+    sorted_times = times[order]
+    sorted_lats = lats[order]
+    sorted_lons = lons[order]
+    coords = np.radians(np.column_stack([sorted_lats, sorted_lons]))
+
+    rows, cols = [], []
+    lo = 0
+    while lo < numpoints:
+        hi = np.searchsorted(sorted_times, sorted_times[lo] + eps_ns, side='right')
+        cand_lo = np.searchsorted(sorted_times, sorted_times[lo] - eps_ns, side='left')
+        cand_hi = np.searchsorted(sorted_times, sorted_times[hi - 1] + eps_ns, side='right')
+
+        tree = BallTree(coords[cand_lo:cand_hi], metric='haversine')
+        found = tree.query_radius(coords[lo:hi], radius)
+        block_rows = np.repeat(np.arange(lo, hi), [len(f) for f in found])
+        block_cols = np.concatenate(found) + cand_lo
+
+        near = (np.abs(sorted_times[block_rows] - sorted_times[block_cols]) <= eps_ns) & \
+               (dists_between(sorted_lats[block_rows], sorted_lons[block_rows],
+                              sorted_lats[block_cols], sorted_lons[block_cols]) <= eps_km)
+        rows.append(block_rows[near])
+        cols.append(block_cols[near])
+        lo = hi
+
+    rows = order[np.concatenate(rows)]
+    cols = order[np.concatenate(cols)]
+    return csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(numpoints, numpoints))
 
 
 def timebucketed_clusters(events, timebuckets, remove_empty=False, **cluster_kw):
@@ -71,6 +105,244 @@ def timebucketed_clusters(events, timebuckets, remove_empty=False, **cluster_kw)
     return ret
 
 
+## streaming clustering
+
+
+class StreamingClusters(object):
+    # Incremental version of `st_clusters` for events arriving in time order. Points of the
+    # ingested segments are kept for `window_min` minutes (`eps_min` by default) after the
+    # latest segment began; `snapshot` gives the ClusterGroup that `st_clusters`' DBSCAN would
+    # find over the points still in the window.
+    #
+    # Neighbors are found through a grid of eps_km cells, and clusters of core points are
+    # merged with a union-find as points arrive. Expired core points may split a cluster,
+    # so the clusters that lost any are rebuilt at the end of each `update`.
+
+    def __init__(self, eps_km, eps_min, min_samples, window_min=None):
+        assert min_samples > 0
+
+        self.eps_km = eps_km
+        self.eps_min = eps_min
+        self.min_samples = min_samples
+        self.window_min = eps_min if window_min is None else window_min
+
+        self._eps_ns = int(eps_min * 60 * 10 ** 9)
+        self._cell_deg = np.degrees(eps_km / EARTH_RADIUS)
+        self._next_id = 0
+        self._now = None
+
+        # per point: (lat, lon, timestamp ns, timestamp, event_id)
+        self._points = {}
+        self._neighbors = {}
+        self._cells = {}
+        self._expiry = []
+        self._events = {}
+        self._event_counts = {}
+
+        # union-find over the core points
+        self._parent = {}
+        self._members = {}
+        self._dirty = set()
+        self._removed = set()
+
+    def __len__(self):
+        return len(self._points)
+
+    def update(self, events, now=None):
+        # `now` defaults to the latest beginning of a segment seen so far
+        if now is not None:
+            now = pd.Timestamp(now).value
+
+        if not events.empty:
+            points = discretize(events)
+            points = points[(~points.lon.isnull()) & (~points.lat.isnull())]
+            times = points.timestamp.values.astype('datetime64[ns]').view(np.int64)
+
+            if now is None and len(points):
+                now = pd.Series(times).groupby(points.event_id.values).min().max()
+            self._advance(now)
+
+            for event_id, event in events.groupby('event_id', sort=False):
+                self._events[event_id] = event
+            for lat, lon, time, timestamp, event_id in zip(points.lat.values, points.lon.values, times,
+                                                           points.timestamp, points.event_id.values):
+                self._add(lat, lon, time, timestamp, event_id)
+        else:
+            self._advance(now)
+
+        self._expire()
+        self._rebuild_dirty()
+
+    def snapshot(self):
+        if not self._points:
+            return ClusterGroup.empty()
+
+        ids = sorted(self._points)
+        roots = {i: self._find(i) for i in self._parent}
+
+        # DBSCAN numbers clusters in the order of their first core point, and a border point
+        # joins the first numbered cluster that reaches it
+        root_labels = {}
+        for i in ids:
+            if i in roots and roots[i] not in root_labels:
+                root_labels[roots[i]] = len(root_labels)
+
+        labels = []
+        for i in ids:
+            if i in roots:
+                labels.append(root_labels[roots[i]])
+            else:
+                core_labels = [root_labels[roots[j]] for j in self._neighbors[i] if j in roots]
+                labels.append(min(core_labels) if core_labels else NOISE_LABEL)
+
+        points = pd.DataFrame({
+            'lat': [self._points[i][0] for i in ids],
+            'lon': [self._points[i][1] for i in ids],
+            'event_id': [self._points[i][4] for i in ids],
+            'timestamp': [self._points[i][3] for i in ids]
+        }, columns=['lat', 'lon', 'event_id', 'timestamp'])
+        points['timestamp'] = pd.DatetimeIndex(points.timestamp)
+        points['cluster'] = labels
+
+        events = pd.concat(list(self._events.values()))
+        return ClusterGroup({label: Cluster(label, points[points.cluster == label], events)
+                             for label in points.cluster.unique()})
+
+    def _add(self, lat, lon, time, timestamp, event_id):
+        if self._now is not None and time < self._now - self._window_ns():
+            return
+
+        point_id = self._next_id
+        self._next_id += 1
+
+        neighbors = set()
+        candidates = [j for cell in self._nearby_cells(lat, lon) for j in self._cells.get(cell, ())]
+        if candidates:
+            cand_lats = np.array([self._points[j][0] for j in candidates])
+            cand_lons = np.array([self._points[j][1] for j in candidates])
+            cand_times = np.array([self._points[j][2] for j in candidates])
+            near = (np.abs(cand_times - time) <= self._eps_ns) & \
+                   (dists_between(lat, lon, cand_lats, cand_lons) <= self.eps_km)
+            neighbors = {j for j, is_near in zip(candidates, near) if is_near}
+
+        self._points[point_id] = (lat, lon, time, timestamp, event_id)
+        self._neighbors[point_id] = neighbors
+        self._cells.setdefault(self._cell(lat, lon), set()).add(point_id)
+        heapq.heappush(self._expiry, (time, point_id))
+        self._event_counts[event_id] = self._event_counts.get(event_id, 0) + 1
+
+        new_cores = []
+        for j in neighbors:
+            self._neighbors[j].add(point_id)
+            if j not in self._parent and self._is_core(j):
+                new_cores.append(j)
+        if self._is_core(point_id):
+            new_cores.append(point_id)
+
+        for j in new_cores:
+            self._parent[j] = j
+            self._members[j] = {j}
+        for j in new_cores:
+            for k in self._neighbors[j]:
+                if k in self._parent:
+                    self._union(j, k)
+
+    def _expire(self):
+        if self._now is None:
+            return
+
+        oldest = self._now - self._window_ns()
+        while self._expiry and self._expiry[0][0] < oldest:
+            _, point_id = heapq.heappop(self._expiry)
+            lat, lon, _, _, event_id = self._points.pop(point_id)
+            cell = self._cell(lat, lon)
+            self._cells[cell].discard(point_id)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+            if point_id in self._parent:
+                self._uncore(point_id)
+            for j in self._neighbors.pop(point_id):
+                self._neighbors[j].discard(point_id)
+                if j in self._parent and not self._is_core(j):
+                    self._uncore(j)
+
+            self._event_counts[event_id] -= 1
+            if not self._event_counts[event_id]:
+                del self._event_counts[event_id]
+                del self._events[event_id]
+
+    def _uncore(self, point_id):
+        # The point's entry stays in `_parent` until its cluster is rebuilt, since other
+        # points may lead to the root through it.
+        root = self._find(point_id)
+        self._members[root].discard(point_id)
+        self._dirty.add(root)
+        self._removed.add(point_id)
+
+    def _rebuild_dirty(self):
+        if not self._dirty:
+            return
+
+        remaining = set()
+        for root in self._dirty:
+            remaining.update(self._members.pop(root))
+        for point_id in remaining | self._removed:
+            del self._parent[point_id]
+        self._dirty = set()
+        self._removed = set()
+
+        for point_id in remaining:
+            self._parent[point_id] = point_id
+            self._members[point_id] = {point_id}
+        for point_id in remaining:
+            for j in self._neighbors[point_id]:
+                if j in self._parent:
+                    self._union(point_id, j)
+
+    def _is_core(self, point_id):
+        # DBSCAN counts the point itself
+        return len(self._neighbors[point_id]) + 1 >= self.min_samples
+
+    def _find(self, point_id):
+        root = point_id
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[point_id] != root:
+            self._parent[point_id], point_id = root, self._parent[point_id]
+        return root
+
+    def _union(self, i, j):
+        root_i, root_j = self._find(i), self._find(j)
+        if root_i == root_j:
+            return
+        if len(self._members[root_i]) < len(self._members[root_j]):
+            root_i, root_j = root_j, root_i
+
+        self._parent[root_j] = root_i
+        self._members[root_i].update(self._members.pop(root_j))
+        if root_j in self._dirty:
+            self._dirty.discard(root_j)
+            self._dirty.add(root_i)
+
+    def _advance(self, now):
+        if now is not None:
+            self._now = now if self._now is None else max(self._now, now)
+
+    def _window_ns(self):
+        return int(self.window_min * 60 * 10 ** 9)
+
+    def _cell(self, lat, lon):
+        return int(np.floor(lat / self._cell_deg)), int(np.floor(lon / self._cell_deg))
+
+    def _nearby_cells(self, lat, lon):
+        # a cell spans eps_km in latitude, but fewer km in longitude away from the equator
+        row, col = self._cell(lat, lon)
+        max_lat = min(abs(lat) + self._cell_deg, 89.)
+        lon_cells = int(np.ceil(1. / np.cos(np.radians(max_lat))))
+        return [(r, c) for r in range(row - 1, row + 2) for c in range(col - lon_cells, col + lon_cells + 1)]
+
+
 ## brute force clustering algorithm
 
 
@@ -195,10 +467,11 @@ class Cluster(object):
     def _empty_cluster(cls):
         return cls(NOISE_LABEL, pd.DataFrame(columns=['lat', 'lon', 'timestamp']), None)
 
-    def __init__(self, cluster_num, cluster_pts, parent):
+    def __init__(self, cluster_num, cluster_pts, parent, event_stats=None):
         self._index = cluster_num
         self._points = cluster_pts
         self._parent = parent
+        self._event_stats = event_stats
 
     @property
     def index(self):
@@ -293,17 +566,19 @@ class Cluster(object):
         if self._parent is None:
             raise NotImplementedError("Cannot output tornado stats for empty cluster")
 
-        all_events = self.events
-        tor_events = all_events[all_events.event_type == 'Tornado']
-        tor_ef = ef(tor_events)
-        tor_longevity = longevity(tor_events)
+        if self._event_stats is not None:
+            event_ids = self._points[self._points.cluster == self._index].event_id.unique()
+            tor_events = self._event_stats.table.iloc[self._event_stats.rows(event_ids)[0]]
+        else:
+            tor_events = _tor_event_stats(self.events).table
 
-        ret = {'ef{}'.format(i): tor_ef[tor_ef == i].count() for i in range(0, 6)}
-        ret['ef?'] = tor_ef[tor_ef.isnull()].count()
+        tor_ef = tor_events.ef.values
+        ret = {'ef{}'.format(i): int((tor_ef == i).sum()) for i in range(0, 6)}
+        ret['ef?'] = int(np.isnan(tor_ef).sum())
         ret['segments'] = len(tor_events)
-        ret['total_time'] = tor_longevity.sum()
-        ret['fatalities'] = tor_events.deaths_direct.sum()
-        ret['injuries'] = tor_events.injuries_direct.sum()
+        ret['total_time'] = tor_events.longevity.sum()
+        ret['fatalities'] = tor_events.fatalities.sum()
+        ret['injuries'] = tor_events.injuries.sum()
 
         return ret
 
@@ -322,6 +597,24 @@ class Cluster(object):
 
 ## utilities
 
+def _tor_event_stats(events, fatalities=None):
+    # The per-tornado figures `Cluster.tor_stats` adds up, computed once for all the clusters
+    # of `events` and indexed by event id.
+    tor_events = events[events.event_type == 'Tornado']
+    stats = pd.DataFrame({
+        'event_id': tor_events.event_id.values,
+        'ef': ef(tor_events).values,
+        'longevity': longevity(tor_events).values,
+        'fatalities': tor_events.deaths_direct.values,
+        'injuries': tor_events.injuries_direct.values
+    }, columns=['event_id', 'ef', 'longevity', 'fatalities', 'injuries'])
+
+    if fatalities is not None:
+        direct = fatality_totals(fatalities).fatalities_direct
+        stats['fatalities'] = direct.reindex(stats.event_id.values).fillna(0).astype(np.int64).values
+    return EventIndex(stats)
+
+
 def assert_clusters_equal(clust1, clust2):
     clust1_pts = clust1.pts.copy()
     clust2_pts = clust2.pts.copy()
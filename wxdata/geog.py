@@ -2,6 +2,8 @@ import geopy
 import geopy.distance
 import math
 
+import numpy as np
+
 from wxdata.utils import persistent_cache
 
 
@@ -49,4 +51,33 @@ def angle_between(pt1, pt2):
 
 
 def dist_between(pt1, pt2):
-    return geopy.distance.great_circle(pt1, pt2).km
\ No newline at end of file
+    return geopy.distance.great_circle(pt1, pt2).km
+
+
+# Array versions of `angle_between` and `dist_between`, taking the latitudes and longitudes
+# of both ends as arrays (or scalars) in degrees.
+
+def angles_between(lats1, lons1, lats2, lons2):
+    lat1 = np.radians(lats1)
+    lat2 = np.radians(lats2)
+    difflong = np.radians(np.subtract(lons2, lons1))
+
+    x = np.sin(difflong) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - (np.sin(lat1) * np.cos(lat2) * np.cos(difflong))
+    return np.arctan2(y, x)
+
+
+def dists_between(lats1, lons1, lats2, lons2, radius=geopy.distance.EARTH_RADIUS):
+    # great circle distance in km, with the same formula and earth radius as geopy
+    lat1 = np.radians(lats1)
+    lat2 = np.radians(lats2)
+    difflong = np.radians(np.subtract(lons2, lons1))
+
+    sin_lat1, cos_lat1 = np.sin(lat1), np.cos(lat1)
+    sin_lat2, cos_lat2 = np.sin(lat2), np.cos(lat2)
+    sin_difflong, cos_difflong = np.sin(difflong), np.cos(difflong)
+
+    d = np.arctan2(np.sqrt((cos_lat2 * sin_difflong) ** 2 +
+                           (cos_lat1 * sin_lat2 - sin_lat1 * cos_lat2 * cos_difflong) ** 2),
+                   sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_difflong)
+    return radius * d
@@ -1,8 +1,11 @@
+import json
+import multiprocessing
 import os
+import re
 import shutil
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from functools import partial
-from multiprocessing import Pool
 try:
     # PYTHON 3
     from urllib.parse import urlparse
@@ -13,6 +16,7 @@ except ImportError:
     from urlparse import urlparse
 
 import requests
+import urllib3
 from bs4 import BeautifulSoup
 from siphon.catalog import TDSCatalog
 
@@ -104,6 +108,7 @@ class _SaveResult(object):
         self.output = None
         self._executed_request = executed_request
         self._expected_status = expected_status
+        self._saved = False
 
     @property
     def success(self):
@@ -125,61 +130,242 @@ class _SaveResult(object):
                                                                          len(self.exceptions))
 
 
-def saveall(src_dest_map, override_existing=False, callback=None):
-    save_and_exec = partial(_save_and_exec_callback, src_dest_map=src_dest_map,
-                            override_existing=override_existing, callback=callback)
-
-    if len(src_dest_map) <= 1:
-        return list(map(save_and_exec, src_dest_map.keys()))
-    else:
-        numprocesses = min(len(src_dest_map), 4)
-        with Pool(numprocesses) as pool:
-            return pool.map(save_and_exec, src_dest_map.keys())
-
-
-def _save_and_exec_callback(url, src_dest_map, override_existing, callback):
-    def wrapped_callback(arg, save_result):
-        if callback is not None:
-            try:
-                # print("arrived at callback for: {}".format(arg))
-                ret = callback(arg)
-                save_result.output = ret
-            except Exception as e:
-                save_result.exceptions.append(e)
-
-    dest = src_dest_map[url]
+def saveall(src_dest_map, override_existing=False, callback=None, max_workers=4, callback_processes=None):
+    """
+    Downloads every url in `src_dest_map` to its destination on a pool of `max_workers` threads
+    sharing one keep-alive HTTP session. `callback` is called with the destination of each saved
+    file; if `callback_processes` is given, callbacks run in a pool of that many processes instead,
+    which is worthwhile for CPU-heavy callbacks. Returns a `_SaveResult` per url, in order.
+    """
+    urls = list(src_dest_map.keys())
+    if not urls:
+        return []
+    offload_callbacks = callback is not None and bool(callback_processes)
+
+    with _http_session(max_workers) as session:
+        save_and_exec = partial(_save_and_exec_callback, src_dest_map=src_dest_map,
+                                override_existing=override_existing,
+                                callback=None if offload_callbacks else callback, session=session)
+
+        if not offload_callbacks and (len(urls) <= 1 or max_workers <= 1):
+            return list(map(save_and_exec, urls))
+
+        with ThreadPoolExecutor(max(min(len(urls), max_workers), 1)) as downloader:
+            futures = [downloader.submit(save_and_exec, url) for url in urls]
+            if offload_callbacks:
+                with ProcessPoolExecutor(min(len(urls), callback_processes), mp_context=_callback_context(callback)) \
+                        as processor:
+                    # start each callback as soon as its file is saved
+                    pending = {}
+                    for future in as_completed(futures):
+                        result = future.result()
+                        if result._saved:
+                            pending[processor.submit(callback, result.dest)] = result
+                    for callback_future, result in pending.items():
+                        _exec_callback(callback_future.result, result)
+
+            return [future.result() for future in futures]
+
+
+def _callback_context(callback):
+    # The download threads are already running when the callback pool starts its workers, and
+    # forking a multithreaded process can deadlock on locks those threads hold (the connection
+    # pool's, logging's, ...). A fork server forks from a clean single-threaded process instead;
+    # the callback's module is imported there once (when the server starts), not in every worker.
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context('forkserver')
+    module = getattr(getattr(callback, 'func', callback), '__module__', None)
+    if module and module != '__main__':
+        context.set_forkserver_preload([module])
+    return context
+
+
+def _http_session(pool_size):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max(pool_size, 1), pool_maxsize=max(pool_size, 1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _exec_callback(func, save_result, *args):
+    try:
+        save_result.output = func(*args)
+    except Exception as e:
+        save_result.exceptions.append(e)
+
+
+def _save_and_exec_callback(url, src_dest_map, override_existing, callback, session=None):
+    result = _save(url, src_dest_map[url], override_existing, session)
+    if result._saved and callback is not None:
+        _exec_callback(callback, result, result.dest)
+    return result
+
+
+def _save(url, dest, override_existing, session=None):
     scheme = urlparse(url).scheme
-    if not override_existing and os.path.isfile(dest):
+    if not override_existing and _is_complete(dest, url, session):
         result = _SaveResult(url, dest, response=None, executed_request=False)
-        wrapped_callback(dest, result)
+        result._saved = True
         return result
 
     # TODO: merge the ftp and http code... they're essentially the same thing
     # and we do not need the requests library to save
     elif scheme == 'ftp':
         source = urlopen(url)
-        with open(dest, 'wb') as target:
+        with open(_part_path(dest), 'wb') as target:
             target.write(source.read())
+        os.replace(_part_path(dest), dest)
 
+        # TODO: some kind of error handling with getcode()
         result = _SaveResult(url, dest, source, executed_request=True)
-        try:
-            # TODO: some kind of error handling with getcode()
-            wrapped_callback(dest, result)
-        except Exception as e:
-            result.exceptions.append(e)
+        result._saved = True
         return result
 
     elif scheme in ('http', 'https'):
-        response = requests.get(url, stream=True)
-        result = _SaveResult(url, dest, response, executed_request=True)
-
-        if response is not None:
-            try:
-                response.raise_for_status()
-                save_response_content(response, dest)
-                wrapped_callback(dest, result)
-            except requests.HTTPError as e:
-                result.exceptions.append(e)
-        return result
+        return _save_http(url, dest, session)
     else:
         raise ValueError("Cannot save: {}; only FTP and HTTP(S) URL's are supported at this time".format(url))
+
+
+## resumable HTTP downloads
+# Downloads go to a `.part` file that is renamed onto the destination once complete. The
+# validators of the last response (ETag, Last-Modified, total length) are kept in a `.meta`
+# file next to it; they tell a truncated file from a complete one, let an interrupted
+# download resume with a Range request, and let an existing file be revalidated with a
+# conditional GET instead of being downloaded again.
+
+def _part_path(dest):
+    return dest + '.part'
+
+
+def _meta_path(dest):
+    return dest + '.meta'
+
+
+def _read_meta(dest):
+    try:
+        with open(_meta_path(dest)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_meta(dest, meta):
+    with open(_meta_path(dest), 'w') as f:
+        json.dump(meta, f)
+
+
+def _is_complete(dest, url=None, session=None):
+    if not os.path.isfile(dest):
+        return False
+    if not os.path.isfile(_meta_path(dest)):
+        # left by a crash or an older downloader: an HTTP(S) file is checked against the size
+        # the server reports before it's reused; anything else is trusted as before
+        return url is None or urlparse(url).scheme not in ('http', 'https') or \
+            _matches_remote(url, dest, session)
+    length = _read_meta(dest).get('length')
+    return length is None or os.path.getsize(dest) == length
+
+
+def _matches_remote(url, dest, session=None):
+    try:
+        response = (session or requests).head(url, allow_redirects=True)
+    except (requests.RequestException, urllib3.exceptions.HTTPError, OSError):
+        return False
+    if response.status_code != 200:
+        return False
+
+    meta = _response_meta(response)
+    if meta['length'] is None or os.path.getsize(dest) != meta['length']:
+        return False
+    _write_meta(dest, meta)
+    return True
+
+
+def _response_meta(response):
+    headers = response.headers
+    if headers.get('Content-Encoding', 'identity') != 'identity':
+        # the decoded size on disk can't be checked against the encoded length
+        length = None
+    elif response.status_code == 206:
+        total = re.search(r'/(\d+)$', headers.get('Content-Range', ''))
+        length = int(total.group(1)) if total else None
+    else:
+        length = int(headers['Content-Length']) if 'Content-Length' in headers else None
+
+    return {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified'), 'length': length}
+
+
+def _request_headers(dest):
+    meta = _read_meta(dest)
+    validator = meta.get('etag') or meta.get('last_modified')
+    headers = {}
+
+    if os.path.isfile(_part_path(dest)) and validator and meta.get('length') is not None:
+        # resume, but only if the resource hasn't changed since the part was downloaded
+        headers['Range'] = 'bytes={}-'.format(os.path.getsize(_part_path(dest)))
+        headers['If-Range'] = validator
+    elif _is_complete(dest):
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+
+# failures of a single transfer, recorded on its result rather than raised
+_TRANSFER_ERRORS = (requests.RequestException, urllib3.exceptions.HTTPError, OSError, DataRetrievalException)
+
+
+def _save_http(url, dest, session=None):
+    getter = session or requests
+    headers = _request_headers(dest)
+    try:
+        response = getter.get(url, stream=True, headers=headers)
+
+        if response is not None and response.status_code == 416:
+            # the part file doesn't fit the resource anymore; start over
+            if os.path.isfile(_part_path(dest)):
+                os.remove(_part_path(dest))
+            headers = {}
+            response = getter.get(url, stream=True)
+    except _TRANSFER_ERRORS as e:
+        result = _SaveResult(url, dest, None, executed_request=True)
+        result.exceptions.append(e)
+        return result
+
+    if response is not None and response.status_code == 304:
+        result = _SaveResult(url, dest, response, executed_request=True, expected_status=304)
+        result._saved = True
+        return result
+
+    resumed = response is not None and response.status_code == 206 and 'Range' in headers
+    result = _SaveResult(url, dest, response, executed_request=True,
+                         expected_status=206 if resumed else 200)
+
+    if response is not None:
+        try:
+            response.raise_for_status()
+            raise_for_bad_response(response, result._expected_status)
+
+            meta = _response_meta(response)
+            _write_meta(dest, meta)
+            with open(_part_path(dest), 'ab' if resumed else 'wb') as f:
+                response.raw.decode_content = True
+                # keep what arrives of a body cut short; the size check below catches it
+                response.raw.enforce_content_length = False
+                shutil.copyfileobj(response.raw, f)
+
+            size = os.path.getsize(_part_path(dest))
+            if meta['length'] is not None and size != meta['length']:
+                raise DataRetrievalException("Incomplete download for url: {} ({} of {} bytes)".format(
+                    url, size, meta['length']))
+
+            os.replace(_part_path(dest), dest)
+            result._saved = True
+        except _TRANSFER_ERRORS as e:
+            # a transfer cut short keeps its part file (and meta), so the next try resumes it
+            result.exceptions.append(e)
+    return result
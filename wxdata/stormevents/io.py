@@ -1,40 +1,118 @@
+import errno
+import glob
+import json
+import os
 import re
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import partial
 from itertools import product
 
+import numpy as np
 import pandas as pd
 import six
 
+from wxdata import workdir
 from wxdata.http import get_links, DataRetrievalException
-from wxdata.stormevents.temporal import convert_df_tz, localize_timestamp_tz, convert_timestamp_tz
+from wxdata.stormevents.temporal import convert_df_tz, localize_timestamp_tz, localize_col_from_utc
 from wxdata.workdir import bulksave
 
-__all__ = ['load_file', 'load_events', 'load_events_year', 'export',
+__all__ = ['load_file', 'load_events', 'iter_events', 'load_events_year', 'export',
+           'compact_events', 'event_narratives', 'refresh_manifest', 'load_locations', 'load_fatalities',
            'tornadoes', 'hail', 'all_severe', 'tstorm_wind', 'urls_for']
 
 
-def urls_for(years):
-    return get_links('https://www1.ncdc.noaa.gov/pub/data/swdi/stormevents/csvfiles/',
-                     file_filter=_year_filter(years))
+def urls_for(years, kind='details'):
+    # `kind` is one of the yearly tables NCEI publishes: details, locations or fatalities
+    files = _listed_files().get(kind, {})
+    return [files[year]['url'] for year in sorted(set(int(year) for year in years)) if year in files]
 
 
-def _year_filter(years):
-    years = (str(yr) for yr in years)
-    regex = r'StormEvents_details-ftp_v\d{1}\.\d{1}_d({YEARS})_c\d{8}.csv.gz'.replace(r'{YEARS}', '|'.join(years))
+def refresh_manifest(kind='details'):
+    # Fetches the NCEI listing again, regardless of how old the work directory's copy is, and
+    # returns the years whose `kind` files were added or re-issued since it was last fetched.
+    # A re-issued file has a new name, so those are the only years downloaded again.
+    path = _manifest_path()
+    previous = _read_manifest(path) if path is not None else None
+    files = _fetch_listing()
+    if path is not None:
+        _write_manifest(path, files)
 
-    def ret(link):
-        return bool(re.search(regex, link))
+    previous_files = previous['files'].get(kind, {}) if previous is not None else {}
+    return sorted(year for year, entry in files.get(kind, {}).items()
+                  if previous_files.get(year, {}).get('revision') != entry['revision'])
 
-    return ret
+
+## manifest of the NCEI listing
+# The yearly files NCEI lists, with their `_cYYYYMMDD` revisions, are kept in the work
+# directory and only fetched again once older than `_MANIFEST_TTL` seconds. Loading years that
+# are listed there and already downloaded makes no network requests at all.
+
+_LISTING_URL = 'https://www1.ncdc.noaa.gov/pub/data/swdi/stormevents/csvfiles/'
+_TABLE_LINK = re.compile(r'StormEvents_(details|locations|fatalities)-ftp_v\d{1}\.\d{1}_d(\d{4})_c(\d{8})\.csv\.gz')
+_MANIFEST_FILE = 'manifest.json'
+_MANIFEST_TTL = 24 * 60 * 60
+
+
+def _listed_files():
+    path = _manifest_path()
+    manifest = _read_manifest(path) if path is not None else None
+    if manifest is not None and 0 <= time.time() - manifest['fetched'] < _MANIFEST_TTL:
+        return manifest['files']
+
+    files = _fetch_listing()
+    if path is not None:
+        _write_manifest(path, files)
+    return files
+
+
+def _fetch_listing():
+    files = {}
+    for link in get_links(_LISTING_URL):
+        matches = _TABLE_LINK.search(link)
+        if not matches:
+            continue
+        kind, year, revision = matches.group(1), int(matches.group(2)), matches.group(3)
+        kind_files = files.setdefault(kind, {})
+        # a year listed more than once is read from its latest revision
+        if year not in kind_files or revision > kind_files[year]['revision']:
+            kind_files[year] = {'url': link, 'revision': revision}
+    return files
+
+
+def _manifest_path():
+    cachedir = _cache_dir()
+    return os.path.join(cachedir, _MANIFEST_FILE) if cachedir is not None else None
+
+
+def _read_manifest(path):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+        files = {kind: {int(year): entry for year, entry in kind_files.items()}
+                 for kind, kind_files in manifest['files'].items()}
+        return {'fetched': float(manifest['fetched']), 'files': files}
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_manifest(path, files):
+    manifest = {'fetched': time.time(), 'listing': _LISTING_URL,
+                'files': {kind: {str(year): entry for year, entry in kind_files.items()}
+                          for kind, kind_files in files.items()}}
+    _makedirs_for(path)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
 
 
 def _year_from_link(link):
-    regex = r'StormEvents_details-ftp_v\d{1}\.\d{1}_d(\d{4})_c\d{8}.csv.gz'
-    matches = re.search(regex, link)
+    matches = _TABLE_LINK.search(link)
     if matches:
-        year = matches.group(1)
+        year = matches.group(2)
         return int(year)
     else:
         raise DataRetrievalException("Could not get year from assumed storm event "
@@ -42,43 +120,48 @@ def _year_from_link(link):
 
 
 def load_file(file, keep_data_start=None, keep_data_end=None, months=None, hours=None,
-              eventtypes=None, states=None, tz=None, tz_localize=False):
-    df = pd.read_csv(file,
-                     parse_dates=['BEGIN_DATE_TIME', 'END_DATE_TIME'],
-                     infer_datetime_format=True,
-                     index_col=False,
-                     converters={
-                         'BEGIN_TIME': lambda t: t.zfill(4),
-                         'END_TIME': lambda t: t.zfill(4)
-                     },
-                     dtype={'{}_{}'.format(flag, temporal_accessor): object
-                            for flag, temporal_accessor
-                            in product(('BEGIN', 'END'), ('YEARMONTH',))},
-                     compression='infer')
+              eventtypes=None, states=None, tz=None, tz_localize=False, columns=None, compact=False):
+    if columns is not None:
+        keep_cols = [col.lower() for col in columns]
+        read_cols = keep_cols + [col for col in _LOAD_COLUMNS if col not in keep_cols]
+    else:
+        keep_cols = read_cols = None
+    # compact frames leave the narratives on disk unless they're asked for by name
+    narratives = not compact or (keep_cols is not None and any(col in keep_cols for col in _NARRATIVE_COLUMNS))
+
+    # The filters are pushed down into the read so that rows which can't match are never
+    # materialized; they're applied exactly again below.
+    pushdown = dict(eventtypes=eventtypes, states=states, months=months, hours=hours,
+                    window=_coarse_window(keep_data_start, keep_data_end))
+
+    # The compact dtypes are decided once per file, when it's cached, so that a cached read
+    # builds them directly instead of compacting the loaded frame afterwards.
+    compact_schema = None
+    cache_path = _cache_path(file)
+    if cache_path is not None and os.path.isfile(cache_path):
+        compact_schema = _cached_compact_schema(cache_path) if compact else None
+        df = _read_cached(cache_path, read_cols, exclude=() if narratives else _NARRATIVE_COLUMNS,
+                          compact_schema=compact_schema, **pushdown)
+    elif cache_path is not None:
+        df = _read_csv(file)
+        compact_schema = _compact_schema(df)
+        if not _write_cache(cache_path, df, compact_schema=compact_schema):
+            cache_path = None
+        df = _prefilter(df, **pushdown)
+    else:
+        df = _read_csv(file, **pushdown)
 
-    df.columns = map(str.lower, df.columns)
+    if read_cols is not None:
+        df = df[[col for col in df.columns if col in read_cols]]
 
     if tz_localize:
-        # hack to restore tz information after loading the file
-        # most times this step will not be needed. This is just for testing and dataframe comparison
-        # TODO: can we implement a localize dataframe function in the temporal processing library?
-
-        # We can't use the localize_timestamp_tz function here because pandas
-        # converts timestamps to UTC time, then makes them tz-naive. The localize function
-        # assumes the timestamps are naive but in the correct timezone.
-        df['begin_date_time'] = df.apply(
-            lambda r: convert_timestamp_tz(r.begin_date_time, 'UTC', r.cz_timezone), axis=1)
-        df['end_date_time'] = df.apply(
-            lambda r: convert_timestamp_tz(r.end_date_time, 'UTC', r.cz_timezone), axis=1)
+        # restore tz information after loading the file; most times this step will not be
+        # needed, it's just for testing and dataframe comparison. pandas reads the timestamps
+        # as UTC, so `localize_timestamp_tz` (which assumes naive wall-clock times) can't be used.
+        for col in ('begin_date_time', 'end_date_time'):
+            df[col] = localize_col_from_utc(df, col)
 
-    if eventtypes is not None:
-        df = df[df.event_type.isin(eventtypes)]
-    if states is not None:
-        df = df[df.state.isin([state.upper() for state in states])]
-    if months is not None:
-        df = df[df.month_name.isin(months)]
-    if hours is not None:
-        df = df[pd.to_numeric(df.begin_time.str[:2]).isin(hours)]
+    df = _filter_events(df, eventtypes, states, months, hours)
 
     if keep_data_start and keep_data_end:
         if tz:
@@ -86,24 +169,309 @@ def load_file(file, keep_data_start=None, keep_data_end=None, months=None, hours
             keep_data_end = localize_timestamp_tz(keep_data_end, tz)
 
             # if we're looking at small date range, we don't have to convert the TZ for the
-            # entire DF, which is expensive. But we do have to account not shifting TZ can cause
-            # a +/- 1 day error.
-            start_m1days = keep_data_start - pd.Timedelta(days=1)
-            end_p1days = keep_data_end + pd.Timedelta(days=1)
-
-            df = df[(df.begin_date_time >= start_m1days) & (df.begin_date_time < end_p1days)]
+            # entire DF, which is expensive. The read above already dropped everything outside
+            # the window padded by a day, which accounts for the +/- 1 day error of not shifting TZ.
             df = convert_df_tz(df, tz, False)
 
         df = df[(df.begin_date_time >= keep_data_start) & (df.begin_date_time < keep_data_end)]
     elif tz:
         df = convert_df_tz(df, tz, False)
 
+    if keep_cols is not None:
+        df = df[[col for col in df.columns if col in keep_cols]]
+
+    if compact:
+        if cache_path is None and not narratives and \
+                any(col in df.columns and df[col].notnull().any() for col in _NARRATIVE_COLUMNS):
+            warnings.warn("Narratives of {} are dropped and can't be fetched later; it isn't cached "
+                          "(no work directory, pyarrow, or not an NCEI yearly file).".format(file))
+        if not narratives:
+            df = df.drop(columns=[col for col in _NARRATIVE_COLUMNS if col in df.columns])
+        # older caches have no schema stored; those frames are compacted as they are
+        df = _apply_compact_schema(df, compact_schema if compact_schema is not None else _compact_schema(df))
+
+    return df
+
+
+_LOAD_PROCESSES = 4
+
+# columns `load_file` itself needs to filter, localize and convert time zones
+_LOAD_COLUMNS = ('event_type', 'state', 'month_name', 'begin_time', 'begin_date_time', 'end_date_time',
+                 'cz_timezone', 'begin_lat', 'begin_lon')
+
+_CSV_CHUNK_ROWS = 20000
+
+
+def _filter_events(df, eventtypes=None, states=None, months=None, hours=None):
+    if eventtypes is not None:
+        df = df[df.event_type.isin(eventtypes)]
+    if states is not None:
+        df = df[df.state.isin([state.upper() for state in states])]
+    if months is not None:
+        df = df[df.month_name.isin(months)]
+    if hours is not None:
+        df = df[pd.to_numeric(df.begin_time.str[:2]).isin(hours)]
+    return df
+
+
+def _coarse_window(start, end):
+    if not (start and end):
+        return None
+
+    # The file's timestamps are naive and in each event's own time zone, so the window is
+    # taken as wall-clock time and padded by a day on either side. The exact, tz-aware
+    # filtering is left to `load_file`.
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if start.tz is not None:
+        start = start.tz_localize(None)
+    if end.tz is not None:
+        end = end.tz_localize(None)
+    return start - pd.Timedelta(days=1), end + pd.Timedelta(days=1)
+
+
+def _prefilter(df, eventtypes=None, states=None, months=None, hours=None, window=None):
+    df = _filter_events(df, eventtypes, states, months, hours)
+    if window is not None and pd.api.types.is_datetime64_dtype(df.begin_date_time):
+        window_start, window_end = window
+        df = df[(df.begin_date_time >= window_start) & (df.begin_date_time < window_end)]
     return df
 
 
+def _read_csv(file, **prefilter_kw):
+    read_kw = dict(parse_dates=['BEGIN_DATE_TIME', 'END_DATE_TIME'],
+                   infer_datetime_format=True,
+                   index_col=False,
+                   converters={
+                       'BEGIN_TIME': lambda t: t.zfill(4),
+                       'END_TIME': lambda t: t.zfill(4)
+                   },
+                   dtype={'{}_{}'.format(flag, temporal_accessor): object
+                          for flag, temporal_accessor
+                          in product(('BEGIN', 'END'), ('YEARMONTH',))},
+                   compression='infer')
+
+    if not any(val is not None for val in prefilter_kw.values()):
+        df = pd.read_csv(file, **read_kw)
+        df.columns = map(str.lower, df.columns)
+        return df
+
+    # read in chunks and drop what can't match before the next chunk is parsed
+    chunks = []
+    for chunk in pd.read_csv(file, chunksize=_CSV_CHUNK_ROWS, **read_kw):
+        chunk.columns = map(str.lower, chunk.columns)
+        chunks.append(_prefilter(chunk, **prefilter_kw))
+    return pd.concat(chunks)
+
+
+## parsed file cache
+
+_CACHE_SUBDIR = os.path.join('_cache', 'stormevents')
+_CACHE_ROW_COL = '_file_row'
+_CACHE_ROW_GROUP_SIZE = 8192
+
+
+def _cache_path(file):
+    # Only NCEI yearly files are cached. Their `_cYYYYMMDD` revision stamp is part of the cache
+    # key, so a re-issued file never reads a stale frame.
+    if _parquet() is None or not isinstance(file, six.string_types):
+        return None
+    matches = re.search(r'(StormEvents_[a-z]+)-ftp_v\d{1}\.\d{1}_d(\d{4})_c(\d{8})\.csv\.gz$',
+                        os.path.basename(file))
+    cachedir = _cache_dir()
+    if not matches or cachedir is None:
+        return None
+
+    kind, year, revision = matches.groups()
+    return os.path.join(cachedir, '{}_d{}_c{}.parquet'.format(kind, year, revision))
+
+
+def _cache_dir():
+    # The directory is only created once something is written to it (see `_makedirs_for`),
+    # so that resolving a path or reading doesn't leave it behind.
+    try:
+        return os.path.join(workdir.get(), _CACHE_SUBDIR)
+    except workdir.WorkDirectoryException:
+        return None
+
+
+def _makedirs_for(path):
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _parquet():
+    try:
+        import pyarrow.parquet as pq
+        return pq
+    except ImportError:
+        return None
+
+
+def _parquet_filters(eventtypes=None, states=None, months=None, hours=None, window=None, event_ids=None):
+    # filters in disjunctive normal form: each inner list is AND-ed, the outer list OR-ed
+    conjunction = []
+    if event_ids is not None:
+        conjunction.append(('event_id', 'in', list(event_ids)))
+    if eventtypes is not None:
+        conjunction.append(('event_type', 'in', list(eventtypes)))
+    if states is not None:
+        conjunction.append(('state', 'in', [state.upper() for state in states]))
+    if months is not None:
+        conjunction.append(('month_name', 'in', list(months)))
+    if window is not None:
+        window_start, window_end = window
+        conjunction.append(('begin_date_time', '>=', window_start.to_pydatetime()))
+        conjunction.append(('begin_date_time', '<', window_end.to_pydatetime()))
+
+    if hours is not None and all(isinstance(hr, six.integer_types) and 0 <= hr < 24 for hr in hours):
+        # `begin_time` is a zero-padded HHMM string
+        return [conjunction + [('begin_time', '>=', '{:02d}00'.format(hr)),
+                               ('begin_time', '<', '{:02d}00'.format(hr + 1))]
+                for hr in sorted(set(hours))] or None
+
+    return [conjunction] if conjunction else None
+
+
+def _read_cached(path, columns=None, exclude=(), compact_schema=None, **prefilter_kw):
+    pq = _parquet()
+    import pyarrow as pa
+
+    if columns is not None or exclude:
+        # names the file doesn't have are ignored, as they are when reading the CSV
+        names = [col for col in pq.read_schema(path).names if col not in exclude and col != _CACHE_ROW_COL]
+        columns = [col for col in names if columns is None or col in columns] + [_CACHE_ROW_COL]
+
+    # with a compact schema the repeated strings are read as dictionaries (categoricals) and
+    # the numbers cast by arrow, so the full-size columns are never built
+    compact_schema = compact_schema or {}
+    categories = [col for col, dtype in compact_schema.items()
+                  if dtype == 'category' and (columns is None or col in columns)]
+    table = pq.read_table(path, columns=columns, filters=_parquet_filters(**prefilter_kw),
+                          memory_map=True, read_dictionary=categories or None)
+    if compact_schema:
+        fields = [field.with_type(pa.from_numpy_dtype(np.dtype(compact_schema[field.name])))
+                  if compact_schema.get(field.name, 'category') != 'category' else field
+                  for field in table.schema]
+        table = table.cast(pa.schema(fields, metadata=table.schema.metadata))
+    df = table.to_pandas()
+
+    # parquet nulls come back as None; the CSV reader gives NaN
+    for col in df.columns[df.dtypes == object]:
+        df.loc[df[col].isnull(), col] = np.nan
+
+    # restore the order and index of the original file
+    df.sort_values(_CACHE_ROW_COL, inplace=True)
+    df.index = df.pop(_CACHE_ROW_COL).values
+    return df
+
+
+def _cached_compact_schema(path):
+    metadata = _parquet().read_schema(path).metadata or {}
+    schema = metadata.get(_COMPACT_SCHEMA_KEY)
+    return json.loads(schema.decode('utf-8')) if schema is not None else None
+
+
+def _write_cache(path, df, sort_columns=('event_type', 'state', 'begin_date_time'), compact_schema=None):
+    pq = _parquet()
+    import pyarrow as pa
+
+    # Rows are stored sorted on the usual filter columns so that the row group statistics
+    # let the reader skip most of the file.
+    to_cache = df.assign(**{_CACHE_ROW_COL: np.arange(len(df))})
+    to_cache = to_cache.sort_values(list(sort_columns), kind='mergesort')
+
+    _makedirs_for(path)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        table = pa.Table.from_pandas(to_cache, preserve_index=False)
+        if compact_schema is None:
+            compact_schema = _compact_schema(df)
+        metadata = dict(table.schema.metadata or {})
+        metadata[_COMPACT_SCHEMA_KEY] = json.dumps(compact_schema).encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+        pq.write_table(table, tmp_path, row_group_size=_CACHE_ROW_GROUP_SIZE)
+    except pa.ArrowException as e:
+        # the cache is optional; a frame pyarrow can't store (e.g. a column mixing strings
+        # and floats) is just left uncached
+        warnings.warn("Could not cache {}: {!r}".format(path, e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, path)
+
+    # drop caches of older revisions of this file
+    stale_glob = re.sub(r'_c\d{8}\.parquet$', '_c*.parquet', path)
+    for stale in glob.glob(stale_glob):
+        if stale != path:
+            os.remove(stale)
+    return True
+
+
 def load_events(start, end, eventtypes=None, states=None, months=None,
-                hours=None, tz=None, debug=False):
+                hours=None, tz=None, debug=False, compact=False):
+    start, end = _event_window(start, end, tz)
+
+    #FIXME: there is a corner case of start and end being near the turn of the year that fails.
+    # We need to resolve the start and end variables to able to load both years'
+    # dataframes if needed.
+    links = urls_for(range(start.year, end.year + 1))
+    load_df_with_filter = _year_loader(start, end, eventtypes=eventtypes, states=states, months=months,
+                                       hours=hours, tz=tz, compact=compact)
 
+    # parsing the files is CPU-bound, so it goes to a process pool while downloads run on threads
+    results = bulksave(links, postsave=load_df_with_filter,
+                       postsave_processes=_LOAD_PROCESSES if len(links) > 1 else None)
+    dfs = [result.output for result in results if result.success and result.output is not None]
+    _warn_errors(results, debug)
+
+    if dfs:
+        ret = pd.concat(_union_categories(dfs), ignore_index=True)
+        ret = ret[(ret.begin_date_time >= start) & (ret.begin_date_time < end)]
+        ret.reset_index(drop=True, inplace=True)
+    else:
+        ret = pd.DataFrame()
+
+    if debug:
+        return results, ret
+    else:
+        return ret
+
+
+def iter_events(start, end, eventtypes=None, states=None, months=None,
+                hours=None, tz=None, debug=False, compact=False):
+    """
+    Like `load_events`, but yields one filtered DataFrame per year, in time order. The next
+    year is downloaded and loaded in the background while the current one is consumed, so at
+    most two years are held in memory at a time. Concatenating everything yielded gives the
+    same frame `load_events` returns.
+    """
+    start, end = _event_window(start, end, tz)
+
+    links = sorted(urls_for(range(start.year, end.year + 1)), key=_year_from_link)
+    load_df_with_filter = _year_loader(start, end, eventtypes=eventtypes, states=states, months=months,
+                                       hours=hours, tz=tz, compact=compact)
+
+    load_years = partial(bulksave, postsave=load_df_with_filter)
+
+    with ThreadPoolExecutor(1) as prefetcher:
+        next_year = prefetcher.submit(load_years, links[:1])
+        for i in range(len(links)):
+            results = next_year.result()
+            if i + 1 < len(links):
+                next_year = prefetcher.submit(load_years, links[i + 1:i + 2])
+            _warn_errors(results, debug)
+
+            for result in results:
+                if result.success and result.output is not None:
+                    df = result.output
+                    df = df[(df.begin_date_time >= start) & (df.begin_date_time < end)]
+                    yield df.reset_index(drop=True)
+
+
+def _event_window(start, end, tz):
     if isinstance(start, six.string_types):
         start = pd.Timestamp(start)
     if isinstance(end, six.string_types):
@@ -113,28 +481,18 @@ def load_events(start, end, eventtypes=None, states=None, months=None,
         start = localize_timestamp_tz(start, tz)
         end = localize_timestamp_tz(end, tz)
 
-    #FIXME: there is a corner case of start and end being near the turn of the year that fails.
-    # We need to resolve the start and end variables to able to load both years'
-    # dataframes if needed.
-
     if end < start:
         raise ValueError("End date must be on or after start date")
-    year1 = start.year
-    year2 = end.year
-
-    if year1 == year2:
-        links = urls_for([year1])
-        load_df_with_filter = partial(load_file, keep_data_start=start, keep_data_end=end,
-                                      eventtypes=eventtypes, states=states, months=months,
-                                      hours=hours, tz=tz)
-    else:
-        links = urls_for(range(year1, year2 + 1))
-        load_df_with_filter = partial(load_file, keep_data_start=None, keep_data_end=None,
-                                      eventtypes=eventtypes, states=states, months=months,
-                                      hours=hours, tz=tz)
+    return start, end
 
-    results = bulksave(links, postsave=load_df_with_filter)
-    dfs = [result.output for result in results if result.success and result.output is not None]
+
+def _year_loader(start, end, **filter_kw):
+    # every year is filtered on the full date window while it's read, so only matching
+    # rows are ever held in memory
+    return partial(load_file, keep_data_start=start, keep_data_end=end, **filter_kw)
+
+
+def _warn_errors(results, debug):
     errors = [result for result in results if not result.success]
 
     if errors:
@@ -146,23 +504,153 @@ def load_events(start, end, eventtypes=None, states=None, months=None,
                 print(err.exceptions)
         warnings.warn('There were errors trying to load dataframes for years: {}'.format(','.join(err_yrs)))
 
-    if dfs:
-        ret = pd.concat(dfs, ignore_index=True)
-        ret = ret[(ret.begin_date_time >= start) & (ret.begin_date_time < end)]
-        ret.reset_index(drop=True, inplace=True)
-    else:
-        ret = pd.DataFrame()
 
+def load_events_year(year, **kwargs):
+    start = datetime(year, 1, 1)
+    end = datetime(year, 12, 31, 23, 59, 59)
+    return load_events(start, end, **kwargs)
+
+
+## locations and fatalities
+# The multi-point paths and the individual fatalities of events, one row per point or fatality,
+# in yearly files of their own. They're downloaded and cached like the details files, sorted on
+# `event_id` so that reading only the rows of `event_ids` skips most of a cached file; see
+# `operations.EventIndex` for joining them to events.
+
+_TABLE_SORT_COLUMNS = {
+    'locations': ('event_id', 'location_index'),
+    'fatalities': ('event_id', 'fatality_id'),
+}
+
+_TABLE_DATE_COLUMNS = {
+    'fatalities': ['FATALITY_DATE'],
+}
+
+
+def load_locations(years, event_ids=None, debug=False):
+    return _load_tables(years, 'locations', event_ids, debug)
+
+
+def load_fatalities(years, event_ids=None, debug=False):
+    return _load_tables(years, 'fatalities', event_ids, debug)
+
+
+def _load_tables(years, kind, event_ids, debug):
+    if event_ids is not None:
+        event_ids = pd.unique(np.asarray(event_ids, dtype=np.int64)).tolist()
+    links = urls_for(years, kind)
+    results = bulksave(links, postsave=partial(_load_table_file, kind=kind, event_ids=event_ids),
+                       postsave_processes=_LOAD_PROCESSES if len(links) > 1 else None)
+    dfs = [result.output for result in results if result.success and result.output is not None]
+    _warn_errors(results, debug)
+
+    ret = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=list(_TABLE_SORT_COLUMNS[kind]))
     if debug:
         return results, ret
     else:
         return ret
 
 
-def load_events_year(year, **kwargs):
-    start = datetime(year, 1, 1)
-    end = datetime(year, 12, 31, 23, 59, 59)
-    return load_events(start, end, **kwargs)
+def _load_table_file(file, kind, event_ids=None):
+    cache_path = _cache_path(file)
+    if cache_path is not None and os.path.isfile(cache_path):
+        return _read_cached(cache_path, event_ids=event_ids)
+
+    df = pd.read_csv(file, index_col=False, parse_dates=_TABLE_DATE_COLUMNS.get(kind, False),
+                     compression='infer')
+    df.columns = [col.lower() for col in df.columns]
+    if cache_path is not None:
+        _write_cache(cache_path, df, _TABLE_SORT_COLUMNS[kind])
+    if event_ids is not None:
+        df = df[df.event_id.isin(event_ids)]
+    return df
+
+
+## compact schema
+
+_NARRATIVE_COLUMNS = ('episode_narrative', 'event_narrative')
+
+# kept at full precision so that tornado paths and distances between events don't change
+_FULL_PRECISION_COLUMNS = ('begin_lat', 'begin_lon', 'end_lat', 'end_lon')
+
+# parquet metadata key of the compact schema of a cached file
+_COMPACT_SCHEMA_KEY = b'wxdata.compact'
+
+
+def compact_events(df, narratives=False):
+    # Strings repeated across events become categoricals, integers are downcast to the smallest
+    # type that holds them and other floats to float32. The narratives are dropped unless asked
+    # for; `event_narratives` fetches them from the parsed file cache by event id.
+    if not narratives:
+        df = df.drop(columns=[col for col in _NARRATIVE_COLUMNS if col in df.columns])
+    return _apply_compact_schema(df, _compact_schema(df))
+
+
+def _compact_schema(df):
+    # {column: dtype name} of the columns `compact_events` changes
+    schema = {}
+    for col in df.columns:
+        values = df[col]
+        if values.dtype == object:
+            if pd.api.types.infer_dtype(values, skipna=True) == 'string' and \
+                    col not in _NARRATIVE_COLUMNS and values.nunique() <= len(values) // 2:
+                schema[col] = 'category'
+        elif pd.api.types.is_integer_dtype(values):
+            schema[col] = pd.to_numeric(values, downcast='integer').dtype.name
+        elif pd.api.types.is_float_dtype(values) and col not in _FULL_PRECISION_COLUMNS:
+            schema[col] = 'float32'
+    return schema
+
+
+def _apply_compact_schema(df, schema):
+    compacted = {col: df[col].astype(dtype) for col, dtype in schema.items()
+                 if col in df.columns and df[col].dtype.name != dtype}
+    return df.assign(**compacted) if compacted else df
+
+
+def _union_categories(dfs):
+    # Categoricals only stay categorical through `pd.concat` if their categories match, so
+    # give each categorical column the union of its categories across the frames.
+    if len(dfs) < 2:
+        return dfs
+    categorical = [col for col in dfs[0].columns
+                   if all(col in df.columns and pd.api.types.is_categorical_dtype(df[col]) for df in dfs)]
+    dtypes = {col: pd.CategoricalDtype(pd.api.types.union_categoricals([df[col] for df in dfs]).categories)
+              for col in categorical}
+    return [df.astype(dtypes) for df in dfs] if dtypes else dfs
+
+
+def event_narratives(event_ids, years=None):
+    # Episode and event narratives of `event_ids`, indexed by event id, from the parsed file cache
+    # `load_file` keeps of every NCEI yearly file it reads with a work directory set. Restricting
+    # to `years` saves opening the other years' files; ids that aren't cached get NaN.
+    event_ids = pd.unique(np.asarray(event_ids, dtype=np.int64))
+    found = []
+
+    pq = _parquet()
+    if pq is not None and len(event_ids):
+        cachedir = _cache_dir()
+        paths = glob.glob(os.path.join(cachedir, 'StormEvents_details_d*.parquet')) if cachedir else []
+        if years is not None:
+            years = set(int(year) for year in years)
+            paths = [path for path in paths if int(re.search(r'_d(\d{4})_c', path).group(1)) in years]
+
+        columns = ['event_id'] + list(_NARRATIVE_COLUMNS)
+        for path in sorted(paths):
+            if not all(col in pq.read_schema(path).names for col in columns):
+                continue
+            table = pq.read_table(path, columns=columns, filters=[('event_id', 'in', event_ids.tolist())],
+                                  memory_map=True)
+            if table.num_rows:
+                found.append(table.to_pandas())
+
+    if found:
+        narratives = pd.concat(found, ignore_index=True).drop_duplicates('event_id')
+    else:
+        narratives = pd.DataFrame(columns=['event_id'] + list(_NARRATIVE_COLUMNS))
+    narratives = narratives.set_index('event_id').reindex(event_ids)
+    narratives.index.name = 'event_id'
+    return narratives
 
 
 def export(df, saveloc, lowercase_cols=True, **kwargs):
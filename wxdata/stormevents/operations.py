@@ -1,16 +1,40 @@
+import numpy as np
 import pandas as pd
 
 import wxdata._timezones as _tzhelp
 from wxdata.stormevents.temporal import df_tz
 
-__all__ = ['filter_on_date', 'filter_on_year', 'filter_region', 'time_partition']
+__all__ = ['filter_on_date', 'filter_on_spc_day', 'filter_on_year', 'filter_region', 'assign_regions',
+           'time_partition', 'daily_totals', 'EventIndex', 'fatality_totals']
 
 
 def time_partition(df, timebuckets):
+    # The events are sorted by begin time once, and each bucket is found with a binary search.
+    # If they're sorted already, each bucket is a slice of `df`.
+    begin_times = df.begin_date_time
+    if begin_times.dtype == object:
+        # mixed time zones; nothing to sort on
+        for bucket in timebuckets:
+            bucket_start, bucket_end = bucket
+            yield bucket, df[(begin_times >= bucket_start) & (begin_times < bucket_end)]
+        return
+
+    valid = np.flatnonzero(begin_times.notnull().values)
+    presorted = len(valid) == len(df) and begin_times.is_monotonic_increasing
+    if presorted:
+        order = valid
+    else:
+        order = valid[np.argsort(begin_times.values[valid], kind='mergesort')]
+    sorted_times = pd.DatetimeIndex(begin_times.iloc[order])
+
     for bucket in timebuckets:
         bucket_start, bucket_end = bucket
-        yield bucket, df[(df.begin_date_time >= bucket_start) &
-                         (df.begin_date_time < bucket_end)]
+        lo = sorted_times.searchsorted(pd.Timestamp(bucket_start), side='left')
+        hi = max(sorted_times.searchsorted(pd.Timestamp(bucket_end), side='left'), lo)
+        if presorted:
+            yield bucket, df.iloc[lo:hi]
+        else:
+            yield bucket, df.iloc[np.sort(order[lo:hi])]
 
 
 def filter_on_date(df, date_, tz_localize=True, tz=None):
@@ -22,11 +46,22 @@ def filter_on_date(df, date_, tz_localize=True, tz=None):
 
 
 def filter_on_spc_day(df, date_, tz_localize=True, tz=None):
+    # SPC convective days run 12Z to 12Z, whatever timezone the frame is in
+    if df.empty:
+        return df
+
     date_ = pd.Timestamp(date_)
     year, month, day = date_.year, date_.month, date_.day
 
-    t1 = pd.Timestamp(year=year, month=month, day=day, hour=12, minute=0)
-    return _filter_on_timeperiod(df, t1, '1 day', tz_localize, tz)
+    t1 = pd.Timestamp(year=year, month=month, day=day, hour=12, minute=0).tz_localize('UTC')
+    t2 = t1 + pd.Timedelta('1 day')
+    if df.begin_date_time.dtype != object and not hasattr(df.begin_date_time.dtype, 'tz'):
+        # naive times are wall clock times in `tz`, or already UTC without `tz_localize`
+        if tz_localize:
+            tz = _tzhelp.parse_tz(tz if tz is not None else df_tz(df))
+            t1, t2 = t1.tz_convert(tz), t2.tz_convert(tz)
+        t1, t2 = t1.tz_localize(None), t2.tz_localize(None)
+    return df[(df.begin_date_time >= t1) & (df.begin_date_time < t2)]
 
 
 def filter_on_year(df, year, tz_localize=True, tz=None):
@@ -48,11 +83,191 @@ def _filter_on_timeperiod(df, t1, dt, tz_localize, tz):
     return df[(df.begin_date_time >= t1) & (df.begin_date_time < t2)]
 
 
+# columns `daily_totals` sums, where present
+_DAILY_TOTAL_COLUMNS = ('injuries_direct', 'injuries_indirect', 'deaths_direct', 'deaths_indirect',
+                        'tor_length')
+
+
+def daily_totals(df, spc_day=False, tz_localize=True, tz=None):
+    # Event counts and casualty and path length sums for every day with events, on the same
+    # days as `filter_on_date`, or as `filter_on_spc_day` (12Z to 12Z) with `spc_day`.
+    sums = [col for col in _DAILY_TOTAL_COLUMNS if col in df.columns]
+    if df.empty:
+        return pd.DataFrame(columns=['events'] + sums, index=pd.DatetimeIndex([], name='date'))
+
+    begin_times = df.begin_date_time
+    if tz_localize:
+        if tz is None:
+            tz = df_tz(df)
+        tz = _tzhelp.parse_tz(tz)
+        if begin_times.dtype == object:
+            begin_times = pd.to_datetime(begin_times, utc=True)
+
+    if spc_day:
+        # as in `filter_on_spc_day`, naive times are wall clock times in `tz`, or already
+        # UTC without `tz_localize`
+        if hasattr(begin_times.dtype, 'tz'):
+            begin_times = begin_times.dt.tz_convert('UTC').dt.tz_localize(None)
+        elif tz_localize:
+            begin_times = begin_times.dt.tz_localize(tz).dt.tz_convert('UTC').dt.tz_localize(None)
+        begin_times = begin_times - pd.Timedelta(hours=12)
+    elif hasattr(begin_times.dtype, 'tz'):
+        # the wall clock time in `tz`, or in the frame's own timezone without `tz_localize`
+        if tz_localize:
+            begin_times = begin_times.dt.tz_convert(tz)
+        begin_times = begin_times.dt.tz_localize(None)
+
+    dates = begin_times.dt.floor('D').rename('date')
+
+    grouped = df[sums].groupby(dates)
+    ret = grouped.sum()
+    ret.insert(0, 'events', grouped.size())
+    return ret
+
+
 def filter_region(df, region_poly):
-    return df[df.apply(lambda r: _is_in_region(r, region_poly), axis=1)]
+    # like the region polygons, the points are (lat, lon)
+    return df[_in_region(df.begin_lat.values, df.begin_lon.values, region_poly)]
+
+
+def assign_regions(df, regions, unassigned=None):
+    # Name of the region each event began in, out of a {name: polygon} mapping, or `unassigned`
+    # if none. Where regions overlap, the first one listed wins.
+    lats = df.begin_lat.values.astype(np.float64)
+    lons = df.begin_lon.values.astype(np.float64)
+    grid = _PointGrid(lats, lons)
+
+    names = np.full(len(df), unassigned, dtype=object)
+    assigned = np.zeros(len(df), dtype=bool)
+    for name, region_poly in regions.items():
+        candidates = grid.candidates(region_poly.bounds)
+        candidates = candidates[~assigned[candidates]]
+        inside = candidates[_contains(region_poly, lats[candidates], lons[candidates])]
+        names[inside] = name
+        assigned[inside] = True
+
+    return pd.Series(names, index=df.index, name='region')
+
+
+def _in_region(lats, lons, region_poly):
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    # only the points in the polygon's bounding box need the exact test
+    min_lat, min_lon, max_lat, max_lon = region_poly.bounds
+    candidates = np.flatnonzero((lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon))
+
+    ret = np.zeros(len(lats), dtype=bool)
+    ret[candidates] = _contains(region_poly, lats[candidates], lons[candidates])
+    return ret
+
+
+def _contains(region_poly, xs, ys):
+    import shapely
+
+    if hasattr(shapely, 'contains_xy'):
+        shapely.prepare(region_poly)
+        return shapely.contains_xy(region_poly, xs, ys)
+
+    # shapely < 2
+    from shapely.vectorized import contains
+    return contains(region_poly, xs, ys)
+
+
+class _PointGrid(object):
+    # Points binned into square cells, for finding the ones in a bounding box without scanning
+    # them all.
+
+    def __init__(self, xs, ys, cell_size=1.0):
+        self._cell_size = cell_size
+        valid = np.flatnonzero(np.isfinite(xs) & np.isfinite(ys))
+        rows = np.floor(xs[valid] / cell_size).astype(np.int64)
+        cols = np.floor(ys[valid] / cell_size).astype(np.int64)
+
+        self._min_row, self._min_col = (rows.min(), cols.min()) if len(valid) else (0, 0)
+        self._numcols = (cols.max() - self._min_col + 1) if len(valid) else 1
+        keys = (rows - self._min_row) * self._numcols + (cols - self._min_col)
+
+        order = np.argsort(keys, kind='mergesort')
+        self._keys = keys[order]
+        self._positions = valid[order]
+
+    def candidates(self, bounds):
+        # positions of the points in the cells overlapping (min_x, min_y, max_x, max_y)
+        min_x, min_y, max_x, max_y = bounds
+        first_row = max(int(np.floor(min_x / self._cell_size)) - self._min_row, 0)
+        last_row = int(np.floor(max_x / self._cell_size)) - self._min_row
+        first_col = max(int(np.floor(min_y / self._cell_size)) - self._min_col, 0)
+        last_col = min(int(np.floor(max_y / self._cell_size)) - self._min_col, self._numcols - 1)
+        if last_row < first_row or last_col < first_col:
+            return np.array([], dtype=np.int64)
+
+        rows = np.arange(first_row, last_row + 1)
+        starts = np.searchsorted(self._keys, rows * self._numcols + first_col, side='left')
+        ends = np.searchsorted(self._keys, rows * self._numcols + last_col, side='right')
+        return np.sort(np.concatenate([self._positions[start:end] for start, end in zip(starts, ends)]))
+
+
+class EventIndex(object):
+    # The rows of a table with any number of rows per event (locations, fatalities) grouped by
+    # `on` once, so the rows of a set of events are found with a binary search instead of a merge.
+
+    def __init__(self, table, on='event_id'):
+        self.table = table
+        self.on = on
+
+        keys = table[on].values
+        valid = np.flatnonzero(pd.notnull(keys))
+        order = valid[np.argsort(keys[valid], kind='mergesort')]
+        self.keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        self._order = order
+        self._starts = starts
+        self._counts = counts
+
+    def rows(self, keys):
+        # (positions in the table, positions in `keys`) of every match; each key's rows are in
+        # table order
+        keys = np.asarray(keys)
+        if not len(self.keys) or not len(keys):
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+        found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        matched = np.flatnonzero(self.keys[found] == keys)
+        starts = self._starts[found[matched]]
+        counts = self._counts[found[matched]]
+
+        owners = np.repeat(matched, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self._order[np.repeat(starts, counts) + offsets], owners
+
+    def join(self, df, columns=None):
+        # Inner join of `df` (on its `on` column) with the table: the table's rows of each of
+        # df's events, in df order, with the `columns` of df alongside.
+        positions, owners = self.rows(df[self.on].values)
+        ret = self.table.iloc[positions].reset_index(drop=True)
+        for col in columns or ():
+            if col not in ret.columns:
+                ret[col] = df[col].values[owners]
+        return ret
+
+    def totals(self, columns=()):
+        # Per-event aggregates of the table, indexed by key: the number of rows of every key
+        # and the sums of `columns`.
+        ret = pd.DataFrame({'rows': self._counts}, index=pd.Index(self.keys, name=self.on))
+        for col in columns:
+            values = self.table[col].values[self._order]
+            # missing values count as zero; flags are counted
+            values = np.nan_to_num(values) if values.dtype.kind == 'f' else values.astype(np.int64)
+            ret[col] = np.add.reduceat(values, self._starts) if len(values) else values
+        return ret
+
 
+def fatality_totals(fatalities):
+    # Number of fatalities of every event in the fatalities table, and how many were direct
+    # or indirect. Indexed by event id.
+    types = fatalities.fatality_type.astype(object).str.upper()
+    index = EventIndex(fatalities.assign(fatalities_direct=(types == 'D').values,
+                                         fatalities_indirect=(types == 'I').values))
+    totals = index.totals(['fatalities_direct', 'fatalities_indirect'])
+    return totals.rename(columns={'rows': 'fatalities'})
 
-def _is_in_region(event, region_poly):
-    from shapely.geometry import Point
-    pt = Point(event.begin_lat, event.begin_lon)
-    return region_poly.contains(pt)
\ No newline at end of file
@@ -1,5 +1,6 @@
 import warnings
 
+import numpy as np
 import pandas as pd
 
 from wxdata import _timezones as _tzhelp
@@ -20,11 +21,107 @@ def convert_df_tz(df, to_tz='CST', copy=True):
 
     for col in ('begin_date_time', 'end_date_time'):
         if col in df.columns:
-            df[col] = df.apply(lambda row: convert_row_tz(row, col, to_tz), axis=1)
+            df[col] = convert_col_tz(df, col, to_tz)
 
     return sync_datetime_fields(df, to_tz)
 
 
+def convert_col_tz(df, col, to_tz):
+    # Columnar equivalent of applying `convert_row_tz` down `col`. Rows whose `cz_timezone` has a
+    # fixed offset are shifted to UTC straight from `STORMEVENTS_TZ_OFFSETS`; the rest are grouped
+    # by (cz_timezone, state) and resolved once per group, and only rows whose timezone can't be
+    # resolved from those two fields go through the row-wise path.
+    dts = df[col]
+    new_tz_pd = _pdtz_from_str(to_tz)
+
+    if pd.api.types.is_datetime64tz_dtype(dts):
+        # already localized, the instant is kept as-is
+        return dts.dt.tz_convert(new_tz_pd)
+    if not pd.api.types.is_datetime64_dtype(dts):
+        return df.apply(lambda row: convert_row_tz(row, col, to_tz), axis=1)
+
+    naive_ns = dts.values.view(np.int64)
+    offsets = _tz_offsets(df['cz_timezone'])
+    # older Alaskan data logs AKST as AST, see `convert_row_tz`
+    offsets[((df['cz_timezone'] == 'AST') & (df['state'] == 'ALASKA')).values] = -540
+    fixed = ~np.isnan(offsets)
+
+    utc_ns = naive_ns.copy()
+    utc_ns[fixed] -= offsets[fixed].astype(np.int64) * _NS_PER_MINUTE
+    rowwise = ~fixed
+
+    unresolved = np.flatnonzero(rowwise)
+    groups = df.iloc[unresolved].groupby(['cz_timezone', 'state'], sort=False, observed=True).indices
+    for (cz_timezone, state), positions in groups.items():
+        from_tz = _group_tz(cz_timezone, state)
+        if from_tz is None:
+            continue
+
+        positions = unresolved[positions]
+        offset = from_tz.utcoffset(None)
+        if offset is None:
+            # not a fixed-offset timezone; let pandas handle the DST rules for this group
+            localized = dts.iloc[positions].dt.tz_localize(from_tz).dt.tz_convert('UTC')
+            utc_ns[positions] = localized.values.view(np.int64)
+        else:
+            utc_ns[positions] = naive_ns[positions] - pd.Timedelta(offset).value
+        rowwise[positions] = False
+
+    utc_ns[dts.isnull().values] = pd.NaT.value
+
+    for position in np.flatnonzero(rowwise):
+        utc_ns[position] = convert_row_tz(df.iloc[position], col, to_tz).value
+
+    converted = pd.DatetimeIndex(utc_ns.view('datetime64[ns]')).tz_localize('UTC').tz_convert(new_tz_pd)
+    return pd.Series(converted, index=df.index, name=col)
+
+
+_NS_PER_MINUTE = 60 * 10 ** 9
+
+
+def localize_col_from_utc(df, col):
+    # Attaches each row's `cz_timezone` to `col`, whose values are UTC instants (or naive UTC
+    # times) as pandas reads them from a CSV with offsets. Equivalent to applying
+    # `convert_timestamp_tz(row[col], 'UTC', row.cz_timezone)` down the frame: a single timezone
+    # gives a tz-aware column, mixed timezones an object column of Timestamps.
+    dts = df[col]
+    if pd.api.types.is_datetime64tz_dtype(dts):
+        utc = dts.dt.tz_convert('UTC')
+    elif pd.api.types.is_datetime64_dtype(dts):
+        utc = dts.dt.tz_localize('UTC')
+    else:
+        utc = pd.to_datetime(dts, utc=True)
+    codes, cz_timezones = pd.factorize(df['cz_timezone'], sort=False)
+    if (codes == -1).any():
+        raise ValueError("Cannot localize `{}` of rows without a `cz_timezone`".format(col))
+    # resolved once per distinct string; unresolvable ones raise like the row-wise path would
+    tzs = [_pdtz_from_str(cz_timezone) for cz_timezone in cz_timezones]
+
+    if len(tzs) == 1 and (codes == 0).all():
+        return utc.dt.tz_convert(tzs[0])
+
+    localized = np.full(len(df), pd.NaT, dtype=object)
+    utc_index = pd.DatetimeIndex(utc.values)
+    for code, tz in enumerate(tzs):
+        positions = np.flatnonzero(codes == code)
+        localized[positions] = utc_index[positions].tz_localize('UTC').tz_convert(tz).astype(object)
+    return pd.Series(localized, index=df.index, name=col)
+
+
+def _group_tz(cz_timezone, state):
+    # Mirrors the timezone resolution in `convert_row_tz` for a whole (cz_timezone, state)
+    # group. Returns None when the row-wise path (lat/lon lookup) is needed.
+    if cz_timezone == 'AST':
+        return _pdtz_from_str('AKST-9' if state == 'ALASKA' else 'AST-4')
+    try:
+        return _pdtz_from_str(cz_timezone)
+    except ValueError:
+        try:
+            return _tzhelp.tz_for_state(state)
+        except (AttributeError, KeyError):
+            return None
+
+
 def convert_row_tz(row, col, to_tz):
     try:
         state = row['state']
@@ -70,13 +167,18 @@ def convert_row_tz(row, col, to_tz):
 def convert_timestamp_tz(timestamp, from_tz, to_tz):
     original_tz_pd = _pdtz_from_str(from_tz)
     new_tz_pd = _pdtz_from_str(to_tz)
-    return pd.Timestamp(timestamp, tz=original_tz_pd).tz_convert(new_tz_pd)
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is not None:
+        # already localized, so `from_tz` doesn't apply
+        return timestamp.tz_convert(new_tz_pd)
+    return timestamp.tz_localize(original_tz_pd).tz_convert(new_tz_pd)
 
 
 def localize_timestamp_tz(timestamp, tz):
     return convert_timestamp_tz(timestamp, tz, tz)
 
 
+@_tzhelp._memoized
 def _pdtz_from_str(tz_str):
     if not tz_str or tz_str in ('UTC', 'GMT'):
         import pytz
@@ -94,7 +196,17 @@ def _pdtz_from_str(tz_str):
     return _tzhelp.parse_tz(tz_str)
 
 
+def _tz_offsets(cz_timezones):
+    # Per-row `utc_offset_minutes` of a `cz_timezone` column, each distinct string looked up
+    # once; NaN where the string alone doesn't give a fixed offset.
+    codes, uniques = pd.factorize(np.asarray(cz_timezones, dtype=object))
+    offsets = np.array([_tzhelp.utc_offset_minutes(tz_str) for tz_str in uniques], dtype=float)
+    return np.append(offsets, np.nan)[codes]
+
+
 def sync_datetime_fields(df, tz=None):
+    # The derived fields are built from integer datetime components rather than strftime, and
+    # stored as categoricals of the same strings (each distinct value formatted once).
     for prefix in ('begin', 'end'):
         dt_col = '{}_date_time'.format(prefix)
         if dt_col in df.columns:
@@ -105,9 +217,9 @@ def sync_datetime_fields(df, tz=None):
             day_col = '{}_day'.format(prefix)
 
             if yearmonth_col in df.columns:
-                df[yearmonth_col] = dts.strftime('%Y%m')
+                df[yearmonth_col] = _formatted_ints(dts.year * 100 + dts.month, '{:06d}', df.index)
             if time_col in df.columns:
-                df[time_col] = dts.strftime('%H%M')
+                df[time_col] = _formatted_ints(dts.hour * 100 + dts.minute, '{:04d}', df.index)
             if day_col in df.columns:
                 df[day_col] = dts.day
 
@@ -115,7 +227,8 @@ def sync_datetime_fields(df, tz=None):
                 df['year'] = dts.year
 
             if prefix == 'begin' and 'month_name' in df.columns:
-                df['month_name'] = dts.strftime('%B')
+                codes = dts.month.fillna(0).values.astype(np.int64) - 1
+                df['month_name'] = pd.Series(pd.Categorical.from_codes(codes, _MONTH_NAMES), index=df.index)
 
     if tz is not None:
         df['cz_timezone'] = tz
@@ -123,6 +236,17 @@ def sync_datetime_fields(df, tz=None):
     return df
 
 
+_MONTH_NAMES = ('January', 'February', 'March', 'April', 'May', 'June', 'July',
+                'August', 'September', 'October', 'November', 'December')
+
+
+def _formatted_ints(ints, fmt, index):
+    # missing (NaT) components stay missing, as with strftime
+    codes, uniques = pd.factorize(ints.values, sort=True)
+    labels = [fmt.format(int(value)) for value in uniques]
+    return pd.Series(pd.Categorical.from_codes(codes, labels), index=index)
+
+
 def df_tz(df):
     all_tzs = df.cz_timezone.unique()
     if len(all_tzs) != 1:
@@ -2,8 +2,10 @@ import pandas as pd
 import numpy as np
 
 from wxdata import _timezones as _tz
+from wxdata.geog import dists_between
 from wxdata.plotting import sample_colors, plot_lines
-from wxdata.stormevents.temporal import sync_datetime_fields, localize_timestamp_tz
+from wxdata.stormevents.operations import EventIndex
+from wxdata.stormevents.temporal import sync_datetime_fields, localize_timestamp_tz, _pdtz_from_str
 
 __all__ = ['longevity', 'ef', 'speed_mph', 'correct_tornado_times',
            'discretize', 'discretize_tor', 'plot_tornadoes', 'plot_time_progression']
@@ -39,13 +41,53 @@ def speed_mph(df, floor_longevity=None):
 def correct_tornado_times(df, copy=True):
     if copy:
         df = df.copy()
-    vals = df[['event_type', 'begin_date_time', 'end_date_time', 'tor_length']].values
 
-    df[['begin_date_time', 'end_date_time']] = np.apply_along_axis(_corrected_times_for,
-                                                                   axis=1, arr=vals)
+    begin, end = _corrected_times(df.event_type, df.begin_date_time, df.end_date_time, df.tor_length)
+    df['begin_date_time'] = begin
+    df['end_date_time'] = end
     return sync_datetime_fields(df)
 
 
+def _corrected_times(event_type, begin_date_time, end_date_time, torlen):
+    # The rules of `_corrected_times_for` as masks over whole columns. NaT compares false, so
+    # rows missing a time take the same branches as they do there.
+    forward = end_date_time >= begin_date_time
+    # assume times were accidentally swapped in entries
+    swapped = ~forward & (begin_date_time - end_date_time < _TORNADO_LONVEVITY_LIMIT)
+    # off-by-one error in date entry
+    wrong_date = ~forward & ~swapped
+
+    begin = begin_date_time.mask(swapped, end_date_time)
+    end = _corrected_end_times(begin, end_date_time.mask(swapped, begin_date_time), torlen)
+    end = end.mask(wrong_date, end_date_time + _ONE_DAY)
+
+    is_tornado = event_type == 'Tornado'
+    return begin.where(is_tornado, begin_date_time), end.where(is_tornado, end_date_time)
+
+
+def _corrected_end_times(begin, end, torlen):
+    elapsed = pd.to_timedelta(end - begin)
+
+    # the longest-lived tornado as of 2017 is the tri-state tornado (3.5 hr)
+    # anything greater than 4 is certainly suspicious.
+    too_long = elapsed >= _TORNADO_LONVEVITY_LIMIT
+    # if possibly not a brief touchdown, assume end-time was entered with wrong day;
+    # otherwise assume a brief touchdown
+    wrong_day = too_long & ~(torlen < 0.3) & (end >= begin + _ONE_DAY)
+    brief_touchdown = too_long & ~wrong_day
+
+    # assume off-by-one error in hour if tornado is moving erroneously slowly
+    elapsed_sec = elapsed.dt.seconds
+    over_hour = ~too_long & (elapsed >= _ONE_HOUR)
+    slow = over_hour & (torlen / (elapsed_sec.where(over_hour) / 3600) < 8)
+    # as in `_corrected_times_for`, `hours - 1` goes in as nanoseconds
+    hour_fixed = begin + elapsed % _ONE_HOUR + pd.to_timedelta((elapsed_sec // 3600 - 1).fillna(0), unit='ns')
+
+    end = end.mask(brief_touchdown, begin)
+    end = end.mask(wrong_day, begin + elapsed % _ONE_DAY)
+    return end.mask(slow, hour_fixed)
+
+
 def _corrected_times_for(torn, indices=None):
     mandatory = ('event_type', 'begin_date_time', 'end_date_time', 'tor_length')
     if indices is None:
@@ -99,16 +141,135 @@ def _corrected_times_for(torn, indices=None):
     return [result_begin, result_end]
 
 
-def discretize(df, spacing_min=1):
-    foreachtor = [discretize_tor(tor, spacing_min) for _, tor in df.iterrows()]
-    return pd.concat(foreachtor, ignore_index=True)
+def discretize(df, spacing_min=1, endpoint=False, locations=None):
+    # With `locations` (the locations table or an `EventIndex` of it), tornadoes with a
+    # multi-point path follow it instead of the straight line from begin to end point.
+    return _discretize(df, spacing_min, endpoint, locations)[0]
+
+
+def _discretize(df, spacing_min=1, endpoint=False, locations=None):
+    # Same points as running `discretize_tor` over every row, built for all rows at once: each
+    # row's points are `begin + k * (end - begin) / numpoints` for k below its point count.
+    # Also returns k for every point.
+    if df.empty:
+        return pd.DataFrame(columns=['lat', 'lon', 'event_id', 'timestamp']), np.array([], dtype=np.int64)
+
+    elapsed_min = ((df.end_date_time - df.begin_date_time) / _ONE_MINUTE).values.astype(np.float64)
+    if np.isnan(elapsed_min).any():
+        raise ValueError("cannot discretize tornadoes without begin and end times")
+    numpoints = (elapsed_min // spacing_min).astype(np.int64)
+    numpoints[numpoints == 0] = 1
+    if (numpoints < 0).any():
+        raise ValueError("tornadoes can't end before they begin")
+
+    rows = np.repeat(np.arange(len(df)), numpoints)
+    steps = np.arange(numpoints.sum()) - np.repeat(np.cumsum(numpoints) - numpoints, numpoints)
+    divisions = numpoints - 1 if endpoint else numpoints
+    ends_at = (np.cumsum(numpoints) - 1)[numpoints > 1] if endpoint else None
+
+    def spaced(begin, end):
+        # np.linspace(begin, end, numpoints, endpoint=endpoint) for every row
+        begin = np.asarray(begin, dtype=np.float64)
+        end = np.asarray(end, dtype=np.float64)
+        step = (end - begin) / np.maximum(divisions, 1)
+        ret = steps * step[rows] + begin[rows]
+        if endpoint:
+            ret[ends_at] = end[numpoints > 1]
+        return ret
+
+    tzstrs = df.cz_timezone.values
+    t0 = np.empty(len(df), dtype=np.int64)
+    t1 = np.empty(len(df), dtype=np.int64)
+    for tzstr, positions in pd.Series(np.arange(len(df))).groupby(tzstrs, sort=False).indices.items():
+        t0[positions] = _localized_ns(df.begin_date_time.iloc[positions], tzstr)
+        t1[positions] = _localized_ns(df.end_date_time.iloc[positions], tzstr)
+
+    lats = spaced(df.begin_lat.values, df.end_lat.values)
+    lons = spaced(df.begin_lon.values, df.end_lon.values)
+    if locations is not None:
+        fractions = steps / np.maximum(divisions, 1)[rows]
+        on_path, path_lats, path_lons = _along_paths(df.event_id.values, rows, fractions, locations)
+        lats[on_path] = path_lats
+        lons[on_path] = path_lons
+
+    ret = pd.DataFrame({
+        'lat': lats,
+        'lon': lons,
+        'event_id': df.event_id.values[rows]
+    }, columns=['lat', 'lon', 'event_id'])
+
+    times = pd.to_datetime(spaced(t0, t1)).tz_localize('GMT')
+    point_tzs = tzstrs[rows]
+    unique_tzs = pd.unique(tzstrs)
+    if len(unique_tzs) == 1:
+        ret['timestamp'] = times.tz_convert(_tz.parse_tz(unique_tzs[0]))
+    else:
+        # like concatenating frames in different time zones, the column holds each point's
+        # timestamp in its own time zone
+        timestamps = np.empty(len(ret), dtype=object)
+        for tzstr in unique_tzs:
+            in_tz = point_tzs == tzstr
+            timestamps[in_tz] = times[in_tz].tz_convert(_tz.parse_tz(tzstr)).astype(object)
+        ret['timestamp'] = timestamps
+
+    return ret, steps
+
+
+def _along_paths(event_ids, rows, fractions, locations):
+    # Positions `fractions` of the way, by distance, along the path through the location points
+    # (in `location_index` order) of the event at `rows`. Returns a mask of the points whose
+    # event has a path of two or more distinct points, and their lats and lons.
+    index = locations if isinstance(locations, EventIndex) else EventIndex(locations)
+    positions, owners = index.rows(event_ids)
+    vertices = index.table.iloc[positions]
+    vlats = vertices.latitude.values.astype(np.float64)
+    vlons = vertices.longitude.values.astype(np.float64)
+
+    order = np.lexsort((vertices.location_index.values, owners))
+    order = order[np.isfinite(vlats[order]) & np.isfinite(vlons[order])]
+    owners, vlats, vlons = owners[order], vlats[order], vlons[order]
+    if not len(owners):
+        return np.zeros(len(rows), dtype=bool), np.array([]), np.array([])
+
+    # distance along the concatenated paths, not counting the jumps from one path to the next
+    same_path = owners[1:] == owners[:-1]
+    legs = np.where(same_path, dists_between(vlats[:-1], vlons[:-1], vlats[1:], vlons[1:]), 0.0)
+    along = np.concatenate([[0.0], np.cumsum(legs)])
+    firsts = np.flatnonzero(np.concatenate([[True], ~same_path]))
+    lasts = np.concatenate([firsts[1:] - 1, [len(owners) - 1]])
+    lengths = along[lasts] - along[firsts]
+
+    path_of_row = np.full(len(event_ids), -1, dtype=np.int64)
+    with_path = np.flatnonzero(lengths > 0)
+    path_of_row[owners[firsts[with_path]]] = with_path
+
+    paths = path_of_row[rows]
+    on_path = paths >= 0
+    paths = paths[on_path]
+    target = along[firsts[paths]] + fractions[on_path] * lengths[paths]
+
+    leg = np.clip(np.searchsorted(along, target, side='right') - 1, firsts[paths], lasts[paths] - 1)
+    leg_length = along[leg + 1] - along[leg]
+    weight = np.where(leg_length > 0, (target - along[leg]) / np.where(leg_length > 0, leg_length, 1), 0.0)
+    return (on_path,
+            vlats[leg] + weight * (vlats[leg + 1] - vlats[leg]),
+            vlons[leg] + weight * (vlons[leg + 1] - vlons[leg]))
+
+
+def _localized_ns(times, tzstr):
+    # nanoseconds since the epoch of `times`, where naive times are in `tzstr`
+    if hasattr(times.dtype, 'tz'):
+        return times.values.view(np.int64)
+    if np.issubdtype(times.dtype, np.datetime64):
+        return pd.DatetimeIndex(times).tz_localize(_pdtz_from_str(tzstr)).asi8
+    return np.array([localize_timestamp_tz(time, tzstr).value for time in times], dtype=np.int64)
 
 
 def discretize_tor(torn_seg, spacing_min=1, endpoint=False):
     elapsed_min = (torn_seg.end_date_time - torn_seg.begin_date_time) / pd.Timedelta('1 min')
     tzstr = torn_seg.cz_timezone
     slat, slon, elat, elon = torn_seg.begin_lat, torn_seg.begin_lon, torn_seg.end_lat, torn_seg.end_lon
-    numpoints = elapsed_min // spacing_min
+    numpoints = int(elapsed_min // spacing_min)
 
     if numpoints == 0:
         numpoints = 1
@@ -178,16 +339,56 @@ def plot_time_progression(tordf, basemap, time_buckets, cmap='viridis',
 
 
 def bucket_events(df, timebuckets):
+    # Each bucket gets the part of every tornado's path within it, as one frame per tornado
+    # numbered like the points of `discretize_tor(event, endpoint=True)`.
     assert isinstance(df, pd.DataFrame)
     bucketed = {bucket: [] for bucket in timebuckets}
+    if df.empty:
+        return bucketed
+
+    pts, numbers = _discretize(df, endpoint=True)
+    pts.index = numbers
+    single_tz = hasattr(pts.timestamp.dtype, 'tz')
+
+    times = _timestamps_ns(pts.timestamp)
+    order = np.argsort(times, kind='mergesort')
+    sorted_times = times[order]
+    aware = _is_aware(pts.timestamp)
+
+    for bucket in bucketed:
+        timebucket_start, timebucket_end = [_timestamp_ns(bound, aware) for bound in bucket]
+        lo, hi = np.searchsorted(sorted_times, [timebucket_start, timebucket_end], side='left')
+        if lo >= hi:
+            continue
+
+        positions = np.sort(order[lo:hi])
+        # split wherever the tornado changes, or its points stop being consecutive
+        breaks = np.flatnonzero((np.diff(positions) != 1) | (numbers[positions[1:]] == 0)) + 1
+        for event_positions in np.split(positions, breaks):
+            bucket_pts = pts.iloc[event_positions]
+            if not single_tz:
+                # a single tornado's points are all in its own time zone
+                bucket_pts = bucket_pts.assign(timestamp=pd.DatetimeIndex(bucket_pts.timestamp.values))
+            bucketed[bucket].append(bucket_pts)
+    return bucketed
 
-    for _, event in df.iterrows():
-        pts = discretize_tor(event, endpoint=True)
 
-        for index, bucket in enumerate(bucketed):
-            timebucket_start, timebucket_end = bucket
-            bucket_pts = pts[(pts.timestamp >= timebucket_start) & (pts.timestamp < timebucket_end)]
+def _timestamps_ns(timestamps):
+    if hasattr(timestamps.dtype, 'tz') or np.issubdtype(timestamps.dtype, np.datetime64):
+        return timestamps.values.view(np.int64)
+    return np.array([timestamp.value for timestamp in timestamps], dtype=np.int64)
 
-            if not bucket_pts.empty:
-                bucketed[bucket].append(bucket_pts)
-    return bucketed
+
+def _is_aware(timestamps):
+    if hasattr(timestamps.dtype, 'tz'):
+        return True
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        return False
+    return len(timestamps) > 0 and timestamps.iloc[0].tzinfo is not None
+
+
+def _timestamp_ns(timestamp, aware):
+    timestamp = pd.Timestamp(timestamp)
+    if (timestamp.tzinfo is not None) != aware:
+        raise TypeError("Cannot compare tz-naive and tz-aware timestamps")
+    return timestamp.value
@@ -1,7 +1,14 @@
+import errno
+import os
+import pickle
+import warnings
+
+import geopy.distance
 import numpy as np
 import pandas as pd
 
-from wxdata.geog import angle_between, dist_between
+from wxdata import workdir
+from wxdata.geog import angles_between, dists_between
 from wxdata.workdir import savefile
 
 _LATEST_IBTRACS_VERSION = 'v03r10'
@@ -23,99 +30,308 @@ def ibtracs_basin(basin, kind='wmo', version=_LATEST_IBTRACS_VERSION):
     return _load_ibtracs_df(_BASE_IBTRACS_URL + path)
 
 
+def ibtracs_index(basin, kind='wmo', version=_LATEST_IBTRACS_VERSION):
+    path = '/{version}/{kind}/csv/basin/Basin.{basin}.ibtracs_{kind}.{version}.csv'.format(
+        basin=basin.upper(), version=version, kind=kind.lower())
+
+    return _load_ibtracs_index(_BASE_IBTRACS_URL + path)
+
+
 def _load_ibtracs_df(url):
     save_to_local = savefile(url, in_subdir='ibtracs')
+    return _read_ibtracs(save_to_local.dest)
+
+
+def _load_ibtracs_index(url):
+    save_to_local = savefile(url, in_subdir='ibtracs')
+    return _read_ibtracs_index(save_to_local.dest)
+
+
+# Column types of the IBTrACS CSVs, by their header names. Columns not listed here are
+# left to pandas to infer.
+_IBTRACS_DTYPES = {
+    'Serial_Num': object,
+    'Basin': 'category',
+    'Sub_basin': 'category',
+    'Name': 'category',
+    'Nature': 'category',
+    'Center': 'category',
+    'Track_type': 'category',
+    'Latitude': np.float32,
+    'Longitude': np.float32,
+    'Wind(WMO)': np.float32,
+    'Pres(WMO)': np.float32,
+    'Wind(WMO) Percentile': np.float32,
+    'Pres(WMO) Percentile': np.float32
+}
+
+_IBTRACS_NA_VALUES = ['', 'N/A', 'NaN', 'nan']
+
+_IBTRACS_CACHE_SUBDIR = os.path.join('_cache', 'ibtracs')
+
+
+def _read_ibtracs(path):
+    # The parsed file is cached next to the work directory as parquet, under the name of the
+    # CSV (which carries the IBTrACS version and kind), and re-parsed when the CSV is newer.
+    cache_path = _ibtracs_cache_path(path)
+    if cache_path is not None and os.path.exists(cache_path) \
+            and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        return _parquet().read_table(cache_path, memory_map=True).to_pandas()
+
+    df = _read_ibtracs_csv(path)
+    if cache_path is not None:
+        _write_ibtracs_cache(cache_path, df)
+    return df
+
 
-    df = pd.read_csv(save_to_local.dest, header=1, parse_dates=['ISO_time'], skiprows=[2])
+def _write_ibtracs_cache(cache_path, df):
+    import pyarrow as pa
+
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    try:
+        _makedirs_for(cache_path)
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, cache_path)
+    except (pa.ArrowException, OSError) as e:
+        # the cache is optional; the parsed frame is returned either way
+        warnings.warn("Could not cache {}: {!r}".format(cache_path, e))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _read_ibtracs_csv(path):
+    # The first line is a title and the one after the header holds the units. 'NA' is the
+    # North Atlantic basin, not a missing value.
+    df = pd.read_csv(path, header=1, skiprows=[2], skipinitialspace=True,
+                     dtype=_IBTRACS_DTYPES, parse_dates=['ISO_time'],
+                     keep_default_na=False, na_values=_IBTRACS_NA_VALUES)
     df.columns = [col.replace('(WMO)', '').replace(' ', '_').lower() for col in df.columns]
 
-    df = df.applymap(lambda x: x.strip() if type(x) is str else x)
+    # `skipinitialspace` takes care of the padding in front of the values; the padding behind
+    # them is stripped from the unique values only.
+    for col in df.columns:
+        if df[col].dtype.name == 'category':
+            df[col] = _strip_categories(df[col])
+        elif df[col].dtype == object:
+            df[col] = df[col].str.strip()
     return df
 
 
+def _strip_categories(series):
+    categories = series.cat.categories
+    if categories.dtype != object:
+        return series
+    stripped = categories.str.strip()
+    if stripped.is_unique:
+        return series.cat.rename_categories(stripped)
+    return series.astype(object).str.strip().astype('category')
+
+
+def _ibtracs_cache_path(path):
+    if _parquet() is None:
+        return None
+
+    cachedir = _ibtracs_cache_dir()
+    if cachedir is None:
+        return None
+
+    filename, _ = os.path.splitext(os.path.basename(path))
+    return os.path.join(cachedir, filename + '.parquet')
+
+
+def _ibtracs_cache_dir():
+    # The directory is only created right before something is written to it, so that reading
+    # from a read-only work directory doesn't need to write anything.
+    try:
+        return os.path.join(workdir.get(), _IBTRACS_CACHE_SUBDIR)
+    except workdir.WorkDirectoryException:
+        return None
+
+
+def _makedirs_for(path):
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _parquet():
+    try:
+        import pyarrow.parquet as pq
+        return pq
+    except ImportError:
+        return None
+
+
+def _read_ibtracs_index(path):
+    # The index of a file is pickled in the cache directory alongside the parsed file, and
+    # rebuilt when the CSV is newer.
+    df = _read_ibtracs(path)
+
+    cachedir = _ibtracs_cache_dir()
+    if cachedir is None:
+        return TrackIndex(df)
+
+    filename, _ = os.path.splitext(os.path.basename(path))
+    index_path = os.path.join(cachedir, filename + '.index.pkl')
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        try:
+            index = TrackIndex.load(index_path, df)
+        except ValueError:
+            # written by an older version, or not an index at all; it's rebuilt below
+            index = None
+        if index is not None:
+            return index
+
+    index = TrackIndex(df)
+    try:
+        _makedirs_for(index_path)
+        index.save(index_path)
+    except OSError as e:
+        warnings.warn("Could not cache {}: {!r}".format(index_path, e))
+    return index
+
+
 ### calcs
 
 
 def delta(df, quantity, dt='6 hr'):
-    series = {}
     dt = pd.Timedelta(dt)
-    for _, storm in df.groupby('serial_num'):
-        for index, row in storm.iterrows():
-            current_time = row.iso_time
-            next_time = current_time + dt
-            try:
-                next_row = storm[storm.iso_time == next_time].iloc[0]
-                dquantity = next_row[quantity] - row[quantity]
-                series[index] = dquantity
-            except (IndexError, KeyError):
-                continue
+    paired = _pair_with_later(df, dt, [quantity])
+    dquantity = paired[quantity + '_later'].values - paired[quantity].values
+    return pd.Series(dquantity, index=paired['_label'].values)
 
-    return pd.Series(series)
 
+def _pair_with_later(df, dt, columns):
+    # Pairs every fix with the fix of the same storm `dt` later (the first one, if there are
+    # duplicates), dropping fixes that have none. Rows come out ordered by serial number, then
+    # by their order in `df`. The later fix's values are in the `<column>_later` columns and
+    # the original index label is in `_label`.
+    keys = ['serial_num', 'iso_time']
+    columns = [col for col in columns if col not in keys]
 
-def label_ri(df, keep_dwind=False, dwind_col=None):
-    labels = {}
+    fixes = df.loc[df.serial_num.notnull() & df.iso_time.notnull(), keys + columns].copy()
+    fixes['_label'] = fixes.index
+    fixes['_position'] = np.arange(len(fixes))
+
+    later = fixes.drop_duplicates(keys)[keys + columns].copy()
+    later['iso_time'] = later.iso_time - dt
+    later.columns = keys + [col + '_later' for col in columns]
+
+    paired = fixes.merge(later, on=keys, how='inner', sort=False)
+    return paired.sort_values(['serial_num', '_position'])
+
+
+def label_ri(df, keep_dwind=False, dwind_col=None, threshold=30.0, window='24 hours'):
+    # A fix is labeled RI if the wind increases by at least `threshold` over the next `window`,
+    # and so is every later fix of the storm within `window` of such an onset. A storm's fixes
+    # are followed by consecutive index labels, as they are in a freshly loaded basin.
+    window = pd.Timedelta(window)
     if dwind_col is None:
-        df['dwind'] = delta(df, 'wind', dt='24 hours')
+        df['dwind'] = delta(df, 'wind', dt=window)
     else:
         df['dwind'] = df[dwind_col]
 
-    for _, storm in df.groupby('serial_num'):
-        for index, row in storm.iterrows():
-            if row['dwind'] >= 30.0:
-                init_time = row.iso_time
-                labels[index] = True
-                internal_index = index
-
-                while True:
-                    internal_index += 1
-                    try:
-                        next_row = storm.loc[internal_index]
-                    except KeyError:
-                        break
-                    next_time = next_row.iso_time
-
-                    if next_time > init_time + pd.Timedelta('24 hours'):
-                        labels[next_row.name] = False
-                        break
-                    else:
-                        labels[next_row.name] = True
-            elif index not in labels:
-                labels[index] = False
+    fixes = df.loc[df.serial_num.notnull(), ['serial_num', 'iso_time', 'dwind']].copy()
+    fixes['_position'] = np.arange(len(fixes))
+    fixes = fixes.sort_values(['serial_num', '_position'])
+
+    labels = _ri_labels(fixes, threshold, window)
 
     if not keep_dwind or (dwind_col is not None and dwind_col != 'dwind'):
         del df['dwind']
-    return pd.Series(labels)
+    return labels
+
+
+def _ri_labels(fixes, threshold, window):
+    numfixes = len(fixes)
+    positions = np.arange(numfixes)
+    index_labels = np.array(fixes.index)
+    serial_nums = fixes.serial_num.values
+    times = fixes.iso_time.values.view(np.int64)
+    onsets = (fixes.dwind >= threshold).values
+
+    new_storm = np.ones(numfixes, dtype=bool)
+    new_storm[1:] = serial_nums[1:] != serial_nums[:-1]
+    storm_ids = np.cumsum(new_storm) - 1
+    storm_starts = np.flatnonzero(new_storm)
+    storm_ends = np.append(storm_starts[1:], numfixes)
+
+    # runs of a storm's fixes with consecutive index labels
+    new_run = new_storm.copy()
+    new_run[1:] |= index_labels[1:] != index_labels[:-1] + 1
+    run_ids = np.cumsum(new_run) - 1
+    run_starts = np.flatnonzero(new_run)
+    run_ends = np.append(run_starts[1:], numfixes)
+
+    # The vectorized rules below need each storm's index to increase down the frame and each
+    # run's times to be sorted; storms that don't, or have missing times, are walked fix by fix.
+    irregular = fixes.iso_time.isnull().values.copy()
+    irregular[1:] |= ~new_storm[1:] & (index_labels[1:] <= index_labels[:-1])
+    irregular[1:] |= ~new_run[1:] & (times[1:] < times[:-1])
+    irregular_storms = np.unique(storm_ids[irregular])
+    in_irregular_storm = np.in1d(storm_ids, irregular_storms)
+
+    # For every onset, the first fix of its run more than `window` later (or the run's end),
+    # found with one binary search over (run, time) keys.
+    query_times = times + window.value
+    uniq_times, ranks = np.unique(np.concatenate([times, query_times]), return_inverse=True)
+    ranks[np.tile(in_irregular_storm, 2)] = 0
+    run_keys = run_ids * (len(uniq_times) + 1)
+    window_ends = np.searchsorted(run_keys + ranks[:numfixes], run_keys + ranks[numfixes:], side='right')
+    window_ends = np.minimum(window_ends, run_ends[run_ids])
+
+    # each fix belongs to the window of the last onset before it in its run, if it's in one
+    last_onsets = np.maximum.accumulate(np.where(onsets, positions, -1))
+    in_run = last_onsets >= run_starts[run_ids]
+    labels = in_run & (positions < window_ends[np.where(in_run, last_onsets, 0)])
+
+    for storm_id in irregular_storms:
+        start, end = storm_starts[storm_id], storm_ends[storm_id]
+        storm_labels = _walk_ri_labels(index_labels[start:end], fixes.iso_time.iloc[start:end].tolist(),
+                                       onsets[start:end], window)
+        index_labels[start:end] = list(storm_labels.keys())
+        labels[start:end] = list(storm_labels.values())
+
+    return pd.Series(labels, index=index_labels)
+
+
+def _walk_ri_labels(index_labels, times, onsets, window):
+    # follows a storm fix by fix, from each onset on to the next index labels
+    storm = {label: (time, onset) for label, time, onset in zip(index_labels, times, onsets)}
+    labels = {}
+    for label in index_labels:
+        time, onset = storm[label]
+        if onset:
+            labels[label] = True
+            next_label = label + 1
+            while next_label in storm:
+                if storm[next_label][0] > time + window:
+                    labels[next_label] = False
+                    break
+                labels[next_label] = True
+                next_label += 1
+        elif label not in labels:
+            labels[label] = False
+    return labels
 
 
 def heading(df, dt='6 hr', to_xy=True, xy_unit='kt'):
-    points = []
     dt = pd.Timedelta(dt)
-    for _, storm in df.groupby('serial_num'):
-        for index, row in storm.iterrows():
-            current_time = row.iso_time
-            result = {}
-            this_row = row
-            try:
-                next_time = current_time + dt
-                next_row = storm[storm.iso_time == next_time].iloc[0]
-            except IndexError:
-                # we don't have a position at that hour. Maybe we've reached the end?
-                continue
-
-            this_point = (this_row.latitude, this_row.longitude)
-            next_point = (next_row.latitude, next_row.longitude)
-
-            result['angle'] = angle_between(this_point, next_point)
-            result['dist'] = dist_between(this_point, next_point)
-            result['name'] = row['name']
-            result['season'] = row['season']
-            result['iso_time'] = row.iso_time
-            result['serial_num'] = row.serial_num
-
-            points.append(result)
-
-    ret = pd.DataFrame(points)
+    paired = _pair_with_later(df, dt, ['latitude', 'longitude', 'name', 'season'])
+    lats, lons = paired.latitude.values, paired.longitude.values
+    next_lats, next_lons = paired.latitude_later.values, paired.longitude_later.values
+
+    ret = pd.DataFrame({
+        'angle': angles_between(lats, lons, next_lats, next_lons),
+        'dist': dists_between(lats, lons, next_lats, next_lons),
+        'name': paired['name'].values,
+        'season': paired.season.values,
+        'iso_time': paired.iso_time.values,
+        'serial_num': paired.serial_num.values
+    }, columns=['angle', 'dist', 'name', 'season', 'iso_time', 'serial_num'])
 
     if to_xy:
         ret['x'] = ret['dist'] * np.cos(ret['angle'])
@@ -125,4 +341,181 @@ def heading(df, dt='6 hr', to_xy=True, xy_unit='kt'):
             ret['x'] = ret.x * 0.54 / (dt.total_seconds() / 3600)
             ret['y'] = ret.y * 0.54 / (dt.total_seconds() / 3600)
 
-    return ret
\ No newline at end of file
+    return ret
+
+
+### spatial-temporal index
+
+
+# bumped whenever what `TrackIndex.save` stores changes, so that older index files are rebuilt
+_TRACK_INDEX_VERSION = 1
+
+
+class TrackIndex(object):
+    # Index over the fixes of an IBTrACS frame for "which fixes passed near here between these
+    # times" queries: a haversine BallTree on the positions plus the fixes sorted by latitude
+    # and by time.
+    # Queries take an optional time window, `start` inclusive and `end` exclusive, and return
+    # the matching rows of `fixes` in their original order.
+
+    def __init__(self, df, _tree=None):
+        self.fixes = df[df.latitude.notnull() & df.longitude.notnull() & df.iso_time.notnull()]
+        lats = self.fixes.latitude.values.astype(np.float64)
+        lons = self.fixes.longitude.values.astype(np.float64)
+
+        self._lats = lats
+        self._lons = lons
+        self._times = self.fixes.iso_time.values.astype('datetime64[ns]').view(np.int64)
+        self._lat_order = np.argsort(lats, kind='mergesort')
+        self._sorted_lats = lats[self._lat_order]
+        # rank of each fix in time order, so that a time window is a range of ranks
+        time_order = np.argsort(self._times, kind='mergesort')
+        self._sorted_times = self._times[time_order]
+        self._time_ranks = np.empty(len(time_order), dtype=np.intp)
+        self._time_ranks[time_order] = np.arange(len(time_order))
+
+        if _tree is None:
+            from sklearn.neighbors import BallTree
+            _tree = BallTree(np.radians(np.column_stack([lats, lons])), metric='haversine')
+        self._tree = _tree
+
+    def __len__(self):
+        return len(self.fixes)
+
+    def radius(self, lat, lon, km, start=None, end=None):
+        return self.along_track([lat], [lon], km, start, end)
+
+    def bbox(self, lon0, lon1, lat0, lat1, start=None, end=None):
+        # same corner order as `geog.calc_bbox`; lon0 > lon1 is a box across the dateline
+        lo = np.searchsorted(self._sorted_lats, lat0, side='left')
+        hi = np.searchsorted(self._sorted_lats, lat1, side='right')
+        positions = self._lat_order[lo:hi]
+
+        lons = self._lons[positions]
+        if lon0 <= lon1:
+            in_lons = (lons >= lon0) & (lons <= lon1)
+        else:
+            in_lons = (lons >= lon0) | (lons <= lon1)
+        return self._select(np.sort(positions[in_lons]), start, end)
+
+    def along_track(self, lats, lons, km, start=None, end=None):
+        # Fixes within `km` of the track through the given points, which follows the great circles
+        # between them. The track is sampled every `spacing` km or closer and each sample queried
+        # `spacing / 2` wider than `km`, so that no fix in the buffer is missed; the candidates are
+        # then cut down by their exact distance to the arc whose sample found them.
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        spacing = km / 8.
+        sample_lats, sample_lons, arcs = _densify_track(lats, lons, spacing)
+
+        radius = (km + spacing / 2.) / geopy.distance.EARTH_RADIUS
+        neighbors = self._tree.query_radius(np.radians(np.column_stack([sample_lats, sample_lons])), radius)
+        positions = np.concatenate(neighbors).astype(np.intp)
+        arcs = np.repeat(arcs, [len(found) for found in neighbors])
+
+        track = _unit_vectors(lats, lons)
+        dists = _dists_to_arcs(_unit_vectors(self._lats[positions], self._lons[positions]),
+                               track[arcs], track[np.minimum(arcs + 1, len(track) - 1)])
+        return self._select(np.unique(positions[dists <= km]), start, end)
+
+    def _select(self, positions, start, end):
+        if start is not None or end is not None:
+            lo, hi = 0, len(self._sorted_times)
+            if start is not None:
+                lo = np.searchsorted(self._sorted_times, pd.Timestamp(start).value, side='left')
+            if end is not None:
+                hi = np.searchsorted(self._sorted_times, pd.Timestamp(end).value, side='left')
+            ranks = self._time_ranks[positions]
+            positions = positions[(ranks >= lo) & (ranks < hi)]
+        return self.fixes.iloc[positions]
+
+    def save(self, path):
+        # only the tree is stored; the fixes come from the (cached) file the index is for
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': _TRACK_INDEX_VERSION, 'numfixes': len(self), 'tree': self._tree},
+                        f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def load(cls, path, df):
+        # Returns None if the stored tree isn't for these fixes, and raises ValueError if the file
+        # isn't an index `save` wrote in this format. Loading a pickle runs code from the file, so
+        # only load indexes from a trusted work directory.
+        try:
+            with open(path, 'rb') as f:
+                stored = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            raise ValueError("{} is not a readable track index: {!r}".format(path, e))
+
+        if not isinstance(stored, dict) or stored.get('version') != _TRACK_INDEX_VERSION:
+            raise ValueError("{} is not a track index of format version {}".format(path, _TRACK_INDEX_VERSION))
+        if not isinstance(stored.get('numfixes'), int) or not hasattr(stored.get('tree'), 'query_radius'):
+            raise ValueError("{} is missing the fix count or the tree of a track index".format(path))
+
+        index = cls(df, _tree=stored['tree'])
+        if stored['numfixes'] != len(index):
+            return None
+        return index
+
+
+def _densify_track(lats, lons, max_spacing_km):
+    # Points every `max_spacing_km` or closer along the great circle arcs between consecutive
+    # track points, and the index of the arc each one is on.
+    if len(lats) < 2:
+        return lats, lons, np.zeros(len(lats), dtype=np.intp)
+
+    dists = dists_between(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    steps = np.maximum(np.ceil(dists / max_spacing_km).astype(int), 1)
+
+    segment = np.append(np.repeat(np.arange(len(steps)), steps), len(steps) - 1)
+    frac = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+    frac = np.append(frac / np.repeat(steps, steps).astype(np.float64), 1.)
+
+    # spherical linear interpolation between the ends of each arc; this also takes segments
+    # across the dateline the short way
+    ends = _unit_vectors(lats, lons)
+    omega = (dists / geopy.distance.EARTH_RADIUS)[segment]
+    sin_omega = np.sin(omega)
+    short = sin_omega < 1e-12
+    sin_omega[short] = 1.
+    from_start = np.where(short, 1 - frac, np.sin((1 - frac) * omega) / sin_omega)
+    from_end = np.where(short, frac, np.sin(frac * omega) / sin_omega)
+    points = from_start[:, None] * ends[segment] + from_end[:, None] * ends[segment + 1]
+
+    new_lats = np.degrees(np.arctan2(points[:, 2], np.hypot(points[:, 0], points[:, 1])))
+    new_lons = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+    return new_lats, new_lons, segment
+
+
+def _unit_vectors(lats, lons):
+    lats = np.radians(lats)
+    lons = np.radians(lons)
+    return np.column_stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)])
+
+
+def _dists_to_arcs(points, starts, ends):
+    # Great circle distance in km from each of `points` to the arc between the matching `starts`
+    # and `ends`, all unit vectors. Points whose perpendicular foot falls off the arc are as far
+    # as the nearer end.
+    normals = np.cross(starts, ends)
+    norms = np.linalg.norm(normals, axis=1)
+    degenerate = norms < 1e-12
+    normals /= np.where(degenerate, 1., norms)[:, None]
+
+    sin_cross = np.einsum('ij,ij->i', points, normals)
+    feet = points - sin_cross[:, None] * normals
+    on_arc = ~degenerate & (np.einsum('ij,ij->i', np.cross(starts, feet), normals) >= 0) & \
+        (np.einsum('ij,ij->i', np.cross(feet, ends), normals) >= 0)
+
+    to_ends = np.minimum(_angles(points, starts), _angles(points, ends))
+    angles = np.where(on_arc, np.abs(np.arcsin(np.clip(sin_cross, -1., 1.))), to_ends)
+    return geopy.distance.EARTH_RADIUS * angles
+
+
+def _angles(u, v):
+    return np.arctan2(np.linalg.norm(np.cross(u, v), axis=1), np.einsum('ij,ij->i', u, v))
@@ -14,9 +14,17 @@ def open_resource(filename, *args, **kwargs):
 
 def assert_frame_eq_ignoring_dtypes(df1, df2,
                                     dt_columns=('begin_date_time', 'end_date_time')):
+    # categoricals are compared by their values, like any other column
+    df1, df2 = _decategorize(df1), _decategorize(df2)
     assert_frame_equal(df1, df2, check_dtype=False)
     # the assert_frame_equal function doesn't work with localized vs. naive timestamps.
     # so we need to do another check for datetime columns
     for col in dt_columns:
         if col in df1.columns:
-            assert df1[col].equals(df2[col])
\ No newline at end of file
+            assert df1[col].equals(df2[col])
+
+def _decategorize(df):
+    categoricals = [col for col in df.columns if str(df[col].dtype) == 'category']
+    if not categoricals:
+        return df
+    return df.assign(**{col: df[col].astype(object) for col in categoricals})
@@ -0,0 +1,93 @@
+import shelve
+import sqlite3
+import time
+from unittest import mock
+
+from wxdata import workdir
+from wxdata.cache import LRUCache, SQLiteCache, TieredCache
+from wxdata.utils import persistent_cache
+
+
+def test_lru_cache():
+    lru = LRUCache(maxsize=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1
+    # `b` is now the least recently used
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert lru.get('a') == 1
+    assert lru.get('c') == 3
+    assert len(lru) == 2
+
+
+def test_sqlite_cache_eviction_and_ttl(tmpdir):
+    path = str(tmpdir.join('test.sqlite'))
+    disk = SQLiteCache(path, max_entries=2)
+    disk.set('a', {'value': 1})
+    disk.set('b', (2, 3))
+    disk.get('a')
+    disk.set('c', None)
+
+    assert len(disk) == 2
+    assert disk.get('b') is None
+    assert disk.get('a') == ({'value': 1}, None)
+    # visible from another connection to the same database
+    assert SQLiteCache(path).get('c') == (None, None)
+
+    with mock.patch('wxdata.cache.time.time', return_value=time.time()) as now:
+        expiring = SQLiteCache(path, ttl=60)
+        expiring.set('d', 4)
+        assert expiring.get('d')[0] == 4
+        now.return_value += 61
+        assert expiring.get('d') is None
+
+
+def test_tiered_cache_stats(tmpdir):
+    path = str(tmpdir.join('test.sqlite'))
+    tiered = TieredCache(path)
+    assert tiered.get('a') is None
+    tiered.set('a', 1)
+    assert tiered.get('a') == 1
+
+    # a fresh process only has the disk tier
+    accessed = 'SELECT accessed FROM cache WHERE key = ?'
+    before = sqlite3.connect(path).execute(accessed, ('a',)).fetchone()
+    fresh = TieredCache(path)
+    assert fresh.get('a') == 1
+    assert fresh.get('a') == 1
+    assert fresh.stats == {'memory_hits': 1, 'disk_hits': 1, 'misses': 0}
+    assert tiered.stats == {'memory_hits': 1, 'disk_hits': 0, 'misses': 1}
+    # a disk hit is only promoted into memory; the database isn't written
+    assert sqlite3.connect(path).execute(accessed, ('a',)).fetchone() == before
+
+
+def test_persistent_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    calls = []
+
+    @persistent_cache(filename='squares')
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert [square(2), square(3), square(2)] == [4, 9, 4]
+    assert calls == [2, 3]
+    assert square.cache_info() == {'memory_hits': 1, 'disk_hits': 0, 'misses': 2}
+    assert tmpdir.join('_cache', 'squares.sqlite').check()
+
+
+def test_persistent_cache_migrates_shelve(tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    with shelve.open(str(tmpdir.mkdir('_cache').join('cities'))) as old_cache:
+        old_cache['Norman, OK'] = (35.2, -97.4)
+    calls = []
+
+    @persistent_cache(filename='cities')
+    def find_latlon(loc):
+        calls.append(loc)
+        return 0., 0.
+
+    assert find_latlon('Norman, OK') == (35.2, -97.4)
+    assert find_latlon('Tulsa, OK') == (0., 0.)
+    assert calls == ['Tulsa, OK']
@@ -3,10 +3,12 @@ import os
 import numpy as np
 import pandas as pd
 import xarray as xr
+from sklearn.cluster import DBSCAN
 
 from wxdata import stormevents, _timezones as _tz
 from wxdata.extras import assert_clusters_equal, st_clusters, lat_weighted_spread
-from wxdata.extras.clusters import Cluster, NOISE_LABEL
+from wxdata.extras.clusters import Cluster, NOISE_LABEL, StreamingClusters, _neighbors_graph
+from wxdata.geog import dist_between
 from wxdata.testing import resource_path
 
 
@@ -19,10 +21,9 @@ def test_find_st_clusters():
     clusterfile_dir = resource_path('120414_clusters')
     for clusterfile in os.listdir(clusterfile_dir):
         clusterfile = os.path.join(clusterfile_dir, clusterfile)
-        clusterpts = pd.read_csv(clusterfile, parse_dates=['timestamp'])
+        clusterpts = pd.read_csv(clusterfile)
         # hard-code this for now
-        clusterpts['timestamp'] = clusterpts.apply(
-            lambda r: r['timestamp'].tz_localize('GMT').tz_convert(_tz.parse_tz('CST')), axis=1)
+        clusterpts['timestamp'] = pd.to_datetime(clusterpts.timestamp, utc=True).dt.tz_convert(_tz.parse_tz('CST'))
         cluster_num = clusterpts.loc[0, 'cluster']
         cluster = Cluster(cluster_num, clusterpts, df)
 
@@ -47,6 +48,74 @@ def test_find_st_clusters():
         assert_clusters_equal(actual, expected)
 
 
+def test_neighbors_graph():
+    rng = np.random.RandomState(0)
+    lats = rng.uniform(33, 37, 300)
+    lons = rng.uniform(-90, -85, 300)
+    times = (pd.Timestamp('2012-04-14') + pd.to_timedelta(rng.randint(0, 600, 300), unit='m')).values
+    times = times.astype(np.int64)
+
+    graph = _neighbors_graph(lats, lons, times, 60, 30).toarray() > 0
+    expected = np.array([[abs(times[i] - times[j]) <= 30 * 60 * 10 ** 9 and
+                          dist_between((lats[i], lons[i]), (lats[j], lons[j])) <= 60
+                          for j in range(300)] for i in range(300)])
+    assert (graph == expected).all()
+
+
+def test_streaming_clusters():
+    df = stormevents.load_file(resource_path('120414_tornadoes.csv'))
+    df = df.sort_values('begin_date_time', kind='mergesort')
+
+    # with a window covering the whole day nothing expires, so it's the same as clustering at once
+    streaming = StreamingClusters(60, 60, 15, window_min=24 * 60)
+    for start in range(0, len(df), 10):
+        streaming.update(df.iloc[start:start + 10])
+    result = streaming.snapshot()
+    expected = st_clusters(df, 60, 60, 15)
+
+    assert len(result) == len(expected)
+    assert_clusters_equal(result.noise, expected.noise)
+    for actual, expected_cluster in zip(result.clusters, expected.clusters):
+        assert_clusters_equal(actual, expected_cluster)
+
+    # with a shorter window the snapshot clusters the points still in it
+    streaming = StreamingClusters(60, 60, 15, window_min=180)
+    for start in range(0, len(df), 10):
+        streaming.update(df.iloc[start:start + 10])
+        snapshot = streaming.snapshot()
+        pts = pd.concat([cluster.pts for cluster in snapshot.clusters] + [snapshot.noise.pts]).sort_index()
+        assert len(pts) == len(streaming)
+
+        times = pts.timestamp.values.astype('datetime64[ns]').view(np.int64)
+        graph = _neighbors_graph(pts.lat.values, pts.lon.values, times, 60, 60)
+        expected_labels = DBSCAN(eps=1, metric='precomputed', min_samples=15).fit_predict(graph)
+        assert (pts.cluster.values == expected_labels).all()
+
+    assert streaming.snapshot().clusters[-1].begin_time >= \
+        df.begin_date_time.iloc[-1] - pd.Timedelta('180 min')
+
+
+def test_cluster_tor_stats():
+    df = stormevents.load_file(resource_path('120414_tornadoes.csv'))
+    clusters = st_clusters(df, 20, 15, 5)
+
+    for cluster in clusters:
+        tor_events = cluster.events[cluster.events.event_type == 'Tornado']
+        stats = cluster.tor_stats()
+        # the precomputed per-event figures add up to the same as the cluster's events
+        assert stats == Cluster(cluster.index, cluster.pts, df).tor_stats()
+        assert stats['segments'] == len(tor_events)
+        assert stats['fatalities'] == tor_events.deaths_direct.sum()
+        assert stats['injuries'] == tor_events.injuries_direct.sum()
+
+    # fatalities counted from the fatalities table; one direct and one indirect for each death
+    killers = df[df.deaths_direct > 0]
+    fatalities = pd.DataFrame({'event_id': np.repeat(killers.event_id.values, 2 * killers.deaths_direct.values)})
+    fatalities['fatality_type'] = np.tile(['D', 'I'], len(fatalities) // 2)
+    with_table = st_clusters(df, 20, 15, 5, fatalities=fatalities)
+    assert [cluster.tor_stats() for cluster in with_table] == [cluster.tor_stats() for cluster in clusters]
+
+
 def test_lat_weighted_spread():
     ds = xr.open_dataarray(resource_path('gfs_ens_init_18090500_valid_18091300.nc'))
     ens_sd = ds.std('ens')
@@ -0,0 +1,185 @@
+import os
+import threading
+from functools import partial
+
+from http.server import BaseHTTPRequestHandler, HTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+from wxdata.http import saveall
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def file_server(tmpdir):
+    served = tmpdir.mkdir('served')
+    for i in range(6):
+        served.join('file{}.txt'.format(i)).write('contents of file {}'.format(i))
+
+    handler = partial(_QuietHandler, directory=str(served))
+    server = HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('callback_processes', [None, 2])
+def test_saveall(file_server, tmpdir, callback_processes):
+    saved = tmpdir.mkdir('saved')
+    src_dest_map = {'{}/file{}.txt'.format(file_server, i): str(saved.join('file{}.txt'.format(i)))
+                    for i in range(6)}
+    src_dest_map[file_server + '/missing.txt'] = str(saved.join('missing.txt'))
+
+    results = saveall(src_dest_map, callback=_read, max_workers=3, callback_processes=callback_processes)
+
+    assert [result.url for result in results] == list(src_dest_map.keys())
+    for i, result in enumerate(results[:-1]):
+        assert result.success
+        assert result.output == 'contents of file {}'.format(i)
+
+    missing = results[-1]
+    assert not missing.success
+    assert missing.output is None
+    assert not os.path.exists(missing.dest)
+
+    # existing files are not downloaded again
+    results = saveall(src_dest_map, callback=_read, max_workers=3, callback_processes=callback_processes)
+    assert all(not result._executed_request for result in results[:-1])
+    assert [result.output for result in results[:-1]] == ['contents of file {}'.format(i) for i in range(6)]
+
+    # nor are files without metadata whose size matches the server's, unlike truncated ones
+    os.remove(results[0].dest + '.meta')
+    os.remove(results[1].dest + '.meta')
+    with open(results[1].dest, 'w') as f:
+        f.write('contents')
+    results = saveall(src_dest_map, callback=_read, max_workers=3, callback_processes=callback_processes)
+    assert not results[0]._executed_request
+    assert os.path.exists(results[0].dest + '.meta')
+    assert results[1]._executed_request
+    assert [result.output for result in results[:-1]] == ['contents of file {}'.format(i) for i in range(6)]
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    # serves `content` with an ETag and supports Range/If-Range and If-None-Match
+    content = b'0123456789' * 1000
+    etag = '"v1"'
+    requests = []
+    # if set, the connection is closed after this many bytes of the body
+    truncate_at = None
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range', self.etag) == self.etag:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(self.content) - 1,
+                                                                     len(self.content)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.content) - start))
+        self.end_headers()
+        if self.truncate_at is not None:
+            self.wfile.write(self.content[start:start + self.truncate_at])
+            self.close_connection = True
+        else:
+            self.wfile.write(self.content[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def range_server():
+    _RangeHandler.requests = []
+    _RangeHandler.truncate_at = None
+    server = HTTPServer(('127.0.0.1', 0), _RangeHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}/data.bin'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_saveall_resumes_and_revalidates(range_server, tmpdir):
+    dest = str(tmpdir.join('data.bin'))
+    content = _RangeHandler.content
+
+    results = saveall({range_server: dest})
+    assert results[0].success
+    assert not os.path.exists(dest + '.part')
+    with open(dest, 'rb') as f:
+        assert f.read() == content
+
+    # an interrupted download is resumed from where it stopped
+    os.rename(dest, dest + '.part')
+    with open(dest + '.part', 'r+b') as f:
+        f.truncate(1234)
+    results = saveall({range_server: dest})
+    assert results[0].success
+    assert results[0].response.status_code == 206
+    assert _RangeHandler.requests[-1]['Range'] == 'bytes=1234-'
+    with open(dest, 'rb') as f:
+        assert f.read() == content
+
+    # a truncated file is not reused
+    with open(dest, 'r+b') as f:
+        f.truncate(1234)
+    results = saveall({range_server: dest})
+    assert results[0].success
+    assert results[0]._executed_request
+    with open(dest, 'rb') as f:
+        assert f.read() == content
+
+    # overriding an unchanged file only revalidates it
+    results = saveall({range_server: dest}, override_existing=True)
+    assert results[0].success
+    assert results[0].response.status_code == 304
+    with open(dest, 'rb') as f:
+        assert f.read() == content
+
+
+def test_saveall_truncated_transfer(range_server, file_server, tmpdir):
+    dest = str(tmpdir.join('data.bin'))
+    other_dest = str(tmpdir.join('file0.txt'))
+    src_dest_map = {range_server: dest, file_server + '/file0.txt': other_dest}
+
+    # a body shorter than its Content-Length fails only its own url
+    _RangeHandler.truncate_at = 5000
+    results = saveall(src_dest_map, max_workers=2)
+    assert not results[0].success
+    assert results[0].exceptions
+    assert not os.path.exists(dest)
+    assert os.path.getsize(dest + '.part') == 5000
+    assert results[1].success
+    assert _read(other_dest) == 'contents of file 0'
+
+    # and is resumed on the next try
+    _RangeHandler.truncate_at = None
+    results = saveall({range_server: dest})
+    assert results[0].success
+    assert results[0].response.status_code == 206
+    with open(dest, 'rb') as f:
+        assert f.read() == _RangeHandler.content
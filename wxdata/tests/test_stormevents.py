@@ -1,3 +1,8 @@
+import gzip
+import os
+import shutil
+import threading
+from collections import OrderedDict
 from itertools import product
 from unittest import mock
 
@@ -6,12 +11,13 @@ import numpy as np
 import pandas as pd
 import pytest
 import pytz
-from pandas.util.testing import assert_series_equal
+from pandas.util.testing import assert_frame_equal, assert_series_equal
 
 from wxdata import stormevents, workdir
 from wxdata.plotting import simple_basemap, LegendBuilder
 from wxdata.stormevents import urls_for, convert_timestamp_tz, localize_timestamp_tz
-from wxdata.stormevents.temporal import df_tz, MixedTimezoneException
+from wxdata.stormevents.temporal import (convert_row_tz, df_tz, localize_col_from_utc, sync_datetime_fields,
+                                         MixedTimezoneException)
 from wxdata.stormevents.tornprocessing import plot_time_progression, plot_tornadoes
 from wxdata.testing import resource_path, open_resource, assert_frame_eq_ignoring_dtypes
 from wxdata.utils import datetime_buckets
@@ -35,6 +41,38 @@ def test_urls_for(req):
     assert results == expected_urls
 
 
+@mock.patch('wxdata.stormevents.io.get_links')
+def test_urls_for_manifest(linkspatch, tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    listing = 'https://www1.ncdc.noaa.gov/pub/data/swdi/stormevents/csvfiles/'
+    linkspatch.return_value = [listing + link for link in (
+        'StormEvents_details-ftp_v1.0_d1990_c20170717.csv.gz',
+        'StormEvents_details-ftp_v1.0_d1991_c20160101.csv.gz',
+        'StormEvents_details-ftp_v1.0_d1991_c20170717.csv.gz',
+        'StormEvents_fatalities-ftp_v1.0_d1991_c20170717.csv.gz',
+    )]
+
+    expected = [listing + 'StormEvents_details-ftp_v1.0_d{}_c20170717.csv.gz'.format(yr) for yr in (1990, 1991)]
+    assert urls_for([1991, 1990, 1992]) == expected
+    # the listing is only fetched again once the manifest is stale
+    assert urls_for(range(1990, 1993)) == expected
+    assert linkspatch.call_count == 1
+    assert tmpdir.join('_cache', 'stormevents', 'manifest.json').check()
+    with mock.patch('wxdata.stormevents.io._MANIFEST_TTL', 0):
+        assert urls_for([1990]) == expected[:1]
+    assert linkspatch.call_count == 2
+
+    # 1991 re-issued and 1992 added
+    linkspatch.return_value = [listing + link for link in (
+        'StormEvents_details-ftp_v1.0_d1990_c20170717.csv.gz',
+        'StormEvents_details-ftp_v1.0_d1991_c20180101.csv.gz',
+        'StormEvents_details-ftp_v1.0_d1992_c20180101.csv.gz',
+    )]
+    assert stormevents.refresh_manifest() == [1991, 1992]
+    assert urls_for([1991]) == [listing + 'StormEvents_details-ftp_v1.0_d1991_c20180101.csv.gz']
+    assert stormevents.refresh_manifest() == []
+
+
 def test_convert_timestamp_tz():
     cst_tzs = ('CST-6', 'CST', 'MDT', 'Etc/GMT+6')
     gmt_tzs = ('GMT', 'UTC')
@@ -86,6 +124,26 @@ def test_localize_timestamp_tz():
                                  'CST') == pd.Timestamp('2017-01-01 18:00', tz='Etc/GMT+6')
 
 
+def test_load_file_tz_localize():
+    for src in ('stormevents_mixed_tzs_togmt.csv', 'stormevents_bad_times_corrected.csv',
+                'StormEvents_details-ftp_v1.0_d1990_c20170717.csv.gz'):
+        df = stormevents.load_file(resource_path(src))
+        localized = stormevents.load_file(resource_path(src), tz_localize=True)
+
+        for col in ('begin_date_time', 'end_date_time'):
+            expected = df.apply(lambda r: convert_timestamp_tz(r[col], 'UTC', r.cz_timezone), axis=1)
+            assert_series_equal(localized[col], expected.rename(col))
+
+    with pytest.raises(ValueError):
+        stormevents.load_file(resource_path('stormevents_mixed_tzs.csv'), tz_localize=True)
+
+    # rows without a timezone aren't silently left as NaT
+    df = stormevents.load_file(resource_path('stormevents_mixed_tzs_togmt.csv'))
+    df.loc[df.index[1], 'cz_timezone'] = np.nan
+    with pytest.raises(ValueError):
+        localize_col_from_utc(df, 'begin_date_time')
+
+
 @mock.patch('wxdata._timezones.tz_for_latlon')
 def test_convert_df_timezone(latlontz):
     def handle_latlon_tz(lat, lon):
@@ -125,6 +183,43 @@ def test_convert_df_timezone_multiple_times(latlontz):
     assert_frame_eq_ignoring_dtypes(converted_src_df, expected_df)
 
 
+@mock.patch('wxdata._timezones.tz_for_latlon')
+def test_convert_df_timezone_matches_rowwise(latlontz):
+    latlontz.return_value = pytz.timezone('Etc/GMT+5')
+    src_df = stormevents.load_file(resource_path('stormevents_mixed_tzs.csv'))
+    # bare EST, MST and HST are pytz zones with DST and LMT history of their own
+    historic = src_df.iloc[:4].copy()
+    historic['cz_timezone'] = ['MST', 'MST', 'HST', 'EST']
+    historic['state'] = ['ARIZONA', 'ARIZONA', 'HAWAII', 'FLORIDA']
+    historic['begin_date_time'] = pd.to_datetime(['1967-07-01 12:00', '1944-07-01 12:00',
+                                                  '1940-07-01 12:00', '1950-07-01 12:00'])
+    historic['end_date_time'] = historic.begin_date_time + pd.Timedelta(minutes=10)
+    src_df = pd.concat([src_df, historic], ignore_index=True)
+
+    for to_tz in ('GMT', 'CST', 'America/Chicago'):
+        converted_df = stormevents.convert_df_tz(src_df, to_tz)
+        for col in ('begin_date_time', 'end_date_time'):
+            expected = src_df.apply(lambda row: convert_row_tz(row, col, to_tz), axis=1)
+            assert converted_df[col].equals(expected)
+
+
+def test_sync_datetime_fields():
+    df = stormevents.load_file(resource_path('120414_tornadoes.csv'))
+    df['begin_date_time'] += pd.Timedelta(hours=7, minutes=5)
+    df.loc[df.index[0], 'end_date_time'] = pd.NaT
+    synced = sync_datetime_fields(df.copy(), 'EST')
+
+    for prefix in ('begin', 'end'):
+        dts = df['{}_date_time'.format(prefix)].dt
+        for col, fmt in (('{}_yearmonth', '%Y%m'), ('{}_time', '%H%M')):
+            col = col.format(prefix)
+            assert synced[col].dtype.name == 'category'
+            assert_series_equal(synced[col].astype(object), dts.strftime(fmt).rename(col))
+    assert_series_equal(synced.month_name.astype(object), df.begin_date_time.dt.strftime('%B').rename('month_name'))
+    assert (synced.begin_day == df.begin_date_time.dt.day).all()
+    assert (synced.cz_timezone == 'EST').all()
+
+
 def test_filter_df_stormtype():
     df = stormevents.load_file(resource_path('stormevents_mixed_tzs.csv'), eventtypes=['Tornado', 'Hail'])
     eventtypes = df[['event_type']]
@@ -145,13 +240,15 @@ def test_filter_df_state():
     assert len(states[states.state == 'NO']) == 0
 
 
-@mock.patch('wxdata.http.get_links', return_value=(
+@mock.patch('wxdata.stormevents.io.get_links', return_value=(
         'StormEvents_details-ftp_v1.0_d1990_c20170717.csv.gz',
         'StormEvents_details-ftp_v1.0_d1991_c20170717.csv.gz',
         'StormEvents_details-ftp_v1.0_d1992_c20170717.csv.gz',
 ))
-def test_load_multiple_years_storm_data(reqpatch):
-    workdir.setto(resource_path(''))
+def test_load_multiple_years_storm_data(reqpatch, tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    for link in reqpatch.return_value:
+        shutil.copy(resource_path(link), str(tmpdir))
     df = stormevents.load_events('1990-01-01', '1992-10-31', eventtypes=['Tornado'],
                                  states=['Texas', 'Oklahoma', 'Kansas'])
 
@@ -159,13 +256,15 @@ def test_load_multiple_years_storm_data(reqpatch):
     assert_frame_eq_ignoring_dtypes(df, df_expected)
 
 
-@mock.patch('wxdata.http.get_links', return_value=(
+@mock.patch('wxdata.stormevents.io.get_links', return_value=(
         'StormEvents_details-ftp_v1.0_d1990_c20170717.csv.gz',
         'StormEvents_details-ftp_v1.0_d1991_c20170717.csv.gz',
         'StormEvents_details-ftp_v1.0_d1992_c20170717.csv.gz',
 ))
-def test_load_multiple_years_storm_data_localize_to_tz(reqpatch):
-    workdir.setto(resource_path(''))
+def test_load_multiple_years_storm_data_localize_to_tz(reqpatch, tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    for link in reqpatch.return_value:
+        shutil.copy(resource_path(link), str(tmpdir))
     df = stormevents.load_events('1990-01-01', '1992-10-31', eventtypes=['Tornado'],
                                  states=['Texas', 'Oklahoma', 'Kansas'], tz='EST')
 
@@ -174,11 +273,13 @@ def test_load_multiple_years_storm_data_localize_to_tz(reqpatch):
     assert_frame_eq_ignoring_dtypes(df, df_expected)
 
 
-@mock.patch('wxdata.http.get_links', return_value=(
+@mock.patch('wxdata.stormevents.io.get_links', return_value=(
         'StormEvents_details-ftp_v1.0_d1991_c20170717.csv.gz',
 ))
-def test_load_two_days_storm_data_localize_to_tz(reqpatch):
-    workdir.setto(resource_path(''))
+def test_load_two_days_storm_data_localize_to_tz(reqpatch, tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    for link in reqpatch.return_value:
+        shutil.copy(resource_path(link), str(tmpdir))
     df = stormevents.load_events('1991-04-26 12:00', '1991-04-28 12:00', eventtypes=['Tornado'], tz='UTC')
 
     df_expected = stormevents.load_file(resource_path('two_day_stormevents_UTC_expected.csv'),
@@ -186,6 +287,211 @@ def test_load_two_days_storm_data_localize_to_tz(reqpatch):
     assert_frame_eq_ignoring_dtypes(df, df_expected)
 
 
+def test_load_file_from_parsed_cache(tmpdir, monkeypatch):
+    src = resource_path('StormEvents_details-ftp_v1.0_d1990_c20170717.csv.gz')
+    filters = [{}, {'eventtypes': ['Tornado'], 'states': ['Texas', 'Oklahoma'], 'months': ['May', 'June']},
+               {'columns': ['event_id', 'begin_date_time', 'tor_f_scale'], 'states': ['Kansas']},
+               # a column the file doesn't have is ignored
+               {'columns': ['event_id', 'no_such_column'], 'eventtypes': ['Hail']}]
+    # parsed from the CSV, with no work directory to cache into
+    monkeypatch.delenv(workdir.VAR, raising=False)
+    expected_dfs = [stormevents.load_file(src, **filter_kw) for filter_kw in filters]
+
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    cached_src = str(tmpdir.join(os.path.basename(src)))
+    shutil.copy(src, cached_src)
+    for filter_kw, expected in zip(filters, expected_dfs):
+        # the first load parses the CSV, the later ones read the cache
+        for _ in range(2):
+            assert_frame_eq_ignoring_dtypes(stormevents.load_file(cached_src, **filter_kw), expected)
+
+    assert os.listdir(str(tmpdir.join('_cache', 'stormevents'))) == [
+        'StormEvents_details_d1990_c20170717.parquet']
+
+    # a new revision of the file replaces the cached one
+    reissued_src = str(tmpdir.join('StormEvents_details-ftp_v1.0_d1990_c20180101.csv.gz'))
+    shutil.copy(src, reissued_src)
+    stormevents.load_file(reissued_src)
+    assert os.listdir(str(tmpdir.join('_cache', 'stormevents'))) == [
+        'StormEvents_details_d1990_c20180101.parquet']
+
+
+def test_load_file_uncacheable(tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    src = str(tmpdir.join('StormEvents_details-ftp_v1.0_d1990_c20170717.csv.gz'))
+    shutil.copy(resource_path(os.path.basename(src)), src)
+
+    # a column mixing strings and floats, which pyarrow can't store
+    read_csv = stormevents.io._read_csv
+    mixed = []
+
+    def mixed_read_csv(*args, **kwargs):
+        df = read_csv(*args, **kwargs)
+        mixed[:] = ['1K' if i % 2 else 1.5 for i in range(len(df))]
+        return df.assign(damage_property=pd.Series(mixed, index=df.index, dtype=object))
+
+    with mock.patch('wxdata.stormevents.io._read_csv', mixed_read_csv), pytest.warns(UserWarning):
+        df = stormevents.load_file(src)
+    assert df.damage_property.tolist() == mixed
+    assert not tmpdir.join('_cache', 'stormevents').check() or not tmpdir.join('_cache', 'stormevents').listdir()
+
+
+def test_load_file_pushdown_filters(tmpdir, monkeypatch):
+    src = resource_path('StormEvents_details-ftp_v1.0_d1991_c20170717.csv.gz')
+    full_df = stormevents.load_file(src)
+    expected = full_df[(full_df.state == 'TEXAS') &
+                       (full_df.begin_date_time >= pd.Timestamp('1991-04-26 12:00')) &
+                       (full_df.begin_date_time < pd.Timestamp('1991-05-28 12:00')) &
+                       (full_df.begin_time.str[:2].isin(['00', '13', '23']))]
+    filter_kw = dict(keep_data_start=pd.Timestamp('1991-04-26 12:00'), keep_data_end=pd.Timestamp('1991-05-28 12:00'),
+                     states=['Texas'], hours=[0, 13, 23])
+
+    # chunked CSV read
+    with mock.patch.dict(os.environ), mock.patch('wxdata.stormevents.io._CSV_CHUNK_ROWS', 1000):
+        os.environ.pop(workdir.VAR, None)
+        assert_frame_eq_ignoring_dtypes(stormevents.load_file(src, **filter_kw), expected)
+
+    # parsed file cache
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    cached_src = str(tmpdir.join(os.path.basename(src)))
+    shutil.copy(src, cached_src)
+    stormevents.load_file(cached_src)
+    assert_frame_eq_ignoring_dtypes(stormevents.load_file(cached_src, **filter_kw), expected)
+
+
+@mock.patch('wxdata.stormevents.io.get_links', return_value=[
+    'StormEvents_locations-ftp_v1.0_d2012_c20170717.csv.gz',
+    'StormEvents_fatalities-ftp_v1.0_d2012_c20170717.csv.gz',
+])
+def test_load_locations_and_fatalities(linkspatch, tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    df = stormevents.load_file(resource_path('120414_tornadoes.csv'))
+
+    # every tornado goes straight from its begin to its end point, except one that bends north
+    tor = df[df.end_date_time - df.begin_date_time > pd.Timedelta('20 min')].iloc[0]
+    others = df[df.event_id != tor.event_id]
+    mid_lat, mid_lon = (tor.begin_lat + tor.end_lat) / 2 + 0.2, (tor.begin_lon + tor.end_lon) / 2
+    locations = pd.DataFrame({
+        'EPISODE_ID': np.concatenate([np.repeat(others.episode_id.values, 2), [tor.episode_id] * 3]),
+        'EVENT_ID': np.concatenate([np.repeat(others.event_id.values, 2), [tor.event_id] * 3]),
+        'LOCATION_INDEX': np.concatenate([np.tile([2, 1], len(others)), [3, 1, 2]]),
+        'LATITUDE': np.concatenate([np.c_[others.end_lat, others.begin_lat].ravel(),
+                                    [tor.end_lat, tor.begin_lat, mid_lat]]),
+        'LONGITUDE': np.concatenate([np.c_[others.end_lon, others.begin_lon].ravel(),
+                                     [tor.end_lon, tor.begin_lon, mid_lon]]),
+    })
+    locations.to_csv(str(tmpdir.join(linkspatch.return_value[0])), index=False, compression='gzip')
+
+    killer = df[df.deaths_direct > 0].iloc[0]
+    fatalities = pd.DataFrame({'FATALITY_ID': [1, 2, 3], 'EVENT_ID': [killer.event_id] * 2 + [1],
+                               'FATALITY_TYPE': ['D', 'I', 'D'],
+                               'FATALITY_DATE': ['04/14/2012 19:00:00'] * 2 + ['01/01/2012 00:00:00']})
+    fatalities.to_csv(str(tmpdir.join(linkspatch.return_value[1])), index=False, compression='gzip')
+
+    # the first load parses and caches the file, the later ones read the cache
+    some_ids = [others.event_id.iloc[0], tor.event_id]
+    for event_ids in (some_ids, some_ids, [], None):
+        loaded = stormevents.load_locations([2012], event_ids=event_ids)
+        expected = locations.rename(columns=str.lower)
+        if event_ids is not None:
+            expected = expected[expected.event_id.isin(event_ids)].reset_index(drop=True)
+        assert_frame_equal(loaded, expected)
+    assert tmpdir.join('_cache', 'stormevents', 'StormEvents_locations_d2012_c20170717.parquet').check()
+
+    index = stormevents.EventIndex(loaded)
+    joined = index.join(df, ['state'])
+    assert len(joined) == len(locations)
+    assert (joined.state == df.set_index('event_id').state.loc[joined.event_id].values).all()
+
+    straight = stormevents.tors.discretize(df, endpoint=True)
+    along = stormevents.tors.discretize(df, endpoint=True, locations=index)
+    assert along.timestamp.equals(straight.timestamp)
+    on_others = (along.event_id != tor.event_id).values
+    assert np.allclose(along[on_others][['lat', 'lon']], straight[on_others][['lat', 'lon']])
+    bent = along[~on_others]
+    assert np.allclose(bent.iloc[[0, -1]][['lat', 'lon']], [[tor.begin_lat, tor.begin_lon], [tor.end_lat, tor.end_lon]])
+    assert abs(bent.lat.max() - mid_lat) < 0.01
+
+    loaded = stormevents.load_fatalities([2012])
+    assert loaded.fatality_date.dtype.kind == 'M'
+    totals = stormevents.fatality_totals(loaded)
+    assert totals.loc[killer.event_id].tolist() == [2, 1, 1]
+    assert totals.loc[1].tolist() == [1, 1, 0]
+
+
+def test_load_file_compact(tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    # the 2012 tornadoes under an NCEI yearly file name, so that they're cached
+    src = str(tmpdir.join('StormEvents_details-ftp_v1.0_d2012_c20170717.csv.gz'))
+    with open_resource('120414_tornadoes.csv', 'rb') as f, gzip.open(src, 'wb') as out:
+        shutil.copyfileobj(f, out)
+
+    full_df = stormevents.load_file(src)
+    df = stormevents.load_file(src, compact=True)
+
+    narratives = ['episode_narrative', 'event_narrative']
+    assert not any(col in df.columns for col in narratives)
+    assert_frame_eq_ignoring_dtypes(df, full_df.drop(columns=narratives))
+    assert df.event_type.dtype.name == 'category'
+    assert df.tor_length.dtype == np.float32
+    assert df.begin_lat.dtype == np.float64
+    # the cached read builds the same frame as compacting the full one
+    assert_frame_equal(df, stormevents.compact_events(full_df), check_categorical=False)
+    assert df.memory_usage(deep=True).sum() < full_df.memory_usage(deep=True).sum() / 4
+    assert_frame_equal(stormevents.tors.discretize(df), stormevents.tors.discretize(full_df), check_dtype=False)
+
+    # narratives are fetched by event id
+    fetched = stormevents.event_narratives(df.event_id[::-1])
+    assert_frame_equal(fetched, full_df.set_index('event_id')[narratives].iloc[::-1])
+    assert stormevents.event_narratives([df.event_id.iloc[0]], years=[2011]).isnull().all().all()
+
+    # unless they're asked for
+    df = stormevents.load_file(src, compact=True, columns=['event_id', 'event_narrative'])
+    assert df.event_narrative.equals(full_df.event_narrative)
+
+
+@mock.patch('wxdata.stormevents.io.get_links', return_value=[
+    'StormEvents_details-ftp_v1.0_d1990_c20170717.csv.gz',
+    'StormEvents_details-ftp_v1.0_d1991_c20170717.csv.gz',
+    'StormEvents_details-ftp_v1.0_d1992_c20170717.csv.gz',
+])
+def test_iter_events(linkspatch, tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    for link in linkspatch.return_value:
+        shutil.copy(resource_path(link), str(tmpdir))
+
+    chunks = list(stormevents.iter_events('1990-03-01', '1992-10-31', eventtypes=['Tornado'],
+                                          states=['Texas', 'Oklahoma', 'Kansas']))
+    assert [chunk.year.unique().tolist() for chunk in chunks] == [[1990], [1991], [1992]]
+
+    # the next year is loaded while the current one is being consumed
+    bulksave = stormevents.io.bulksave
+    prefetching = threading.Event()
+
+    def watched_bulksave(links, **kwargs):
+        if any('_d1991_' in link for link in links):
+            prefetching.set()
+        return bulksave(links, **kwargs)
+
+    with mock.patch('wxdata.stormevents.io.bulksave', watched_bulksave):
+        years = stormevents.iter_events('1990-03-01', '1992-10-31', eventtypes=['Tornado'])
+        assert next(years).year.unique().tolist() == [1990]
+        assert prefetching.wait(10)
+        assert len(list(years)) == 2
+
+    df = stormevents.load_events('1990-03-01', '1992-10-31', eventtypes=['Tornado'],
+                                 states=['Texas', 'Oklahoma', 'Kansas'])
+    assert_frame_eq_ignoring_dtypes(pd.concat(chunks, ignore_index=True), df)
+
+    # categoricals survive putting the years together
+    compact_df = stormevents.load_events('1990-03-01', '1992-10-31', eventtypes=['Tornado'],
+                                         states=['Texas', 'Oklahoma', 'Kansas'], compact=True)
+    assert compact_df.state.dtype.name == 'category'
+    assert_frame_eq_ignoring_dtypes(compact_df, df.drop(columns=['episode_narrative', 'event_narrative']))
+    # the listing came from the manifest after the first load
+    assert linkspatch.call_count == 1
+
+
 def test_correct_tornado_times():
     df = stormevents.load_file(resource_path('stormevents_bad_times.csv'))
     df = stormevents.tors.correct_tornado_times(df)
@@ -203,6 +509,104 @@ def test_after_tz_conversion_correct_tornado_times():
     assert_frame_eq_ignoring_dtypes(df, df_expected)
 
 
+def test_correct_tornado_times_matches_row_rules():
+    begin = pd.Timestamp('2011-04-27 15:00')
+    minutes = [-1500, -300, -60, 0, 30, 90, 150, 300, 300, 1500, 1500, None]
+    df = pd.DataFrame({
+        'event_type': ['Tornado'] * 11 + ['Hail'],
+        'begin_date_time': [begin] * 12,
+        'end_date_time': [begin + pd.Timedelta(minutes=m) if m is not None else pd.NaT for m in minutes],
+        'tor_length': [1., 1., 1., 1., 1., 5., 30., 0.1, 10., 10., np.nan, 1.]
+    })
+    df.loc[10, 'begin_date_time'] = pd.NaT
+
+    corrected = stormevents.tors.correct_tornado_times(df)
+    for row, expected in zip(corrected.itertuples(), df.values):
+        expected_begin, expected_end = stormevents.tors._corrected_times_for(expected)
+        assert row.begin_date_time is expected_begin or row.begin_date_time == expected_begin
+        assert row.end_date_time is expected_end or row.end_date_time == expected_end
+
+
+def test_filter_region():
+    from shapely.geometry import Polygon
+
+    df = pd.DataFrame({'begin_lat': [35., 36., 40., np.nan, 35.5],
+                       'begin_lon': [-97., -95., -97., -97., -99.5]})
+    # (lat, lon) vertices, like the points
+    region = Polygon([(34, -100), (37, -100), (37, -94), (34, -94)])
+    triangle = Polygon([(34, -100), (37, -100), (34, -97)])
+
+    assert list(stormevents.filter_region(df, region).index) == [0, 1, 4]
+    assert list(stormevents.filter_region(df, triangle).index) == [4]
+
+    regions = OrderedDict([('triangle', triangle), ('region', region)])
+    assert_series_equal(stormevents.assign_regions(df, regions),
+                        pd.Series([u'region', u'region', None, None, u'triangle'], name='region'))
+    assert list(stormevents.assign_regions(df, {}, unassigned='none')) == ['none'] * 5
+
+
+def test_time_partition():
+    df = stormevents.load_file(resource_path('120414_tornadoes.csv'))
+    df = df.iloc[::-1]
+    df.iloc[3, df.columns.get_loc('begin_date_time')] = pd.NaT
+    buckets = list(datetime_buckets('2012-04-14 12:00', '2012-04-15 12:00', '3 hours', tz='CST'))
+
+    partitioned = list(stormevents.time_partition(df, buckets))
+    assert [bucket for bucket, _ in partitioned] == buckets
+    for (bucket_start, bucket_end), bucket_df in partitioned:
+        expected = df[(df.begin_date_time >= bucket_start) & (df.begin_date_time < bucket_end)]
+        assert_frame_equal(bucket_df, expected)
+
+
+def test_bucket_events():
+    df = stormevents.load_file(resource_path('120414_tornadoes.csv'))
+    buckets = list(datetime_buckets('2012-04-14 12:00', '2012-04-15 12:00', '30 min', tz='CST'))
+
+    bucketed = stormevents.tors.bucket_events(df, buckets)
+    assert list(bucketed) == buckets
+    for (bucket_start, bucket_end), bucket_pts in bucketed.items():
+        expected = []
+        for _, event in df.iterrows():
+            pts = stormevents.tors.discretize_tor(event, endpoint=True)
+            pts = pts[(pts.timestamp >= bucket_start) & (pts.timestamp < bucket_end)]
+            if not pts.empty:
+                expected.append(pts)
+
+        assert len(bucket_pts) == len(expected)
+        for actual_pts, expected_pts in zip(bucket_pts, expected):
+            assert_frame_equal(actual_pts, expected_pts)
+
+
+def test_daily_totals():
+    df = stormevents.load_file(resource_path('120414_tornadoes.csv'))
+
+    for spc_day, filter_func in ((False, stormevents.filter_on_date), (True, stormevents.filter_on_spc_day)):
+        totals = stormevents.daily_totals(df, spc_day=spc_day)
+        assert list(totals.columns) == ['events', 'injuries_direct', 'injuries_indirect',
+                                        'deaths_direct', 'deaths_indirect', 'tor_length']
+        assert totals.events.sum() == len(df)
+
+        for date_, day_totals in totals.iterrows():
+            day_df = filter_func(df, date_)
+            assert day_totals.events == len(day_df)
+            assert day_totals.deaths_direct == day_df.deaths_direct.sum()
+            assert np.isclose(day_totals.tor_length, day_df.tor_length.sum())
+
+    # SPC days run 12Z to 12Z, i.e. 06:00 to 06:00 CST
+    df = pd.DataFrame({'begin_date_time': pd.to_datetime(['2012-04-14 05:30', '2012-04-14 06:30',
+                                                          '2012-04-15 05:59']),
+                       'cz_timezone': 'CST', 'deaths_direct': [1, 2, 4]})
+    expected = pd.DataFrame({'events': [1, 2], 'deaths_direct': [1, 6]},
+                            index=pd.DatetimeIndex(['2012-04-13', '2012-04-14'], name='date'))
+    assert_frame_equal(stormevents.daily_totals(df, spc_day=True), expected)
+    assert stormevents.filter_on_spc_day(df, '2012-04-14').deaths_direct.tolist() == [2, 4]
+    df['begin_date_time'] = df.begin_date_time.dt.tz_localize(pytz.FixedOffset(-360))
+    assert_frame_equal(stormevents.daily_totals(df, spc_day=True), expected)
+    assert_frame_equal(stormevents.daily_totals(df, spc_day=True, tz_localize=False), expected)
+    assert stormevents.filter_on_spc_day(df, '2012-04-14').deaths_direct.tolist() == [2, 4]
+    assert stormevents.filter_on_spc_day(df, '2012-04-13', tz_localize=False).deaths_direct.tolist() == [1]
+
+
 def test_get_longevity():
     init = pd.Timestamp('1990-01-01 00:00')
     deltas = [pd.Timedelta(hours=0), pd.Timedelta('00:01:11'), pd.Timedelta(hours=1), pd.Timedelta(minutes=45)]
@@ -311,6 +715,19 @@ def test_discretize_tor():
     assert extrapt['lon'] == tor3['begin_lon']
 
 
+def test_discretize_matches_per_tornado():
+    for src, tz_localize in (('120414_tornadoes.csv', False), ('stormevents_mixed_tzs.csv', False),
+                             ('StormEvents_details-ftp_v1.0_d1992_c20170717.csv.gz', True)):
+        df = stormevents.load_file(resource_path(src), tz_localize=tz_localize)
+        df = df[(df.end_date_time >= df.begin_date_time) & ~df.cz_timezone.isin(['UNK', 'SCT', 'CSC'])]
+
+        expected = pd.concat([stormevents.tors.discretize_tor(tor, 3) for _, tor in df.iterrows()],
+                             ignore_index=True)
+        assert_frame_equal(stormevents.tors.discretize(df, 3), expected)
+
+    assert stormevents.tors.discretize(df.iloc[:0]).empty
+
+
 @pytest.mark.mpl_image_compare
 def test_plot_tornadoes():
     fig = plt.figure()
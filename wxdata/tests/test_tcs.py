@@ -0,0 +1,192 @@
+import os
+import pickle
+from unittest import mock
+
+import geopy.distance
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.util.testing import assert_frame_equal, assert_series_equal
+
+from wxdata import geog, tcs, workdir
+
+
+def _storm(serial_num, times, **values):
+    ret = pd.DataFrame({'serial_num': serial_num, 'iso_time': pd.to_datetime(times)})
+    for col, vals in values.items():
+        ret[col] = vals
+    return ret
+
+
+def test_delta():
+    df = pd.concat([
+        _storm('2005B', ['2005-08-01 00:00', '2005-08-01 06:00', '2005-08-01 09:00', '2005-08-01 12:00'],
+               wind=[30., 35., 40., np.nan]),
+        # listed before 2005B in the frame, but comes after it in the result; note the duplicate fix
+        _storm('2005A', ['2005-07-01 00:00', '2005-07-01 06:00', '2005-07-01 06:00', '2005-07-02 00:00'],
+               wind=[50., 65., 70., 100.]),
+    ], ignore_index=True)
+    df = df.iloc[[4, 5, 6, 7, 0, 1, 2, 3]]
+
+    assert_series_equal(tcs.delta(df, 'wind'), pd.Series([15., 5., np.nan], index=[4, 0, 1]))
+    assert_series_equal(tcs.delta(df, 'wind', dt='3 hr'), pd.Series([5., np.nan], index=[1, 2]))
+    assert_series_equal(tcs.delta(df, 'wind', dt='24 hr'), pd.Series([50.], index=[4]))
+
+
+def test_label_ri():
+    day1 = ['2005-08-01 00:00', '2005-08-01 06:00', '2005-08-01 12:00', '2005-08-01 18:00']
+    df = pd.concat([
+        _storm('2005A', day1 + ['2005-08-02 00:00', '2005-08-02 06:00'], wind=[30., 40., 50., 65., 70., 70.]),
+        _storm('2005B', ['2005-09-01 00:00', '2005-09-01 12:00', '2005-09-02 00:00'], wind=[20., 20., 25.]),
+    ], ignore_index=True)
+
+    # onsets at the first two fixes, the second one's window reaches the last fix
+    assert_series_equal(tcs.label_ri(df), pd.Series([True] * 6 + [False] * 3))
+    assert 'dwind' not in df.columns
+
+    # only the first fix is an onset
+    assert_series_equal(tcs.label_ri(df, threshold=35, keep_dwind=True),
+                        pd.Series([True] * 5 + [False] * 4))
+    assert_series_equal(df.dwind, pd.Series([40., 30.] + [np.nan] * 4 + [5., np.nan, np.nan], name='dwind'))
+
+    # a 12-hour window needs 35 kt over 12 hours
+    assert_series_equal(tcs.label_ri(df, threshold=35, window='12 hours'), pd.Series([False] * 9))
+    assert_series_equal(tcs.label_ri(df, threshold=25, window='12 hours'),
+                        pd.Series([False, True, True, True, False, False, False, False, False]))
+
+
+def test_heading():
+    df = pd.concat([
+        _storm('2005B', ['2005-08-01 00:00', '2005-08-01 06:00', '2005-08-01 12:00'],
+               latitude=[20., 20., 21.], longitude=[-60., -61., -61.], name='B', season=2005),
+        _storm('2005A', ['2005-07-01 00:00', '2005-07-01 06:00'],
+               latitude=[15., 15.5], longitude=[-40., -40.5], name='A', season=2005),
+    ], ignore_index=True)
+
+    ret = tcs.heading(df)
+    assert list(ret.columns) == ['angle', 'dist', 'name', 'season', 'iso_time', 'serial_num', 'x', 'y']
+    assert list(ret.serial_num) == ['2005A', '2005B', '2005B']
+    np.testing.assert_allclose(ret.dist, [geog.dist_between((15., -40.), (15.5, -40.5)),
+                                          geog.dist_between((20., -60.), (20., -61.)),
+                                          geog.dist_between((20., -61.), (21., -61.))])
+    np.testing.assert_allclose(ret.angle, [geog.angle_between((15., -40.), (15.5, -40.5)),
+                                           geog.angle_between((20., -60.), (20., -61.)),
+                                           geog.angle_between((20., -61.), (21., -61.))])
+
+    # due west, then due north, in knots
+    np.testing.assert_allclose(ret.x[1:], [-ret.dist[1] * 0.54 / 6, 0.], atol=1e-2)
+    np.testing.assert_allclose(ret.y[2], ret.dist[2] * 0.54 / 6)
+
+
+_IBTRACS_CSV = '''IBTrACS WMO -- Version: v03r10
+Serial_Num,Season,Num,Basin,Sub_basin,Name,ISO_time,Nature,Latitude,Longitude,Wind(WMO),Pres(WMO),Center,Wind(WMO) Percentile,Pres(WMO) Percentile,Track_type
+ N/A, Year, #, BB, BB, N/A, YYYY-MM-DD HH:MM:SS, N/A, deg_north, deg_east, kt, mb, N/A, %, %, N/A
+2005236N23285, 2005, 12, NA, MM,              KATRINA ,2005-08-23 18:00:00, TS, 23.10,-75.10,  30.0, 1008.0,atcf ,  -100.000,  -100.000,main
+2005236N23285, 2005, 12, NA, GM,              KATRINA ,2005-08-29 12:00:00, TS, 29.50,-89.60, 110.0,  920.0,atcf ,    99.000,    99.000,main
+2005289N18282, 2005, 25, NA, CS,                WILMA ,2005-10-19 12:00:00, TS, 17.30,-82.80, 150.0,  882.0,atcf ,   100.000,   100.000,main
+'''
+
+
+def test_read_ibtracs(tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    src = tmpdir.join('Year.2005.ibtracs_wmo.v03r10.csv')
+    src.write(_IBTRACS_CSV)
+
+    df = tcs._read_ibtracs(str(src))
+    assert list(df.columns) == ['serial_num', 'season', 'num', 'basin', 'sub_basin', 'name', 'iso_time',
+                                'nature', 'latitude', 'longitude', 'wind', 'pres', 'center',
+                                'wind_percentile', 'pres_percentile', 'track_type']
+    assert list(df.serial_num) == ['2005236N23285', '2005236N23285', '2005289N18282']
+    assert list(df.name) == ['KATRINA', 'KATRINA', 'WILMA']
+    assert list(df.center) == ['atcf'] * 3
+    assert df.basin.dtype.name == 'category'
+    assert list(df.basin) == ['NA'] * 3
+    assert df.latitude.dtype == np.float32
+    assert list(df.wind) == [30., 110., 150.]
+    assert df.iso_time[1] == pd.Timestamp('2005-08-29 12:00')
+
+    # a second read comes from the binary cache, until the CSV changes
+    cache = tmpdir.join('_cache', 'ibtracs', 'Year.2005.ibtracs_wmo.v03r10.parquet')
+    assert cache.check()
+    assert_frame_equal(tcs._read_ibtracs(str(src)), df)
+
+    src.write(_IBTRACS_CSV.replace('WILMA', 'RITA'))
+    os.utime(str(src), (cache.mtime() + 10, cache.mtime() + 10))
+    assert list(tcs._read_ibtracs(str(src)).name) == ['KATRINA', 'KATRINA', 'RITA']
+
+
+def test_read_ibtracs_cache_write_fails(tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    src = tmpdir.join('Year.2005.ibtracs_wmo.v03r10.csv')
+    src.write(_IBTRACS_CSV)
+
+    # resolving the cache path doesn't create the cache directory
+    tcs._ibtracs_cache_path(str(src))
+    assert not tmpdir.join('_cache').check()
+
+    def failing_to_parquet(df, path, **kwargs):
+        with open(path, 'wb') as f:
+            f.write(b'PAR1')
+        raise IOError('disk full')
+
+    with mock.patch('pandas.DataFrame.to_parquet', failing_to_parquet), pytest.warns(UserWarning):
+        df = tcs._read_ibtracs(str(src))
+    assert list(df.name) == ['KATRINA', 'KATRINA', 'WILMA']
+    assert tmpdir.join('_cache', 'ibtracs').listdir() == []
+
+
+def test_track_index():
+    df = pd.concat([
+        _storm('A', ['2005-08-01 00:00', '2005-08-01 06:00', '2005-08-01 12:00'],
+               latitude=[20., 21., 22.], longitude=[-60., -60., -60.]),
+        _storm('B', ['2006-08-01 00:00', '2006-08-01 06:00'], latitude=[20.5, np.nan], longitude=[-61., -61.]),
+        _storm('C', ['2005-09-01 00:00', '2005-09-01 06:00'], latitude=[10., 10.], longitude=[179.5, -179.5]),
+    ], ignore_index=True)
+    index = tcs.TrackIndex(df)
+    assert len(index) == 6
+
+    assert list(index.radius(20., -60., 120.).index) == [0, 1, 3]
+    assert list(index.radius(20., -60., 120., start='2005-08-01 06:00', end='2006-01-01').index) == [1]
+    assert list(index.bbox(-61., -60., 20.5, 22.).index) == [1, 2, 3]
+    assert list(index.bbox(179., -179., 0., 20.).index) == [5, 6]
+
+    # between the two fixes of C, across the dateline
+    assert list(index.along_track([10.5, 10.5], [179., -179.], 60.).index) == [5, 6]
+    assert list(index.along_track([10.5, 10.5], [179., -179.], 50.).index) == []
+
+
+def test_track_index_buffer_edge():
+    # fixes 99.9 and 100.2 km north of an equatorial track, halfway between two of its samples
+    lon = 0.5 * 10. / 89
+    lats = np.array([99.9, 100.2]) / geopy.distance.EARTH_RADIUS * 180 / np.pi
+    df = _storm('A', ['2005-08-01 00:00', '2005-08-01 06:00', '2005-08-01 12:00'],
+                latitude=np.append(lats, 0.), longitude=[lon, lon, 5.])
+    index = tcs.TrackIndex(df)
+
+    assert list(index.along_track([0., 0.], [0., 10.], 100.).index) == [0, 2]
+    assert list(index.along_track([0., 0.], [0., 10.], 100., start='2005-08-01 06:00').index) == [2]
+    assert list(index.along_track([0., 0.], [0., 10.], 100., end='2005-08-01 12:00').index) == [0]
+
+
+def test_read_ibtracs_index(tmpdir, monkeypatch):
+    monkeypatch.setenv(workdir.VAR, str(tmpdir))
+    src = tmpdir.join('Year.2005.ibtracs_wmo.v03r10.csv')
+    src.write(_IBTRACS_CSV)
+
+    index = tcs._read_ibtracs_index(str(src))
+    assert tmpdir.join('_cache', 'ibtracs', 'Year.2005.ibtracs_wmo.v03r10.index.pkl').check()
+    assert list(index.radius(17., -83., 100.).name) == ['WILMA']
+
+    reloaded = tcs._read_ibtracs_index(str(src))
+    assert list(reloaded.radius(29.5, -89.6, 100.).name) == ['KATRINA']
+
+    # an index of an older format is refused on its own, and rebuilt when read through the cache
+    index_path = tmpdir.join('_cache', 'ibtracs', 'Year.2005.ibtracs_wmo.v03r10.index.pkl')
+    with open(str(index_path), 'wb') as f:
+        pickle.dump({'numfixes': 3, 'tree': index._tree}, f)
+    os.utime(str(index_path), (index_path.mtime() + 10, index_path.mtime() + 10))
+    with pytest.raises(ValueError):
+        tcs.TrackIndex.load(str(index_path), index.fixes)
+    rebuilt = tcs._read_ibtracs_index(str(src))
+    assert list(rebuilt.radius(29.5, -89.6, 100.).name) == ['KATRINA']
+    assert tcs.TrackIndex.load(str(index_path), index.fixes) is not None
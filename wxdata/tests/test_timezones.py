@@ -70,3 +70,31 @@ def test_utc_offset_no_dst():
     assert _tz.utc_offset_no_dst('GMT') == 0
     # Guam (Asia, on the other side of the Date Line)
     assert _tz.utc_offset_no_dst('Pacific/Guam') == 10
+
+
+def test_utc_offset_minutes():
+    # straight from the StormEvents table
+    assert _tz.utc_offset_minutes('CST') == -360
+    assert _tz.utc_offset_minutes('CST-6') == -360
+    assert _tz.utc_offset_minutes('CSt') == -360
+    assert _tz.utc_offset_minutes('GST10') == 600
+    assert _tz.utc_offset_minutes('SCT') is None
+
+    _tz.utc_offset_minutes.cache_clear()
+    # anything else is resolved once
+    assert _tz.utc_offset_minutes('Etc/GMT+3') == -180
+    assert _tz.utc_offset_minutes('Etc/GMT+3') == -180
+    # no fixed offset
+    assert _tz.utc_offset_minutes('America/Chicago') is None
+    assert _tz.utc_offset_minutes('ABC') is None
+    assert _tz.utc_offset_minutes.cache_info() == {'hits': 1, 'misses': 3, 'size': 3}
+
+
+def test_parse_tz_memoized():
+    _tz.parse_tz.cache_clear()
+    assert _tz.parse_tz('CST-6') is _tz.parse_tz('CST-6')
+    # failures are remembered too, but still raised each time
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            _tz.parse_tz('ABC')
+    assert _tz.parse_tz.cache_info() == {'hits': 2, 'misses': 2, 'size': 2}
@@ -1,10 +1,12 @@
+import dbm
 import os
+import pickle
 import shelve
 from functools import wraps
 
 import pandas as pd
 
-from wxdata import workdir, _timezones
+from wxdata import cache, workdir, _timezones
 
 
 def diff(df1, df2):
@@ -43,34 +45,71 @@ def log_if_debug(stmt, debug):
         print(stmt)
 
 
-def persistent_cache(saveloc=None, filename='cache', debug=False):
-
+def persistent_cache(saveloc=None, filename='cache', debug=False, maxsize=128, max_entries=None, ttl=None):
+    # Results are cached by the first argument in memory and in an SQLite database under `saveloc`
+    # (or the work directory). Functions using the same location and filename share the cache;
+    # `cache_info()` on a decorated function gives that cache's hit/miss counts.
     def decorator(func):
-        @wraps(func)
-        def wrapped_func(key, *args, **kwargs):
+        def get_func_cache():
             try:
                 saveloc_here = saveloc or workdir.subdir('_cache')
             except workdir.WorkDirectoryException:
-                log_if_debug('Cannot find cache location, calling real function...', debug)
-                return func(key, *args, **kwargs)
+                return None
 
-            fullpath = os.path.join(saveloc_here, filename)
+            fullpath = os.path.join(saveloc_here, filename + '.sqlite')
+            migrate = not os.path.exists(fullpath)
+            func_cache = cache.get_cache(fullpath, maxsize=maxsize, max_entries=max_entries, ttl=ttl)
+            if migrate:
+                _migrate_shelve(os.path.join(saveloc_here, filename), func_cache)
+            return func_cache
 
-            with shelve.open(fullpath) as cache:
-                if key in cache:
-                    log_if_debug('Fetching from cache for: {}'.format(key), debug)
-                    return cache[key]
-                else:
-                    log_if_debug('Calling real function for: {}'.format(key), debug)
-                    ret = func(key, *args, **kwargs)
-                    cache[key] = ret
-                    return ret
+        @wraps(func)
+        def wrapped_func(key, *args, **kwargs):
+            func_cache = get_func_cache()
+            if func_cache is None:
+                log_if_debug('Cannot find cache location, calling real function...', debug)
+                return func(key, *args, **kwargs)
 
+            ret = func_cache.get(key, _MISSING)
+            if ret is not _MISSING:
+                log_if_debug('Fetching from cache for: {}'.format(key), debug)
+                return ret
+            else:
+                log_if_debug('Calling real function for: {}'.format(key), debug)
+                ret = func(key, *args, **kwargs)
+                func_cache.set(key, ret)
+                return ret
+
+        def cache_info():
+            func_cache = get_func_cache()
+            return func_cache.stats if func_cache is not None else None
+
+        wrapped_func.cache_info = cache_info
         return wrapped_func
 
     return decorator
 
 
+def _migrate_shelve(path, func_cache):
+    # Copies the entries of the shelve file `persistent_cache` kept before it moved to SQLite.
+    # The shelve is left in place, and entries it can't unpickle are fetched again.
+    if not dbm.whichdb(path):
+        return
+    try:
+        with shelve.open(path, flag='r') as old_cache:
+            for key in list(old_cache.keys()):
+                try:
+                    value = old_cache[key]
+                except (pickle.UnpicklingError, AttributeError, ImportError, EOFError):
+                    continue
+                func_cache.disk.set(key, value)
+    except dbm.error:
+        pass
+
+
+_MISSING = object()
+
+
 # TODO: this has been moved to the geog module
 @persistent_cache(filename='cities')
 def find_latlon(loc, geocodor=None):
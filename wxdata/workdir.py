@@ -63,11 +63,13 @@ def savefile(url, in_subdir=None, override_existing=False, postsave=None):
     return saveall(src_dest_map, override_existing, postsave)[0]
 
 
-def bulksave(urls, in_subdir=None, override_existing=False, postsave=None):
+def bulksave(urls, in_subdir=None, override_existing=False, postsave=None,
+             max_workers=4, postsave_processes=None):
     src_dest_map = {}
     for url in urls:
         dest = save_dest(url, in_subdir)
         if dest:
             src_dest_map[url] = dest
 
-    return saveall(src_dest_map, override_existing, postsave)
+    return saveall(src_dest_map, override_existing, postsave,
+                   max_workers=max_workers, callback_processes=postsave_processes)